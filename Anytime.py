@@ -0,0 +1,149 @@
+"""
+Time budgets of the solvers.
+
+RTDP, LRTDP, UCT and VI are anytime algorithms: they can be stopped at any
+moment and their current values (or tree) still give a policy, the longer
+they run the better it is. Every solver accepts a deadline, which is either
+a number of seconds from the call or a Deadline object built from an
+absolute time.monotonic() timestamp (useful to share a single planning
+budget between several calls):
+
+    RTDP(s0, gamma, None, deadline=0.05)             # 50 ms from now
+    budget = Deadline(at=time.monotonic() + 0.05)
+    LRTDP(s0, gamma, epsilon, deadline=budget)
+
+The trial-based solvers (RTDP, LRTDP, UCT) check the deadline every
+CHECK_EVERY steps inside their trials (and expansions of checkSolved), so
+they overrun it by at most that many backups, even when a trial would
+never end ("Stay" forever with maxDepth=None). VI checks it every sweep and
+may overrun it by one sweep. A check is one call to time.monotonic(), and
+no call at all without a deadline: Deadline.of(None) is NEVER.
+
+When they are given a stats dictionary, they also report:
+    -"stop"    : why they stopped: "converged", "trials", "backups",
+                 "iterations" or "deadline"
+    -"elapsed" : seconds spent in the call
+and their convergence measures (residual at s0, solved fraction...).
+
+The generator versions iter_VI, iter_RTDP, iter_LRTDP and iter_UCT run the
+same loops but yield a Snapshot after every sweep (or every "every" trials),
+so the caller can watch the residual fall, hand the current policy to a
+controller, or stop on its own criterion by leaving the loop:
+
+    for snap in iter_LRTDP(s0, gamma, epsilon, deadline=0.5):
+        if snap.residual < 1e-2:
+            break
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import math
+import time
+
+CHECK_EVERY = 64         # steps of a trial between two deadline checks
+
+##-----------------------------Class definition-----------------------------##
+"""
+The objects of type Deadline have the following attributes:
+    -float start : time.monotonic() when the object was built
+    -float at    : time.monotonic() timestamp of the deadline (inf -> never)
+"""
+class Deadline:
+
+    def __init__(self, seconds=None, at=None):
+
+        self.start = time.monotonic()
+        if at is None:
+            at = math.inf if seconds is None else self.start + seconds
+        self.at = at
+
+    @staticmethod
+    def of(deadline):
+
+        """
+        This method turns the deadline argument of a solver into a Deadline:
+        None (no deadline, NEVER), a number of seconds or a Deadline.
+        """
+
+        if deadline is None:
+            return NEVER
+        if isinstance(deadline, Deadline):
+            return deadline
+        return Deadline(seconds=deadline)
+
+    def expired(self):
+        return time.monotonic() >= self.at
+
+    def remaining(self):
+        return max(0.0, self.at - time.monotonic())
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+
+"""
+The deadline that never expires, without reading the clock: the checks in the
+trials cost a method call when the solver has no deadline.
+"""
+class NoDeadline(Deadline):
+
+    def expired(self):
+        return False
+
+    def remaining(self):
+        return math.inf
+
+
+NEVER = NoDeadline()
+
+
+#----------------------------------------------------------------------------#
+"""
+The objects of type Snapshot are the progress reports of the generators:
+    -int iteration  : sweeps (VI) or trials done so far
+    -float residual : largest residual of the sweep (VI), residual at s0
+                      (RTDP, LRTDP), None for UCT
+    -float value    : current value of s0 (None if there is no s0)
+    -action         : greedy action at s0 (None for VI)
+    -float elapsed  : seconds since the generator started
+    -str stop       : None while running, why it stopped in the last one
+    -V, policy      : VI only, the current value function and policy. They
+                      are not copied (iter_VI(copy=True) does): the in-place
+                      modes keep updating them after the snapshot
+    -tree           : UCT only, the UCTTree being built
+"""
+class Snapshot:
+
+    __slots__ = ("iteration", "residual", "value", "action", "elapsed",
+                 "stop", "V", "policy", "tree")
+
+    def __init__(self, iteration, residual, value, action, elapsed,
+                 stop=None, V=None, policy=None, tree=None):
+
+        self.iteration = iteration
+        self.residual = residual
+        self.value = value
+        self.action = action
+        self.elapsed = elapsed
+        self.stop = stop
+        self.V = V
+        self.policy = policy
+        self.tree = tree
+
+    def __repr__(self):
+        return ("Snapshot(iteration=%d, residual=%s, value=%s, stop=%s)"
+                % (self.iteration, self.residual, self.value, self.stop))
+
+
+#----------------------------------------------------------------------------#
+"""
+This function writes the reason of the stop, the elapsed time (since the
+given start, a time.monotonic() value) and any other measure into the stats
+dictionary, if the caller gave one.
+"""
+def finish(stats, start, stop, **measures):
+
+    if stats is not None:
+        stats["stop"] = stop
+        stats["elapsed"] = time.monotonic() - start
+        stats.update(measures)
@@ -0,0 +1,371 @@
+"""
+This file provides a compiled version of the declarative model. The list of
+State objects produced by SSP_obstaclesModel is very comfortable to write
+solvers with, but every Bellman backup has to walk several nested dictionaries
+and dereference Python objects. This is fine for the 3x4 map, but it becomes
+the bottleneck as soon as the maze grows.
+
+The compiled model stores exactly the same information in flat NumPy arrays:
+    -succ     : int32   [S, A, K] index of the k-th successor of (s,a)
+    -prob     : float   [S, A, K] P(s'|s,a) of that successor
+    -cost     : float   [S, A, K] cost of that transition
+    -goal     : bool    [S]       True if the state is a goal
+    -obstacle : bool    [S]       True if the state is a dead-end
+
+K is the maximum number of successors of any pair state-action (3 in the
+obstacles maze). Pairs with fewer successors are padded with the state itself
+and a null probability, so they do not change any expectation.
+
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import hashlib
+import numpy as np
+from scipy import sparse
+from Sampling import aliasTable, sampleAlias, RandomStream
+
+##-------------------------------CONSTANTS----------------------------------##
+
+# Actions of the obstacles maze, in the same order used by TransCostModel
+ACTIONS = ("Stay", "North", "South", "East", "West")
+
+##-----------------------------Class definition-----------------------------##
+"""
+The objects of type CompiledModel have the following attributes:
+    -int H, W        : dimensions of the grid map
+    -tuple actions   : name of each action, actions[a] is the column a
+    -int initial     : index of the initial state
+    -arrays succ, prob, cost, goal, obstacle : see the header of this file
+"""
+class CompiledModel:
+
+    def __init__(self, H, W, succ, prob, cost, goal, obstacle,
+                 initial=0, actions=ACTIONS):
+
+        self.H = H
+        self.W = W
+        self.actions = tuple(actions)
+        self.initial = initial
+
+        self.succ = succ
+        self.prob = prob
+        self.cost = cost
+        self.goal = goal
+        self.obstacle = obstacle
+
+        # Lazily built operators (see below)
+        self._P = None
+        self._R = None
+        self._pred = None
+        self._alias = None
+
+    @property
+    def nStates(self):
+        return self.succ.shape[0]
+
+    @property
+    def nActions(self):
+        return self.succ.shape[1]
+
+    #-------------------------------------------------------------------------
+    def fingerprint(self):
+
+        """
+        This method returns the SHA-256 (hex string) of the model: the grid
+        size, the actions, the masks and the transitions in a canonical form,
+        so the same maze gives the same fingerprint whichever way it was
+        built. The slots of null probability (padding) are dropped and the
+        transitions of each pair state-action are sorted by successor,
+        probability and cost, in canonical dtypes (int32 successors, float32
+        probabilities and costs): the slot layout of the builder does not
+        matter. It is recomputed on every call, the arrays may have been
+        updated.
+        """
+
+        S, A, K = self.succ.shape
+        succ = np.asarray(self.succ, dtype=np.int32).reshape(S*A, K)
+        prob = np.asarray(self.prob, dtype=np.float32).reshape(S*A, K)
+        cost = np.asarray(self.cost, dtype=np.float32).reshape(S*A, K)
+
+        pair, slot = np.nonzero(prob > 0)
+        succ, prob, cost = succ[pair, slot], prob[pair, slot], cost[pair, slot]
+        order = np.lexsort((cost, prob, succ, pair))
+        counts = np.bincount(pair, minlength=S*A).astype(np.int32)
+
+        digest = hashlib.sha256()
+        digest.update(np.array([self.H, self.W], dtype=np.int64).tobytes())
+        digest.update(",".join(self.actions).encode())
+
+        for array, dtype in ((self.goal, np.bool_), (self.obstacle, np.bool_),
+                             (counts, np.int32), (succ[order], np.int32),
+                             (prob[order], np.float32),
+                             (cost[order], np.float32)):
+            digest.update(memoryview(np.ascontiguousarray(array, dtype=dtype)
+                                     ).cast("B"))
+
+        return digest.hexdigest()
+
+    #-------------------------------------------------------------------------
+    def transitionMatrix(self):
+
+        """
+        This method returns the transition model as a CSR matrix of shape
+        [S*A, S]. The row s*A + a holds P(.|s,a), which means that the block
+        of rows of the action a is the classical matrix P_a. Stacking all the
+        actions allows the Bellman backup of every pair state-action with a
+        single sparse matrix-vector product.
+        """
+
+        if self._P is None:
+
+            S, A, K = self.succ.shape
+            indptr = np.arange(0, S*A*K + 1, K, dtype=np.int64)
+            self._P = sparse.csr_matrix(
+                (self.prob.ravel().astype(np.float64),
+                 self.succ.ravel(), indptr), shape=(S*A, S), copy=True)
+            self._P.sum_duplicates()     # merge padded entries (in place,
+                                         # hence the copy of succ above)
+            self._P.eliminate_zeros()
+
+        return self._P
+
+    #-------------------------------------------------------------------------
+    def expectedCost(self):
+
+        """
+        This method returns the expected immediate cost of each pair
+        state-action, sum_s' P(s'|s,a) * C(s,a,s'), as an array [S, A].
+        """
+
+        if self._R is None:
+            self._R = np.einsum("sak,sak->sa",
+                                self.prob.astype(np.float64),
+                                self.cost.astype(np.float64))
+
+        return self._R
+
+    #-------------------------------------------------------------------------
+    def predecessors(self):
+
+        """
+        This method returns the PredecessorIndex of the model (see below).
+        """
+
+        if self._pred is None:
+
+            S, A, K = self.succ.shape
+            mask = self.prob.ravel() > 0
+            slot = np.flatnonzero(mask)
+            self._pred = PredecessorIndex(S, self.succ.ravel()[mask],
+                                          slot // (A*K), (slot // K) % A,
+                                          self.prob.ravel()[mask])
+
+        return self._pred
+
+    #-------------------------------------------------------------------------
+    def aliasTables(self):
+
+        """
+        This method returns the alias tables (threshold, alias) of every pair
+        state-action, both of shape [S, A, K]. See Sampling.py.
+        """
+
+        if self._alias is None:
+
+            S, A, K = self.succ.shape
+            threshold, alias = aliasTable(self.prob.reshape(S*A, K))
+            self._alias = (threshold.reshape(S, A, K), alias.reshape(S, A, K))
+
+        return self._alias
+
+    #-------------------------------------------------------------------------
+    def updateStates(self, idx, succ, prob, cost):
+
+        """
+        This method overwrites the transitions of the states idx (rows of
+        shape [n, A, K], e.g. computed by gridTransitions) and keeps the
+        cached operators consistent: the expected costs and the alias tables
+        are recomputed for those rows only, the sparse matrices are dropped
+        and rebuilt on the next call. The goal and obstacle masks are not
+        touched, the caller updates them.
+        """
+
+        idx = np.asarray(idx)
+        self.succ[idx] = succ
+        self.prob[idx] = prob
+        self.cost[idx] = cost
+
+        self._P = None
+        self._pred = None
+
+        if self._R is not None:
+            self._R[idx] = np.einsum("sak,sak->sa",
+                                     self.prob[idx].astype(np.float64),
+                                     self.cost[idx].astype(np.float64))
+
+        if self._alias is not None:
+            n, A, K = self.succ[idx].shape
+            threshold, alias = aliasTable(self.prob[idx].reshape(n*A, K))
+            self._alias[0][idx] = threshold.reshape(n, A, K)
+            self._alias[1][idx] = alias.reshape(n, A, K)
+
+    #-------------------------------------------------------------------------
+    def sample(self, states, actions, rng):
+
+        """
+        Batch version of State.sampleNewState: draws one successor for each
+        pair (states[n], actions[n]) with a single call to the generator.
+        inputs:
+            - int arrays states, actions : same shape
+            - rng : numpy.random.Generator or RandomStream
+        outputs:
+            - int array successors, int array k (slot of the successor, to 
+              read its probability or cost)
+        """
+
+        if isinstance(rng, RandomStream):
+            rng = rng.generator
+
+        threshold, alias = self.aliasTables()
+        S, A, K = self.succ.shape
+        pairs = np.asarray(states) * A + np.asarray(actions)
+        u = rng.random(pairs.shape)
+        k = sampleAlias(threshold.reshape(S*A, K), alias.reshape(S*A, K),
+                        pairs, u)
+
+        return self.succ.reshape(S*A, K)[pairs, k], k
+
+
+##-----------------------------Class definition-----------------------------##
+"""
+Reverse adjacency of the transition model: for every state s', the list of
+pairs (s, a) such that P(s'|s,a) > 0. It is stored in CSR format, the entries
+of the state s' are in the slice indptr[s'] : indptr[s'+1] of the arrays:
+    -int32 state    : predecessor s
+    -int8 action    : action a (column of the CompiledModel)
+    -float32 prob   : P(s'|s,a)
+
+Self-loops are included; the solvers which do not want them filter them out.
+
+Usage:
+    pred = model.predecessors()          # CompiledModel
+    pred = predecessorIndex(states)      # list of State objects
+    states, actions, probs = pred.of(s)
+"""
+class PredecessorIndex:
+
+    def __init__(self, n_states, target, state, action, prob):
+
+        # sort the entries by target state (stable -> by predecessor inside)
+        target = np.asarray(target)
+        order = np.argsort(target, kind="stable")
+        counts = np.bincount(target, minlength=n_states)
+
+        self.indptr = np.zeros(n_states + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.state = np.asarray(state, dtype=np.int32)[order]
+        self.action = np.asarray(action, dtype=np.int8)[order]
+        self.prob = np.asarray(prob, dtype=np.float32)[order]
+
+    def __len__(self):
+        return self.indptr.shape[0] - 1
+
+    def of(self, s):
+
+        lo, hi = self.indptr[s], self.indptr[s+1]
+        return self.state[lo:hi], self.action[lo:hi], self.prob[lo:hi]
+
+
+##--------------------------COMPILE A LIST OF STATES------------------------##
+"""
+This function takes the declarative model (a list of State objects whose
+transitions dictionaries are complete) and returns the equivalent
+CompiledModel. It is a single pass over the states, the order of the actions
+is the order of the keys in the transitions dictionary of the first state.
+
+inputs:
+    - list states: declarative model, states[i].number must be i
+
+output:
+    - CompiledModel
+"""
+def compileModel(states):
+
+    S = len(states)
+    actions = stateActions(states)
+    A = len(actions)
+    K = max(len(dest) for s in states for dest in s.flat)
+
+    H = max(s.vPos for s in states) + 1
+    W = max(s.hPos for s in states) + 1
+
+    # Padding: every slot points to the state itself with probability 0
+    succ = np.repeat(np.arange(S, dtype=np.int32), A*K).reshape(S, A, K)
+    prob = np.zeros((S, A, K), dtype=np.float64)
+    cost = np.zeros((S, A, K), dtype=np.float64)
+    goal = np.zeros(S, dtype=bool)
+    obstacle = np.zeros(S, dtype=bool)
+    initial = 0
+
+    for s in states:
+
+        i = s.number
+        goal[i] = s.goal
+        obstacle[i] = s.obstacle
+        if s.initial:
+            initial = i
+
+        for a, dest in enumerate(s.flat):
+            for k, (s_prime, p, c) in enumerate(dest):
+
+                succ[i, a, k] = s_prime.number
+                prob[i, a, k] = p
+                cost[i, a, k] = c
+
+    return CompiledModel(H, W, succ, prob, cost, goal, obstacle,
+                         initial=initial, actions=actions)
+
+
+#----------------------------------------------------------------------------#
+"""
+This function compiles the states that are not yet and returns the names of
+the actions, which must be the same (and in the same order) for all of them.
+"""
+def stateActions(states):
+
+    actions = None
+    for s in states:
+        if s.flat is None:
+            s.compile()
+        if s.actions is not actions and s.actions != actions:
+            if actions is not None:
+                raise ValueError("The states do not have the same actions: "
+                                 + str(actions) + " and " + str(s.actions))
+            actions = s.actions
+
+    return actions
+
+
+##-------------------PREDECESSORS OF A LIST OF STATES-----------------------##
+"""
+This function builds the PredecessorIndex of a declarative model (a list of 
+State objects) in a single pass over the transitions dictionaries.
+"""
+def predecessorIndex(states):
+
+    stateActions(states)
+    target, state, action, prob = [], [], [], []
+
+    for s in states:
+        for a, dest in enumerate(s.flat):
+            for s_prime, p, c in dest:
+
+                if p > 0:
+                    target.append(s_prime.number)
+                    state.append(s.number)
+                    action.append(a)
+                    prob.append(p)
+
+    return PredecessorIndex(len(states), np.array(target, dtype=np.int64),
+                            state, action, prob)
@@ -0,0 +1,194 @@
+"""
+Dead-end detection.
+
+A dead-end is a state from which the goal cannot be reached, whatever the
+policy. The obstacles are dead-ends by construction, but so is every free
+cell walled in by obstacles, and the solvers only know about the former:
+VI sweeps the pockets forever, the trials of RTDP and LRTDP wander in them
+until maxDepth, and UCT only stops its descents on the obstacles.
+
+The dead-ends are found by backward reachability: a breadth first search
+from the goals over the predecessor graph (PredecessorIndex) marks every
+state that reaches a goal with positive probability; the others are
+dead-ends. Following Mausam and Kolobov (finite-penalty SSP), reaching one
+of them costs a penalty: they are collapsed into a single absorbing sink
+whose every step costs penalty, so its value is penalty / (1 - gamma). The
+default penalty, obstacleCost, gives the obstacles the value they already
+had; the walled-in free cells get it too instead of the value of staying
+there forever.
+
+Usage:
+    dead = deadEnds(model)                          # bool mask [S]
+    policy, V, n, Res = VI_pruned(model, gamma, epsilon, maxIter)
+    reduced, live = reducedModel(model)             # for any solver
+    markDeadEnds(lazy, gamma)                       # RTDP / LRTDP
+    UCT_like(None, trials, model=model, deadEnds=True)
+
+The marks are not updated by Replanning.py, call markDeadEnds again after
+changing the map.
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import numpy as np
+from CompiledModel import CompiledModel
+from SSP_obstaclesModel import GenerativeModel, obstacleCost
+from ValueIteration import VI
+from Heuristics import asCompiled
+
+##--------------------------------DETECTION---------------------------------##
+"""
+inputs:
+    - model : CompiledModel, list of State objects or GenerativeModel
+output:
+    - bool array [S], True for the states that cannot reach a goal
+"""
+def deadEnds(model):
+
+    model = asCompiled(model)
+    pred = model.predecessors()
+    reach = model.goal.copy()
+    frontier = np.flatnonzero(reach)
+
+    while frontier.size:
+
+        # all the predecessors of the frontier, in one gather
+        lo, hi = pred.indptr[frontier], pred.indptr[frontier + 1]
+        counts = hi - lo
+        slots = (np.repeat(lo - np.cumsum(counts) + counts, counts)
+                 + np.arange(counts.sum()))
+
+        frontier = np.unique(pred.state[slots])
+        frontier = frontier[~reach[frontier]]
+        reach[frontier] = True
+
+    return ~reach
+
+
+"""
+This function returns the value of the sink: penalty / (1 - gamma), or the
+finite bound penalty * S when gamma = 1 (as in Heuristics.py).
+"""
+def sinkValue(penalty, gamma, S):
+
+    if gamma < 1:
+        return penalty / (1 - gamma)
+    return penalty * S
+
+##-----------------------------REDUCED MODEL--------------------------------##
+"""
+This function builds the model of the live states plus one sink. The
+transitions into a dead-end go to the sink (with their original cost), the
+sink stays in itself with cost penalty for every action. The sink is the
+last state and the only obstacle of the reduced model, which is not a grid
+any more (H = 1, W = number of states).
+inputs:
+    - model   : CompiledModel, list of State objects or GenerativeModel
+    - penalty : cost of every step in the sink
+    - dead    : bool mask of the dead-ends (computed if None)
+outputs:
+    - CompiledModel reduced
+    - int array live : live[r] is the original index of the reduced state r
+"""
+def reducedModel(model, penalty=obstacleCost, dead=None):
+
+    model = asCompiled(model)
+    if dead is None:
+        dead = deadEnds(model)
+
+    S, A, K = model.succ.shape
+    live = np.flatnonzero(~dead)
+    sink = live.shape[0]
+    newIndex = np.full(S, sink, dtype=np.int32)
+    newIndex[live] = np.arange(sink, dtype=np.int32)
+
+    succ = np.empty((sink + 1, A, K), dtype=np.int32)
+    prob = np.zeros((sink + 1, A, K), dtype=model.prob.dtype)
+    cost = np.zeros((sink + 1, A, K), dtype=model.cost.dtype)
+    succ[:sink] = newIndex[model.succ[live]]
+    prob[:sink] = model.prob[live]
+    cost[:sink] = model.cost[live]
+    succ[sink] = sink
+    prob[sink, :, 0] = 1
+    cost[sink, :, 0] = penalty
+
+    goal = np.append(model.goal[live], False)
+    obstacle = np.zeros(sink + 1, dtype=bool)
+    obstacle[sink] = True
+
+    reduced = CompiledModel(1, sink + 1, succ, prob, cost, goal, obstacle,
+                            initial=int(newIndex[model.initial]),
+                            actions=model.actions)
+
+    return reduced, live
+
+
+#----------------------------------------------------------------------------#
+"""
+VI on the live states only. Same inputs and outputs as VI (V0 defaults to
+zeros, options are the other arguments of VI), the dead-ends get the value
+of the sink and its action. stats also receives the number of "deadEnds".
+"""
+def VI_pruned(model, gamma, epsilon, maxIter, V0=None, penalty=obstacleCost,
+              dead=None, stats=None, **options):
+
+    compiled = asCompiled(model)
+    if dead is None:
+        dead = deadEnds(compiled)
+    reduced, live = reducedModel(compiled, penalty, dead)
+
+    S = compiled.nStates
+    Vsink = sinkValue(penalty, gamma, S)
+    V0 = np.zeros(live.shape[0] + 1) if V0 is None else np.append(
+        np.asarray(V0, dtype=np.float64)[live], Vsink)
+
+    policy, V, n, Res = VI(reduced, gamma, epsilon, maxIter, V0,
+                           stats=stats, **options)
+
+    # back to the original states: the dead-ends are the sink
+    fullPolicy = np.full(S, policy[-1], dtype=object)
+    fullPolicy[live] = np.asarray(policy, dtype=object)[:-1]
+    fullV = np.full(S, float(V[-1]))
+    fullV[live] = np.asarray(V)[:-1]
+    fullRes = np.zeros(S)
+    fullRes[live] = np.asarray(Res)[:-1]
+
+    if stats is not None:
+        stats["deadEnds"] = int(dead.sum())
+
+    return fullPolicy, fullV, n, fullRes
+
+##------------------------------STATE OBJECTS-------------------------------##
+"""
+This function marks the dead-ends of a model made of State objects for
+RTDP, LRTDP and UCT: deadEnd = True, the value of the sink and solved (they
+are never backed up, the trials stop on them). A GenerativeModel applies the
+marks to the states it creates later.
+inputs:
+    - model   : list of State objects or GenerativeModel
+    - gamma   : discount factor of the solver
+    - penalty : cost of every step in a dead-end
+    - dead    : bool mask of the dead-ends (computed if None)
+output:
+    - number of dead-ends
+"""
+def markDeadEnds(model, gamma, penalty=obstacleCost, dead=None):
+
+    if dead is None:
+        dead = deadEnds(model)
+    value = sinkValue(penalty, gamma, dead.shape[0])
+
+    if isinstance(model, GenerativeModel):
+        model.deadEnds = frozenset(np.flatnonzero(dead).tolist())
+        model.deadEndValue = value
+        states = model.cache.values()
+    else:
+        states = model
+
+    for s in states:
+        if dead[s.number]:
+            s.deadEnd = True
+            s.value = value
+            s.solved = True
+
+    return int(dead.sum())
@@ -0,0 +1,163 @@
+"""
+Heuristic value initialisations for the obstacles maze.
+
+RTDP and LRTDP only converge towards V* from an admissible initialisation,
+which in this repo (costs are negative rewards, the solvers maximize) means an
+upper bound: V0(s) >= V*(s). The default, V0 = 0, is admissible but blind, the
+trials wander until they stumble on the goal. These heuristics use the grid
+geometry to say how far the goal is:
+
+    -"chebyshev": d(s) = max(|di|, |dj|) to the nearest goal. Because of the
+                  slip, a single move may end in a diagonal cell, so no
+                  policy reaches the goal in fewer steps. Obstacles ignored.
+    -"relaxed"  : d(s) = shortest path to the goal in the all-outcomes
+                  determinization of the model (the agent picks the outcome
+                  of every action). A breadth first search over the reversed
+                  transition graph, it goes around the obstacles.
+
+A path of d steps pays the nominal cost on the d-1 free cells before the goal
+(and goalCost = 0 on the goal), so with any policy
+    V*(s) <= nominal * (1 - gamma^(d-1)) / (1 - gamma)       (gamma < 1)
+    V*(s) <= nominal * (d - 1)                               (gamma = 1)
+The dead-ends get their exact value, obstacleCost / (1 - gamma), and the free
+states that cannot reach the goal the value of staying forever,
+nominal / (1 - gamma). With gamma = 1 both are -inf, they get the finite
+bounds cost * S instead.
+
+Usage:
+    V0 = heuristicValues(model, gamma, "relaxed")     # array [S]
+    VI(model, gamma, epsilon, maxIter, V0)
+    UCT_like(None, trials, model=model, heuristic=V0)
+    initialValues(states, V0); LRTDP(states[0], gamma, epsilon)
+    GenerativeModel(H, W, initial, goal, obstacles, heuristic=V0)
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+from CompiledModel import CompiledModel, compileModel
+from SSP_obstaclesModel import (nominalCost, obstacleCost, compactModel,
+                                GenerativeModel)
+
+##---------------------------------DISTANCES--------------------------------##
+"""
+Both functions return a float array [S] with the number of steps from each
+state to the nearest goal (0 on the goals, inf if there is no path).
+"""
+
+def chebyshevDistance(model):
+
+    model = asCompiled(model, transitions=False)
+    S = model.H * model.W
+    rows, cols = np.divmod(np.arange(S), model.W)
+
+    d = np.full(S, np.inf)
+    for g in np.flatnonzero(model.goal):
+        gi, gj = divmod(int(g), model.W)
+        np.minimum(d, np.maximum(np.abs(rows - gi), np.abs(cols - gj)), out=d)
+
+    return d
+
+
+def relaxedDistance(model):
+
+    model = asCompiled(model)
+    S, A, K = model.succ.shape
+
+    # reversed graph: an edge s' -> s for every outcome s' of every (s,a)
+    mask = model.prob > 0
+    source = np.broadcast_to(np.arange(S)[:, None, None], (S, A, K))[mask]
+    graph = sparse.csr_matrix((np.ones(source.size), (model.succ[mask],
+                                                      source)), shape=(S, S))
+
+    return csgraph.dijkstra(graph, unweighted=True, min_only=True,
+                            indices=np.flatnonzero(model.goal))
+
+##-----------------------------------VALUES---------------------------------##
+"""
+This function turns the distances to the goal into the admissible values of
+the header. obstacle is the bool mask of the dead-ends.
+"""
+def distanceValue(d, gamma, obstacle, nominal=nominalCost,
+                  deadEnd=obstacleCost):
+
+    S = d.shape[0]
+    steps = np.maximum(d - 1, 0)
+    reachable = np.isfinite(d)
+
+    if gamma < 1:
+        V = nominal * (1 - gamma ** np.where(reachable, steps, 0)) / (1 - gamma)
+        V[~reachable] = nominal / (1 - gamma)
+        V[obstacle] = deadEnd / (1 - gamma)
+    else:
+        V = nominal * np.where(reachable, steps, 0)
+        V[~reachable] = nominal * S
+        V[obstacle] = deadEnd * S
+
+    return V
+
+
+#----------------------------------------------------------------------------#
+"""
+inputs:
+    - model : CompiledModel, GenerativeModel or list of State objects
+    - gamma : discount factor of the solver
+    - kind  : "chebyshev" or "relaxed"
+output:
+    - float array [S], an upper bound of V*, indexed by the state number
+"""
+def heuristicValues(model, gamma, kind="relaxed"):
+
+    model = asCompiled(model, transitions=(kind == "relaxed"))
+
+    if kind == "chebyshev":
+        d = chebyshevDistance(model)
+    elif kind == "relaxed":
+        d = relaxedDistance(model)
+    else:
+        raise ValueError("Unknown heuristic: " + str(kind))
+
+    return distanceValue(d, gamma, model.obstacle)
+
+
+#----------------------------------------------------------------------------#
+"""
+This function writes the heuristic into the value attribute of a list of
+State objects (for a GenerativeModel, pass heuristic=V when building it: the
+states do not exist yet).
+"""
+def initialValues(states, V):
+
+    for s in states:
+        s.value = float(V[s.number])
+
+##---------------------------------AUXILIARY--------------------------------##
+"""
+Every model type is turned into a CompiledModel. Without transitions only
+the geometry and the masks are needed, so the GenerativeModel is not
+expanded (the transitions arrays are empty).
+"""
+def asCompiled(model, transitions=True):
+
+    if isinstance(model, CompiledModel):
+        return model
+
+    if isinstance(model, GenerativeModel):
+
+        S = model.H * model.W
+        obstacles = np.zeros(S, dtype=bool)
+        obstacles[list(model.obstacles)] = True
+        if transitions:
+            return compactModel(model.H, model.W, model.initial,
+                                list(model.goals), obstacles, slip=model.slip)
+
+        goal = np.zeros(S, dtype=bool)
+        goal[list(model.goals)] = True
+        obstacles[goal] = False
+        empty = np.zeros((S, 0, 0))
+        return CompiledModel(model.H, model.W, empty.astype(np.int32), empty,
+                             empty, goal, obstacles, initial=model.initial)
+
+    return compileModel(model)
@@ -25,28 +25,65 @@ an unsolved state.
 
 """
 
-def checkSolved(s, gamma, epsilon):
+import time
+from collections import deque
+from Sampling import RandomStream
+from Anytime import CHECK_EVERY, Deadline, Snapshot, finish
+from StateClass import SOLVED, TERMINAL
+
+"""
+Membership tests: a state is in openStack or closedStack if and only if its
+attribute "mark" equals the generation of the current call. Each call (and 
+each trial) takes a new generation, so the marks never have to be cleared 
+and the test costs O(1) without allocating any set.
+
+The marks also tell which states the current run of LRTDP has touched: those
+whose mark is above runStart, the generation at the start of the run. The
+first time a state gets marked in the run it is counted in stats["touched"],
+and stats["solved"] counts the states labeled by the run.
+"""
+generation = 0
+runStart = 0
+
+def newGeneration():
+    
+    global generation
+    generation += 1
+    return generation
+
+
+def checkSolved(s, gamma, epsilon, stats=None, probe=None, deadline=None):
     
     rv = True                      # initialise the return value
-    openStack = []                 # create a list with states still unchecked
+    openStack = deque()            # states still unchecked
     closedStack = []               # create a list with already checked states
+    mark = newGeneration()         # tag of the states seen in this call
+    deadline = Deadline.of(deadline)
     
-    if not s.solved :              # if the state is not labeled solved
+    if not s.flags & SOLVED :      # if the state is not labeled solved
         
         openStack.append(s)        # add it to the list of unchecked states
+        if stats is not None and s.mark <= runStart:
+            stats["touched"] += 1
+        s.mark = mark
         
         
-    while not openStack == []:     # let's check start checking if there still
+    while openStack:               # let's check start checking if there still
                                    # something to check
         
-        last = len(openStack) -1   # take and remove the last element of the stack
-        s = openStack[last]
-        openStack.pop(last)                                                                         
+        # out of time: label nothing, the states checked so far are
+        # updated below as if one of them had not converged
+        if not len(closedStack) % CHECK_EVERY and deadline.expired():
+            rv = False
+            break
+        
+        s = openStack.pop()        # take and remove the last element of the stack
         
         closedStack.append(s)      # append that state to the already checked list
         
-        # Check the residual
-        if s.Residual(gamma) > epsilon:
+        # Check the residual (greedy action and Q-value in a single pass)
+        a, q = s.bestQ(gamma)
+        if abs(s.value - q) > epsilon:
             
             rv = False             # We have found an unconverged state.
                                    # This will finish the call to checkSolved
@@ -56,92 +93,241 @@ def checkSolved(s, gamma, epsilon):
         # The following block only applies when a converged State is found
         # Expand the state and add its successors in the greedy graph just
         # to see if the have converged too.
-        a = s.greedyAction(gamma)
-        for successor in s.transitions[a].keys():
+        for successor, p, c in s.flat[a]:
             
-            if not successor.solved and successor not in (openStack + closedStack): 
+            if not successor.flags & SOLVED and successor.mark != mark: 
+                if stats is not None and successor.mark <= runStart:
+                    stats["touched"] += 1
+                successor.mark = mark
                 openStack.append(successor)  
+    
+    if probe is not None:
+        probeCheck(probe, closedStack, rv)
                 
     if rv :   #This means that all the checked states have converged
         
         # label relevant states
         for s in closedStack:
-            s.solved = True
+            s.flags |= SOLVED
+        if stats is not None:
+            stats["solved"] += len(closedStack)
         
     else:     # the state or one of its successors have not converged
         
         # update states with residuals and ancestors
-        while not closedStack ==  []:
+        if stats is not None:
+            stats["backups"] += len(closedStack)
+            
+        while closedStack:
             
             # take and remove the last element of the stack
-            last = len(closedStack) -1   
-            s = closedStack[last]
-            closedStack.pop(last)
+            s = closedStack.pop()
             
-            s.update(gamma)
+            s.backup(gamma)
     
     return rv
 
 
-def TRIAL_LRTDP(s, gamma, epsilon):
+def TRIAL_LRTDP(s, gamma, epsilon, rng=None, maxDepth=None, stats=None,
+                probe=None, deadline=None):
+    
+    deadline = Deadline.of(deadline)
     
     # Each iteration, create an empty list to save all the states that have
     # been visited
     visited = []
+    mark = newGeneration()
+    depth = 0
+    qEvaluations = 0
+    t = probe.tic() if probe is not None else None
     
     # The trial will continue until it reaches a solved-labeled state,
     # intially only the goal is solved.
-    while not s.solved :
+    # (or until maxDepth steps, an optimal policy may "Stay" forever)
+    while not s.flags & SOLVED and depth != maxDepth :
         
         # Append the current state to the visited list
         # Be careful with cyclic transitions models -> try to append states
         # only once
-        if s not in visited :
+        if s.mark != mark :
+            if stats is not None and s.mark <= runStart:
+                stats["touched"] += 1
+            s.mark = mark
             visited.append(s)     
         
         # termination at goal and dead-ends. Equivalent to define these states
-        # as solved.
+        # as solved (markDeadEnds does label the dead-ends it finds).
         # In RTDP this was in the while condition because there wasn't any
         # other stopping criteria
-        if  s.goal or s.obstacle :
+        if  s.flags & TERMINAL :
             
             break
         
+        # a trial may never end ("Stay"), check the deadline in the loop
+        if not depth % CHECK_EVERY and deadline.expired():
+            break
+        
         # Now follow the same procedure as in RTDP 
         # pick the best action and update the hash table
-        a = s.greedyAction(gamma)
-        s.update(gamma)
+        a, v, residual = s.backup(gamma)
+        depth += 1
+        if probe is not None:
+            qEvaluations += len(s.actions)
         
         # stochastically simulate next state
-        s = s.sampleNewState(a)
+        s = s.sampleNewState(a, rng)
+    
+    if stats is not None:
+        stats["backups"] += depth
+    if probe is not None:
+        probe.trial(t, depth, qEvaluations)
+        t = probe.tic()
     
     # once The trial has finished, try to label
     # the visited states in reverse order
-    while not visited == [] :
+    while visited :
         
         # take the last state of the list and remove it
-        last = len(visited) -1
-        s = visited[last]
-        visited.pop(last)
-        if not checkSolved(s, gamma, epsilon) :
+        s = visited.pop()
+        if not checkSolved(s, gamma, epsilon, stats, probe, deadline) :
             
             break # As soon as I find an unconverged state stop checking 
                   # because its ancestors won't have converged neither
-            
     
-    return
+    if probe is not None:
+        probe.toc("checkSolved", t)
+    
+    return depth
 
 
-def LRTDP(s0, gamma, epsilon):
+"""
+This function reports a call to checkSolved into the probe: the states it
+expanded (one bestQ each), and either the labels applied or the backups of
+the states that did not converge.
+"""
+def probeCheck(probe, closedStack, rv):
+    
+    expanded = len(closedStack)
+    qEvaluations = sum(len(s.actions) for s in closedStack)
+    probe.count("checkSolved")
+    probe.count("checkSolvedExpansions", expanded)
+    if rv:
+        probe.count("labels", expanded)
+        probe.count("qEvaluations", qEvaluations)
+    else:
+        probe.count("backups", expanded)
+        probe.count("qEvaluations", 2 * qEvaluations)
+
+
+"""
+LRTDP launches trials from s0 until s0 is labeled solved, or until one of the
+optional budgets is exhausted (they are checked before every trial, the
+deadline also every CHECK_EVERY steps of the trials and of checkSolved).
+inputs:
+    s0       : initial state
+    gamma    : discount factor
+    epsilon  : residual under which a state is considered converged
+    seed     : seed of the random numbers of the run
+    maxDepth : maximum length of a trial (None -> no limit)
+    deadline : seconds or Deadline (see Anytime.py)
+    maxTrials, maxBackups : trials and backups budgets (None -> no limit)
+    stats    : optional dictionary, filled with the number of "trials" and
+               "backups" performed, "stop", "elapsed", the greedy "action" at
+               s0 and its "residual", the states "touched" and "solved" by
+               this run and the "solvedFraction" solved / touched
+    probe    : optional Probe (see Probe.py), receives the counters of the
+               trials and of checkSolved, the "trialLength", the "trial" and
+               "checkSolved" timers and an event per trial
+output:
+    number of trials (the greedy action at s0 is stats["action"])
+The policy is the greedy policy of the values left in the states.
+"""
+def LRTDP(s0, gamma, epsilon, seed=None, maxDepth=None, deadline=None,
+          maxTrials=None, maxBackups=None, stats=None, probe=None):
+    
+    global runStart
+    start = time.monotonic()
+    deadline = Deadline.of(deadline)
+    counters = {} if stats is None else stats
+    counters.update(trials=0, backups=0, touched=0, solved=0)
+    runStart = generation
     
     n = 0                                 # Count iters for performances
     s = s0
+    rng = RandomStream(seed)              # random numbers of this run
+    stop = "converged"
+        
     while not s.solved :                  # launch trials until the
                                           # intial state is solved.
         
-        TRIAL_LRTDP(s, gamma, epsilon)
+        if maxTrials is not None and n >= maxTrials:
+            stop = "trials"
+            break
+        if maxBackups is not None and counters["backups"] >= maxBackups:
+            stop = "backups"
+            break
+        if deadline.expired():
+            stop = "deadline"
+            break
+        
+        depth = TRIAL_LRTDP(s, gamma, epsilon, rng, maxDepth, counters,
+                            probe, deadline)
         
         n += 1                            # Increase counter
-    print("MDP LRTDP: trials stopped, epsilon-optimal policy found")
+        counters["trials"] = n
+        if probe is not None:
+            probe.event("LRTDP", trial=n, length=depth, value=s0.value,
+                        solved=counters["solved"])
+    
+    a, q = s0.bestQ(gamma)
+    touched = counters["touched"]
+    finish(counters, start, stop, action=s0.actions[a],
+           residual=abs(s0.value - q),
+           solvedFraction=counters["solved"] / touched if touched else 1.0)
+    
+    if stop == "converged":
+        print("MDP LRTDP: trials stopped, epsilon-optimal policy found")
+    elif stop == "deadline":
+        print("MDP LRTDP: trials stopped, deadline reached")
+    else:
+        print("MDP LRTDP: trials stopped, max number of " + stop + " reached")
     return n
+
+
+"""
+Generator version of LRTDP (see Anytime.py): the same trials, with a 
+Snapshot every "every" trials and a last one, whose stop is set, when s0 is
+solved or a budget is exhausted. The inputs are the ones of LRTDP, the 
+snapshots give the value of s0, its greedy action and its residual.
+"""
+def iter_LRTDP(s0, gamma, epsilon, seed=None, maxDepth=None, deadline=None,
+               maxTrials=None, maxBackups=None, every=1):
+    
+    start = time.monotonic()
+    deadline = Deadline.of(deadline)
+    counters = {"trials": 0, "backups": 0, "touched": 0, "solved": 0}
+    rng = RandomStream(seed)
+    n = 0
+    stop = "converged" if s0.solved else None
+    while True:
+        
+        if stop is not None or (n and n % every == 0):
+            a, q = s0.bestQ(gamma)
+            yield Snapshot(n, abs(s0.value - q), s0.value, s0.actions[a],
+                           time.monotonic() - start, stop)
+        if stop is not None:
+            return
+        
+        TRIAL_LRTDP(s0, gamma, epsilon, rng, maxDepth, counters,
+                    deadline=deadline)
+        n += 1
+        
+        if s0.solved:
+            stop = "converged"
+        elif maxTrials is not None and n >= maxTrials:
+            stop = "trials"
+        elif maxBackups is not None and counters["backups"] >= maxBackups:
+            stop = "backups"
+        elif deadline.expired():
+            stop = "deadline"
         
\ No newline at end of file
@@ -0,0 +1,265 @@
+"""
+Value iteration for many goals on the same map.
+
+Several agents share an obstacle map but not their goal. Solving each goal
+on its own model repeats the same work: the models only differ around the
+goal. With the goal-free model of the map (compactModel without goal), the
+model of the goal g is obtained with two corrections:
+    -the transitions into g pay goalCost instead of the cost of arriving at
+     that cell: R_g(s,a) = R(s,a) + P(g|s,a) * (goalCost - arrival(g))
+    -g is absorbing with value goalCost / (1 - gamma) = 0, so V_g(g) is
+     pinned to 0 (its own transitions are never used)
+Everything else, the matrices P_a in particular, is shared. The value
+functions are the columns of a matrix V [S, G], and the Jacobi backup of
+all the goals is one sparse-dense product per action:
+
+    V' = max_a ( R_a + gamma * P_a @ V )      ([S, S] @ [S, G])
+
+which reads P_a once per sweep instead of once per goal and per sweep. V
+has an extra row of ones and R_a is an extra column of gamma * P_a, so each
+product gives the Q-values directly and the maximum over the actions is
+accumulated in place. The greedy actions are only computed for the goals
+that stop, from the same values (so the policy is the one of VI_sparse), and
+these goals leave the product. The goals are solved in batches of at most
+batch columns to bound the memory.
+
+Usage:
+    solution = VI_multiGoal(H, W, obstacles, goals, gamma, epsilon, maxIter)
+    solution.V[k]                         # value function of goals[k]
+    names, values = solution.query(agents, cells)
+    solution.solved                       # goals whose values converged
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import time
+import numpy as np
+from scipy import sparse
+from SSP_obstaclesModel import (compactModel, arrivalCost, goalCost,
+                                slipProb)
+from Anytime import Deadline, finish
+
+##-----------------------------Class definition-----------------------------##
+"""
+The objects of type MultiGoalSolution have the following attributes:
+    -int H, W        : dimensions of the grid map
+    -array goals     : int [G] cell of each goal
+    -tuple actions   : name of each action column
+    -array policy    : int8 [G, S] greedy action of each state for each goal
+    -array V         : float [G, S] value of each state for each goal
+    -array sweeps    : int [G] sweeps performed for each goal
+    -array solved    : bool [G] True if the values of the goal converged
+When the deadline (or maxIter) stops VI_multiGoal, the goals of the batch
+being solved keep their last values and policy (solved is False), and the
+goals of the later batches are never swept (sweeps is 0): their V = 0 and
+"Stay" policy mean nothing, so query rejects them.
+"""
+class MultiGoalSolution:
+
+    def __init__(self, H, W, goals, actions, policy, V, sweeps, solved):
+
+        self.H = H
+        self.W = W
+        self.goals = goals
+        self.actions = tuple(actions)
+        self.policy = policy
+        self.V = V
+        self.sweeps = sweeps
+        self.solved = solved
+        self.row = {int(g): k for k, g in enumerate(goals)}
+
+    def __len__(self):
+        return self.goals.shape[0]
+
+    def query(self, agents, cells):
+
+        """
+        Batched look-up of many pairs (agent, cell).
+        inputs:
+            - int array agents : row of the goal of each agent (k such that
+                                 goals[k] is its goal, see forGoals)
+            - int array cells  : state number of each agent, or a tuple of
+                                 arrays (i, j)
+        outputs:
+            - array with the action names, float array with the values
+        It raises ValueError if the goal of an agent was never swept (see
+        above).
+        """
+
+        if isinstance(cells, tuple):
+            cells = np.ravel_multi_index(cells, (self.H, self.W))
+        agents, cells = np.asarray(agents), np.asarray(cells)
+        unsolved = self.sweeps[agents] == 0
+        if unsolved.any():
+            raise ValueError("MultiGoalSolution: no values for the goals "
+                             + str(sorted(set(self.goals[agents[unsolved]]
+                                              .tolist())))
+                             + " (deadline reached before their batch)")
+        names = np.array(self.actions, dtype=object)
+
+        return names[self.policy[agents, cells]], self.V[agents, cells]
+
+    def forGoals(self, goals):
+
+        """
+        This method returns the rows of the given goal cells.
+        """
+
+        return np.array([self.row[int(g)] for g in np.atleast_1d(goals)])
+
+
+##---------------------------------AUXILIARY--------------------------------##
+"""
+This function is the Bellman backup of several goals of a chunk.
+inputs:
+    - blocks : list of the [S+1, S+1] matrices of the actions (see above)
+    - fixes  : arrays (state, action, goal of the chunk, delta) of the
+               arrival corrections
+    - Vin    : float [S+1, n] values of the goals chunk[columns], and ones
+    - greedy : also return the greedy actions
+outputs:
+    - float [S+1, n] new values, int8 [S+1, n] greedy actions (or None)
+"""
+def multiBackup(blocks, fixes, Vin, chunk, columns, greedy=False):
+
+    n = Vin.shape[1]
+    position = np.full(chunk.shape[0], -1)
+    position[columns] = np.arange(n)
+    fixState, fixAction, fixGoal, fixValue = fixes
+    keep = position[fixGoal] >= 0
+
+    best, action = None, None
+    for a, block in enumerate(blocks):
+
+        q = block @ Vin
+        sel = keep & (fixAction == a)
+        np.add.at(q, (fixState[sel], position[fixGoal[sel]]), fixValue[sel])
+
+        if best is None:
+            best = q
+            action = np.zeros(q.shape, dtype=np.int8) if greedy else None
+        elif greedy:
+            better = q > best
+            np.copyto(action, a, where=better)
+            np.copyto(best, q, where=better)
+        else:
+            np.maximum(best, q, out=best)
+
+    # the goals are absorbing with value goalCost, they "Stay"
+    best[chunk[columns], np.arange(n)] = goalCost
+    if greedy:
+        action[chunk[columns], np.arange(n)] = 0
+
+    return best, action
+
+##-------------------------------SOLVER-------------------------------------##
+"""
+inputs:
+    - int H, W       : dimensions of the grid map
+    - obstacles      : bool mask of shape [H, W] or [H*W]
+    - goals          : iterable with the cell of each goal
+    - gamma, epsilon, maxIter : as in VI (maxIter is per goal)
+    - float slip     : probability of each lateral destination
+    - int batch      : maximum number of goals solved together
+    - deadline       : seconds or Deadline (see Anytime.py), checked every
+                       sweep
+    - stats          : optional dict, filled with the "sweeps" (max over the
+                       goals), "backups" (all the goals), "stop", "elapsed",
+                       the largest "residual" and the number of "solved"
+                       goals
+output:
+    - MultiGoalSolution
+The value functions are the ones VI_sparse computes on compactModel(H, W,
+initial, goal, obstacles) for each goal.
+"""
+def VI_multiGoal(H, W, obstacles, goals, gamma, epsilon, maxIter,
+                 slip=slipProb, batch=64, deadline=None, stats=None):
+
+    start = time.monotonic()
+    deadline = Deadline.of(deadline)
+    optimality = 2*epsilon*gamma/(1-gamma)
+
+    base = compactModel(H, W, 0, [], obstacles, slip=slip)
+    S, A = base.nStates, base.nActions
+    P = base.transitionMatrix()                  # shared by all the goals
+    R = base.expectedCost()
+    arrival = arrivalCost(base.goal, base.obstacle)
+
+    # [gamma * P_a | R_a] plus a last row that keeps the row of ones of V
+    one = sparse.csr_matrix(([1.0], ([0], [S])), shape=(1, S + 1))
+    blocks = [sparse.vstack([sparse.hstack([gamma * P[a::A], R[:, a:a+1]]),
+                             one]).tocsr()
+              for a in range(A)]
+
+    goals = np.asarray(list(goals), dtype=np.int64)
+    G = goals.shape[0]
+    V = np.zeros((G, S))
+    policy = np.zeros((G, S), dtype=np.int8)
+    sweeps = np.zeros(G, dtype=np.int64)
+    residual = np.zeros(G)
+    solved = np.zeros(G, dtype=bool)
+    stop = "converged"
+
+    for b0 in range(0, G, batch):
+
+        chunk = goals[b0 : b0 + batch]
+        k = chunk.shape[0]
+
+        # arrival corrections: (state, action, goal of the chunk, delta)
+        into = P[:, chunk].tocoo()
+        fixes = (into.row // A, into.row % A, into.col,
+                 into.data * (goalCost - arrival[chunk][into.col]))
+
+        Vb = np.zeros((S + 1, k))
+        Vb[S] = 1
+        active = np.arange(k)
+        n = 0
+        while active.size:
+
+            # no copy of V while every goal of the chunk is active
+            full = active.size == k
+            Vin = Vb if full else np.ascontiguousarray(Vb[:, active])
+            Vnew = multiBackup(blocks, fixes, Vin, chunk, active)[0]
+            Res = np.abs(Vnew[:S] - Vin[:S]).max(axis=0)
+            if full:
+                Vb = Vnew
+            else:
+                Vb[:, active] = Vnew
+            sweeps[b0 + active] += 1
+            residual[b0 + active] = Res
+            n += 1
+
+            done = Res < optimality
+            solved[b0 + active[done]] = True
+            if n >= maxIter:
+                stop = "iterations"
+                done[:] = True
+            elif deadline.expired():
+                stop = "deadline"
+                done[:] = True
+
+            # greedy actions of the goals that stop, from the same values
+            if done.any():
+                policy[b0 + active[done]] = multiBackup(
+                    blocks, fixes, Vin[:, done], chunk, active[done],
+                    greedy=True)[1][:S].T
+            active = active[~done]
+
+        V[b0 : b0 + k] = Vb[:S].T
+        if stop == "deadline":
+            break
+
+    if stop == "converged":
+        print("MDP Multi-goal VI: " + str(G) + " goals, epsilon-optimal policies found")
+    elif stop == "deadline":
+        print("MDP Multi-goal VI: iterations stopped, deadline reached")
+    else:
+        print("MDP Multi-goal VI: iterations stopped, max number of iteration reached")
+
+    finish(stats, start, stop, sweeps=int(sweeps.max(initial=0)),
+           backups=int(sweeps.sum()) * S,
+           residual=float(residual.max(initial=0)),
+           solved=int(solved.sum()))
+
+    return MultiGoalSolution(H, W, goals, base.actions, policy, V, sweeps,
+                             solved)
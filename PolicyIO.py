@@ -0,0 +1,239 @@
+"""
+On-disk format of the solutions.
+
+The solvers leave their solution in memory (the policy and V lists returned
+by VI, or the value/solved attributes of the State objects for RTDP and
+LRTDP), so every restart solves again. This file saves a solution in a
+compact binary file that any process can map with numpy.memmap: loading is
+instant, the arrays are read from the page cache when they are accessed and
+a look-up by (i, j) costs O(1).
+
+Layout of the file (little endian, every block aligned to 64 bytes):
+
+    header   : 256 bytes, see HEADER (magic, version, H, W, gamma, epsilon,
+               SHA-256 of the model, names of the actions, flags)
+    actions  : int8    [H*W] column of the greedy action, -1 if unknown
+    values   : float32 [H*W] value of each state, nan if unknown
+    solved   : uint8   [ceil(H*W / 8)] packed solved labels (bit k % 8 of
+               byte k // 8, least significant first), only if FLAG_SOLVED
+
+Usage:
+    policy, V, n, Res = VI(model, gamma, epsilon, maxIter, V0)
+    savePolicy("maze.pol", policy, V, H, W, gamma, epsilon, model=model)
+
+    LRTDP(lazy.s0, gamma, epsilon)
+    saveStates("maze.pol", lazy, gamma, epsilon)
+
+    solution = loadPolicy("maze.pol")
+    solution.action(i, j), solution.value(i, j), solution.solved(i, j)
+    solution.matches(model)              # same model fingerprint?
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import math
+import numpy as np
+from CompiledModel import ACTIONS
+from Heuristics import asCompiled
+
+##-------------------------------CONSTANTS----------------------------------##
+
+MAGIC = b"OMAZEPOL"
+VERSION = 1
+FLAG_SOLVED = 1
+
+HEADER_SIZE = 256
+ALIGN = 64
+
+HEADER = np.dtype([("magic", "S8"), ("version", "<u4"), ("flags", "<u4"),
+                   ("H", "<i8"), ("W", "<i8"), ("gamma", "<f8"),
+                   ("epsilon", "<f8"), ("nActions", "<u4"), ("pad", "<u4"),
+                   ("hash", "S64"), ("actions", "S64")])
+
+##-----------------------------Class definition-----------------------------##
+"""
+The objects of type Policy are the loaded solutions, with the attributes:
+    -int H, W         : dimensions of the grid map
+    -float gamma      : discount factor of the solution
+    -float epsilon    : convergence criterion (None if the solver had none)
+    -str modelHash    : CompiledModel.fingerprint() of the model ("" unknown)
+    -tuple actions    : name of each action column
+    -array policy     : int8 [H*W] greedy action of each state (-1 unknown)
+    -array V          : float32 [H*W] value of each state
+    -array solvedBits : uint8 packed solved labels, or None
+"""
+class Policy:
+
+    def __init__(self, header, policy, V, solvedBits):
+
+        self.H = int(header["H"])
+        self.W = int(header["W"])
+        self.gamma = float(header["gamma"])
+        epsilon = float(header["epsilon"])
+        self.epsilon = None if math.isnan(epsilon) else epsilon
+        self.modelHash = header["hash"].decode()
+        self.actions = tuple(header["actions"].decode().split(","))
+
+        self.policy = policy
+        self.V = V
+        self.solvedBits = solvedBits
+
+    def __len__(self):
+        return self.H * self.W
+
+    def index(self, i, j):
+        return i * self.W + j
+
+    def action(self, i, j):
+
+        a = self.policy[i * self.W + j]
+        return None if a < 0 else self.actions[a]
+
+    def value(self, i, j):
+        return float(self.V[i * self.W + j])
+
+    def solved(self, i, j):
+
+        if self.solvedBits is None:
+            return False
+        k = i * self.W + j
+        return bool((self.solvedBits[k >> 3] >> (k & 7)) & 1)
+
+    def matches(self, model):
+        return self.modelHash == asCompiled(model).fingerprint()
+
+
+##-------------------------------SAVE---------------------------------------##
+"""
+This function writes a solution given as arrays indexed by the state number.
+inputs:
+    - str path        : file to write
+    - policy          : the action of each state, by name (the policy of VI)
+                        or by column; None or -1 for unknown states
+    - V               : the value of each state
+    - int H, W        : dimensions of the grid map
+    - float gamma     : discount factor of the solution
+    - float epsilon   : convergence criterion of the solver (None -> unknown)
+    - model           : optional, the solved model (CompiledModel, list of
+                        State objects or GenerativeModel), to store its
+                        fingerprint
+    - solved          : optional bool array [H*W] with the solved labels
+    - tuple actions   : names of the action columns
+"""
+def savePolicy(path, policy, V, H, W, gamma, epsilon=None, model=None,
+               solved=None, actions=ACTIONS):
+
+    S = H * W
+    policy = actionCodes(policy, actions)
+    V = np.asarray(V, dtype=np.float32)
+    if policy.shape != (S,) or V.shape != (S,):
+        raise ValueError("The policy and V must have H*W = " + str(S)
+                         + " entries")
+
+    header = np.zeros(1, dtype=HEADER)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["flags"] = 0 if solved is None else FLAG_SOLVED
+    header["H"], header["W"] = H, W
+    header["gamma"] = gamma
+    header["epsilon"] = math.nan if epsilon is None else epsilon
+    header["nActions"] = len(actions)
+    header["hash"] = b"" if model is None else asCompiled(model).fingerprint()
+    header["actions"] = ",".join(actions).encode()
+
+    with open(path, "wb") as f:
+
+        f.write(header.tobytes().ljust(HEADER_SIZE, b"\0"))
+        for block in (policy, V, None if solved is None else
+                      np.packbits(np.asarray(solved, dtype=bool),
+                                  bitorder="little")):
+            if block is not None:
+                f.write(block.tobytes())
+                f.write(b"\0" * (-block.nbytes % ALIGN))
+
+
+#----------------------------------------------------------------------------#
+"""
+This function writes the solution of RTDP or LRTDP, read from the State
+objects: greedy action, value and solved label of every state. The states a
+GenerativeModel has never created are saved as unknown (-1, nan), the ones
+it has not expanded keep their value but no action.
+inputs:
+    - str path : file to write
+    - model    : list of State objects or GenerativeModel
+    - gamma, epsilon : parameters of the solver
+    - bool fingerprint : store the fingerprint of the model (compiles it)
+"""
+def saveStates(path, model, gamma, epsilon=None, fingerprint=True):
+
+    if isinstance(model, list):
+        states = model
+        H = max(s.vPos for s in states) + 1
+        W = max(s.hPos for s in states) + 1
+    else:
+        states = list(model.cache.values())
+        H, W = model.H, model.W
+
+    S = H * W
+    policy = [None] * S
+    V = np.full(S, np.nan, dtype=np.float32)
+    solved = np.zeros(S, dtype=bool)
+    for s in states:
+        if getattr(s, "expanded", True):
+            policy[s.number] = s.greedyAction(gamma)
+        V[s.number] = s.value
+        solved[s.number] = s.solved
+
+    savePolicy(path, policy, V, H, W, gamma, epsilon,
+               model if fingerprint else None, solved)
+
+
+##---------------------------------AUXILIARY--------------------------------##
+"""
+This function turns a policy given by action names (None for unknown) into
+the int8 columns of the file. A policy of columns is only cast.
+"""
+def actionCodes(policy, actions):
+
+    policy = np.asarray(policy)
+    if policy.dtype.kind in "iu":
+        return policy.astype(np.int8)
+
+    codes = np.full(policy.shape, -1, dtype=np.int8)
+    for a, name in enumerate(actions):
+        codes[policy == name] = a
+
+    return codes
+
+##-------------------------------LOAD---------------------------------------##
+"""
+This function opens a solution file. With mmap (default) the arrays are
+numpy.memmap objects: nothing is read until a state is looked up. Without
+it they are read into memory.
+output:
+    - Policy
+"""
+def loadPolicy(path, mmap=True):
+
+    header = np.fromfile(path, dtype=HEADER, count=1)[0]
+    if header["magic"] != MAGIC or header["version"] != VERSION:
+        raise ValueError(str(path) + " is not a policy file (version "
+                         + str(VERSION) + ")")
+
+    S = int(header["H"]) * int(header["W"])
+    offsets = [HEADER_SIZE]
+    for nbytes in (S, 4 * S):
+        offsets.append(offsets[-1] + nbytes + (-nbytes % ALIGN))
+
+    def block(dtype, offset, count):
+        if mmap:
+            return np.memmap(path, dtype=dtype, mode="r", offset=offset,
+                             shape=(count,))
+        return np.fromfile(path, dtype=dtype, count=count, offset=offset)
+
+    policy = block(np.int8, offsets[0], S)
+    V = block("<f4", offsets[1], S)
+    solvedBits = (block(np.uint8, offsets[2], (S + 7) // 8)
+                  if header["flags"] & FLAG_SOLVED else None)
+
+    return Policy(header, policy, V, solvedBits)
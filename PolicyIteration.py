@@ -0,0 +1,240 @@
+"""
+Policy iteration and modified policy iteration.
+
+VI improves the values one Bellman backup at a time, so with gamma = 0.95
+the information needs many sweeps to cross a large maze. Policy iteration
+alternates two steps:
+    -improvement : one Bellman backup of every state, the greedy policy pi
+                   of the current values (exactly the sweep of VI)
+    -evaluation  : the values of pi, V_pi = R_pi + gamma * P_pi @ V_pi
+
+The evaluation is either "direct", the sparse linear system
+(I - gamma * P_pi) V_pi = R_pi solved by scipy.sparse.linalg.spsolve (PI),
+or "iterative", k sweeps of V <- R_pi + gamma * P_pi @ V from the values of
+the improvement (modified PI). With k = 0 modified PI is VI.
+
+The stopping rule is the one of VI: the improvement that changes no value
+by more than 2*epsilon*gamma/(1-gamma) ends the iterations and its policy is
+returned, so the policies of PI and VI have the same guarantee. gamma must be
+below 1 (I - gamma * P_pi is then always invertible, dead-ends included).
+
+Usage:
+    policy, V, n, Res = PI(states, gamma, epsilon, maxIter, V0)
+    policy, V, n, Res = PI(model, gamma, epsilon, maxIter, V0,
+                           evaluation="iterative", k=20)
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import time
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+from CompiledModel import CompiledModel, compileModel
+from ValueIteration import flatModel, stopped
+from Anytime import Deadline
+
+EVALUATIONS = ("direct", "iterative")
+
+##----------------------------Function description--------------------------##
+"""
+inputs:
+    decModel   : list of State objects (see StateClass) or CompiledModel
+    gamma      : discount factor, below 1
+    epsilon    : convergence criteria (as in VI)
+    maxIter    : budget of policy improvements
+    V0         : initialization of the value function
+    backend    : "python" walks the State objects, "sparse" compiles the
+                 model (a CompiledModel is always solved with "sparse")
+    evaluation : "direct" (PI) or "iterative" (modified PI)
+    k          : evaluation sweeps of modified PI
+    deadline   : seconds or Deadline (see Anytime.py), checked every
+                 improvement
+    stats      : optional dictionary, filled with the "iterations" (policy
+                 improvements), the "sweeps" (improvement and evaluation
+                 sweeps), the "backups" of the improvements, the linear
+                 "solves", "stop", "elapsed", the largest "residual" and the
+                 "solvedFraction" (see VI)
+    probe      : optional Probe (see Probe.py), receives the "iterations",
+                 "backups", "qEvaluations", "evaluationSweeps" and "solves",
+                 the "iteration" timer and an event per improvement
+
+outputs (as in VI):
+    policy : greedy action of each state (list of names, or array of names
+             with the sparse backend)
+    V      : values of the last improvement
+    n      : number of improvements
+    Res    : residual of each state in the last improvement
+"""
+
+def PI(decModel, gamma, epsilon, maxIter, V0, backend="python",
+       evaluation="direct", k=10, deadline=None, stats=None, probe=None):
+
+    if evaluation not in EVALUATIONS:
+        raise ValueError("PI: unknown evaluation " + repr(evaluation)
+                         + ", expected one of " + str(EVALUATIONS))
+
+    start      = time.monotonic()
+    deadline   = Deadline.of(deadline)
+    optimality = 2*epsilon*gamma/(1-gamma)       # optimality convergence criterium
+
+    if isinstance(decModel, CompiledModel) or backend == "sparse":
+
+        model = decModel if isinstance(decModel, CompiledModel) \
+            else compileModel(decModel)
+        names = np.array(model.actions, dtype=object)
+        n_states = model.nStates
+        qSweep = model.nStates * model.nActions
+        steps = sparsePolicySteps(model, gamma, V0, evaluation, k)
+
+    else:
+
+        actions, rows = flatModel(decModel)
+        names = None
+        n_states = len(rows)
+        qSweep = sum(len(row) for row in rows)
+        steps = statePolicySteps(rows, gamma, V0, evaluation, k)
+
+    direct = evaluation == "direct"
+    n = 0                                        # improvements counter
+
+    while n < maxIter :
+
+        t = probe.tic() if probe is not None else None
+        a, V, Res = next(steps)                  # evaluation + improvement
+        residual = np.max(Res)
+
+        n += 1
+        if stats is not None:
+            stats["iterations"] = n
+            stats["sweeps"] = n if direct else n + (n-1)*k
+            stats["backups"] = n*n_states
+            stats["solves"] = n-1 if direct else 0
+        if probe is not None:
+            probe.toc("iteration", t)
+            probe.count("iterations")
+            probe.count("backups", n_states)
+            probe.count("qEvaluations", qSweep)
+            if n > 1:
+                probe.count("solves" if direct else "evaluationSweeps",
+                            1 if direct else k)
+            probe.event("PI", iteration=n, residual=float(residual))
+
+        if residual < optimality:
+            stop = "converged"
+        elif n == maxIter:
+            stop = "iterations"
+        elif deadline.expired():
+            stop = "deadline"
+        else:
+            continue
+
+        stopped(stats, start, stop, Res, optimality,
+                solver="Policy Iteration" if direct
+                else "Modified Policy Iteration")
+        if names is None:
+            return [actions[x] for x in a], V, n, Res
+        return names[a], V, n, Res
+
+
+#----------------------------------------------------------------------------#
+"""
+Iterations on the State objects (rows of flatModel, see ValueIteration.py):
+every next() evaluates the policy of the previous improvement (none the
+first time, V0 is improved) and returns the greedy action numbers, the V
+and Res lists of one more improvement. Ties are broken in favour of the
+first action, as in VI.
+"""
+
+def statePolicySteps(rows, gamma, V0, evaluation, k):
+
+    n_states = len(rows)
+    V_old    = [float(v) for v in V0]
+
+    while True:
+
+        policy = [0] * n_states
+        V      = [0] * n_states
+        Res    = [0] * n_states
+
+        for s, row in enumerate(rows):
+
+            bestA = 0
+            bestQ = None
+            for a, dest in enumerate(row):
+
+                q = 0
+                for j, p, c in dest:
+                    q += p * (c + gamma * V_old[j])
+
+                if bestQ is None or q > bestQ:
+                    bestA, bestQ = a, q
+
+            policy[s], V[s] = bestA, bestQ
+            Res[s] = abs(bestQ - V_old[s])
+
+        yield policy, V, Res
+
+        chosen = [row[a] for row, a in zip(rows, policy)]
+        if evaluation == "direct":
+
+            indptr = np.cumsum([0] + [len(dest) for dest in chosen])
+            entries = [e for dest in chosen for e in dest]
+            j, p, c = zip(*entries)
+            P_pi = sparse.csr_matrix((p, j, indptr),
+                                     shape=(n_states, n_states))
+            R_pi = np.add.reduceat(np.multiply(p, c), indptr[:-1])
+            V_old = evaluatePolicy(P_pi, R_pi, gamma).tolist()
+
+        else:
+
+            for sweep in range(k):
+                V = [sum(p * (c + gamma * V[j]) for j, p, c in dest)
+                     for dest in chosen]
+            V_old = V
+
+
+#----------------------------------------------------------------------------#
+"""
+Iterations on a CompiledModel, as statePolicySteps: P_pi is the rows
+s*A + pi(s) of the stacked transition matrix (see CompiledModel), R_pi the
+expected cost of the chosen actions. Returns the greedy action columns, V and
+Res arrays.
+"""
+
+def sparsePolicySteps(model, gamma, V0, evaluation, k):
+
+    n_states   = model.nStates                   # number of states
+    n_actions  = model.nActions                  # number of actions
+    P          = model.transitionMatrix()        # stacked P_a matrices
+    R          = model.expectedCost()            # expected costs
+    rows       = np.arange(n_states)
+    V_old      = np.asarray(V0, dtype=np.float64)
+
+    while True:
+
+        # improvement: Bellman backup of every pair state-action
+        Q = R + gamma * (P @ V_old).reshape(n_states, n_actions)
+        a = Q.argmax(axis=1)
+        V = Q[rows, a]
+        Res = np.abs(V - V_old)
+
+        yield a, V, Res
+
+        P_pi = P[rows * n_actions + a]
+        R_pi = R[rows, a]
+        if evaluation == "direct":
+            V_old = evaluatePolicy(P_pi, R_pi, gamma)
+        else:
+            for sweep in range(k):
+                V = R_pi + gamma * (P_pi @ V)
+            V_old = V
+
+
+"""
+This function solves (I - gamma * P_pi) V = R_pi, the values of a policy.
+"""
+def evaluatePolicy(P_pi, R_pi, gamma):
+
+    A = sparse.identity(P_pi.shape[0], format="csc") - gamma * P_pi.tocsc()
+    return spsolve(A, np.asarray(R_pi, dtype=np.float64))
@@ -0,0 +1,140 @@
+"""
+Instrumentation of the solvers.
+
+The stats dictionaries (see Anytime.py) tell why and when a solver stopped,
+not where its time went. A Probe is a small recorder that VI, RTDP, LRTDP
+and UCT_like accept as probe=...; they report what they do into it:
+
+    -counters      : "sweeps", "trials", "backups", "qEvaluations" (one per
+                     action of each backed up or checked state), "samples"
+                     (successor draws), "checkSolved" calls and their
+                     "checkSolvedExpansions", "labels" applied, tree "nodes"
+                     created, "rollouts"...
+    -distributions : count, total, min, max and mean of a measure, e.g. the
+                     "trialLength" of every trial
+    -timers        : only with Probe(timers=True), seconds and calls of each
+                     phase ("sweep", "trial", "checkSolved", "selection",
+                     "rollout", "backpropagation")
+    -callback      : callback(solver, info) after every sweep or trial, info
+                     is a dict (iteration, residual, trial length...)
+
+Without a probe (the default) the hot loops only pay an "is not None" test
+per step; the counts of a trial are accumulated in local variables and
+reported once at its end. The timers call time.perf_counter() twice per
+phase, so they are off unless requested.
+
+Usage:
+    probe = Probe(timers=True, callback=lambda solver, info: print(info))
+    LRTDP(lazy.s0, gamma, epsilon, probe=probe)
+    probe.asDict()       -> {"counters": {...}, "distributions": {...},
+                             "timers": {...}}
+    probe.toJSON()
+
+A probe accumulates over several calls, reset() clears it. The parallel
+modes (workers) only report their totals: the counts of the worker
+processes are not sent back.
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import json
+import time
+
+##-----------------------------Class definition-----------------------------##
+"""
+The objects of type Probe have the following attributes:
+    -dict counters      : {name : int}
+    -dict distributions : {name : [count, total, min, max]}
+    -dict timers        : {name : [calls, seconds]}, None if disabled
+    -callback           : function(solver, info) or None
+"""
+class Probe:
+
+    def __init__(self, timers=False, callback=None):
+
+        self.counters = {}
+        self.distributions = {}
+        self.timers = {} if timers else None
+        self.callback = callback
+
+    def count(self, name, k=1):
+        self.counters[name] = self.counters.get(name, 0) + k
+
+    def observe(self, name, x):
+
+        d = self.distributions.get(name)
+        if d is None:
+            self.distributions[name] = [1, x, x, x]
+        else:
+            d[0] += 1
+            d[1] += x
+            if x < d[2]:
+                d[2] = x
+            if x > d[3]:
+                d[3] = x
+
+    #-------------------------------------------------------------------------
+    def tic(self):
+
+        """
+        This method starts timing a phase: it returns the current time, or
+        None when the timers are disabled (then toc does nothing).
+        """
+
+        return None if self.timers is None else time.perf_counter()
+
+    def toc(self, name, t):
+
+        if t is not None:
+            timer = self.timers.setdefault(name, [0, 0.0])
+            timer[0] += 1
+            timer[1] += time.perf_counter() - t
+
+    def trial(self, t, length, qEvaluations):
+
+        """
+        This method reports a trial of RTDP or LRTDP: a backup, its
+        Q-evaluations and a sampled successor per step.
+        """
+
+        self.toc("trial", t)
+        self.count("trials")
+        self.count("backups", length)
+        self.count("qEvaluations", qEvaluations)
+        self.count("samples", length)
+        self.observe("trialLength", length)
+
+    def event(self, solver, **info):
+
+        if self.callback is not None:
+            self.callback(solver, info)
+
+    #-------------------------------------------------------------------------
+    def asDict(self):
+
+        """
+        This method returns the recorded measures as plain Python objects
+        (JSON serialisable).
+        """
+
+        distributions = {}
+        for name, (n, total, low, high) in self.distributions.items():
+            distributions[name] = {"count": n, "total": total, "min": low,
+                                   "max": high, "mean": total / n}
+
+        timers = {}
+        for name, (calls, seconds) in (self.timers or {}).items():
+            timers[name] = {"calls": calls, "seconds": seconds}
+
+        return {"counters": dict(self.counters),
+                "distributions": distributions, "timers": timers}
+
+    def toJSON(self, **options):
+        return json.dumps(self.asDict(), **options)
+
+    def reset(self):
+
+        self.counters.clear()
+        self.distributions.clear()
+        if self.timers is not None:
+            self.timers.clear()
@@ -34,33 +34,308 @@ Drawbacks: -extremely slow convergence.
             will use one.
 
 """
+
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from Sampling import RandomStream
+from Anytime import CHECK_EVERY, Deadline, Snapshot, finish
+from StateClass import TERMINAL
  
-def TRIAL(s, gamma):
+def TRIAL(s, gamma, rng=None, maxDepth=None, probe=None, deadline=None):
     
-    while not s.goal and not s.obstacle:
+    deadline = Deadline.of(deadline)
+    depth = 0
+    qEvaluations = 0
+    t = probe.tic() if probe is not None else None
+    while not s.flags & TERMINAL and depth != maxDepth:
+        
+        # a trial may never end, so the deadline is checked in the loop
+        if not depth % CHECK_EVERY and deadline.expired():
+            break
         
         # pick the best action and update the hash
-        a = s.greedyAction(gamma)
-        s.update(gamma)
+        a, v, residual = s.backup(gamma)
+        depth += 1
+        if probe is not None:
+            qEvaluations += len(s.actions)
         
         # stochastically simulate next state
-        s = s.sampleNewState(a) 
+        s = s.sampleNewState(a, rng) 
         
+    if probe is not None:
+        probe.trial(t, depth, qEvaluations)
         
-    return
+    return depth
     
-   
-def RTDP(s0, gamma, maxTrials):
+
+"""
+inputs:
+    s0        : initial state
+    gamma     : discount factor
+    maxTrials : trials budget (None -> no limit, use a deadline)
+    seed      : seed of the random numbers of the run
+    maxDepth  : maximum length of a trial (None -> no limit). Note that the
+                optimal policy of a state may be to "Stay" forever.
+    deadline  : seconds or Deadline (see Anytime.py), checked every
+                CHECK_EVERY steps of the trials
+    maxBackups: backups budget (None -> no limit), checked every trial
+    stats     : optional dictionary, filled with the number of "trials" and
+                "backups" performed, "stop", "elapsed", the greedy "action"
+                at s0 and its "residual"
+    probe     : optional Probe (see Probe.py), receives the counters of the
+                trials, their "trialLength", the "trial" timer and an event
+                per trial
+The policy is the greedy policy of the values left in the states, the
+greedy action at s0 is stats["action"].
+"""
+def RTDP(s0, gamma, maxTrials, seed=None, maxDepth=None, deadline=None,
+         maxBackups=None, stats=None, probe=None):
     
+    start = time.monotonic()
+    deadline = Deadline.of(deadline)
     s = s0                     
     n = 0
-    while n < maxTrials :
+    backups = 0
+    rng = RandomStream(seed)   # random numbers of this run (seedable)
+    while True :
+        
+        if maxTrials is not None and n >= maxTrials:
+            stop = "trials"
+            break
+        if maxBackups is not None and backups >= maxBackups:
+            stop = "backups"
+            break
+        if deadline.expired():
+            stop = "deadline"
+            break
         
-        TRIAL(s, gamma)
+        depth = TRIAL(s, gamma, rng, maxDepth, probe, deadline)
+        backups += depth
         n += 1
+        if probe is not None:
+            probe.event("RTDP", trial=n, length=depth, value=s0.value)
+    
+    a, q = s0.bestQ(gamma)
+    finish(stats, start, stop, trials=n, backups=backups,
+           action=s0.actions[a], residual=abs(s0.value - q))
               
-    print("MDP RTDP: trials stopped, max number of trials reached")
+    if stop == "deadline":
+        print("MDP RTDP: trials stopped, deadline reached")
+    else:
+        print("MDP RTDP: trials stopped, max number of " + stop + " reached")
     return
+
+
+"""
+Generator version of RTDP (see Anytime.py): the same trials, with a Snapshot
+every "every" trials and a last one, whose stop is set, when a budget is 
+exhausted. The inputs are the ones of RTDP; without any budget the trials go
+on until the caller leaves the loop. The snapshots give the value of s0, 
+its greedy action and its residual.
+"""
+def iter_RTDP(s0, gamma, maxTrials=None, seed=None, maxDepth=None,
+              deadline=None, maxBackups=None, every=1):
+    
+    start = time.monotonic()
+    deadline = Deadline.of(deadline)
+    rng = RandomStream(seed)
+    n = 0
+    backups = 0
+    stop = None
+    while True:
+        
+        if stop is not None or (n and n % every == 0):
+            a, q = s0.bestQ(gamma)
+            yield Snapshot(n, abs(s0.value - q), s0.value, s0.actions[a],
+                           time.monotonic() - start, stop)
+        if stop is not None:
+            return
+        
+        backups += TRIAL(s0, gamma, rng, maxDepth, deadline=deadline)
+        n += 1
+        
+        if maxTrials is not None and n >= maxTrials:
+            stop = "trials"
+        elif maxBackups is not None and backups >= maxBackups:
+            stop = "backups"
+        elif deadline.expired():
+            stop = "deadline"
+
+
+##----------------------------------------------------------------------------##
+"""
+Parallel RTDP. The trials of RTDP are independent simulations from s0, the
+only thing they share is the value function. This mode keeps the value 
+function of a CompiledModel in a shared memory NumPy array and runs the 
+trials concurrently in a pool of processes.
+
+There are no locks. The initial values must be an upper bound of V* (the 
+default, V0 = 0, is one because all the costs are negative) and every backup
+is written as V(s) = min(V(s), Q(s,a*)). Starting from an upper bound the 
+Bellman backups can only decrease the values, and a backup computed from 
+stale values of another process is still an upper bound, so keeping the 
+minimum never breaks admissibility whatever the interleaving of the writes.
+
+inputs:
+    model     : CompiledModel
+    gamma     : discount factor
+    maxTrials : total number of trials (split among the workers), None ->
+                no limit, use a deadline
+    workers   : number of processes (all the cores by default)
+    V0        : initial values, an upper bound of V* (zeros by default)
+    seed      : seed of the run, each worker gets an independent stream
+    maxDepth  : maximum length of a trial (dead loops on "Stay")
+    deadline  : seconds or Deadline (see Anytime.py), checked every
+                CHECK_EVERY steps of the trials
+    stats     : optional dictionary, filled as by RTDP: the total number of
+                "trials" and "backups", "stop", "elapsed", the greedy
+                "action" at s0 and its "residual" (from V), plus the
+                "workerTrials" and "workerThroughput" (trials/sec) of each
+                worker
+    probe     : optional Probe, receives the total number of "trials"
+output:
+    V : array with the value of every state (the policy is greedy in V)
+"""
+
+# Shared arrays of the worker processes: {name : NumPy view}
+workerArrays = {}
+workerBlocks = []
+
+
+def shareArray(array, blocks):
+    
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    blocks.append(shm)
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    
+    return (shm.name, array.shape, array.dtype.str)
+
+
+def attachArrays(specs):
+    
+    for name, (shmName, shape, dtype) in specs.items():
+        
+        shm = shared_memory.SharedMemory(name=shmName)
+        workerBlocks.append(shm)       # keep the block alive
+        workerArrays[name] = np.ndarray(shape, dtype=np.dtype(dtype),
+                                        buffer=shm.buf)
+
+
+def TRIAL_array(s, gamma, rng, maxDepth, deadline):
+    
+    V = workerArrays["V"]
+    succ = workerArrays["succ"]
+    prob = workerArrays["prob"]
+    cost = workerArrays["cost"]
+    terminal = workerArrays["terminal"]
+    threshold = workerArrays["threshold"]
+    alias = workerArrays["alias"]
+    K = succ.shape[2]
+    depth = 0
+    
+    while not terminal[s] and depth < maxDepth:
+        
+        if not depth % CHECK_EVERY and deadline.expired():
+            break
         
+        # greedy backup, monotone write
+        Q = (prob[s] * (cost[s] + gamma * V[succ[s]])).sum(axis=1)
+        a = Q.argmax()
+        if Q[a] < V[s]:
+            V[s] = Q[a]
         
-            
\ No newline at end of file
+        # stochastically simulate next state (alias tables)
+        x = rng.random() * K
+        k = int(x)
+        if x - k >= threshold[s, a, k]:
+            k = alias[s, a, k]
+        s = succ[s, a, k]
+        depth += 1
+    
+    return depth
+
+
+def runTrials(s0, gamma, nTrials, seed, maxDepth, deadline):
+    
+    rng = RandomStream(seed)
+    start = time.perf_counter()
+    n = 0
+    backups = 0
+    while n < nTrials and not deadline.expired():
+        backups += TRIAL_array(s0, gamma, rng, maxDepth, deadline)
+        n += 1
+        
+    return n, time.perf_counter() - start, backups
+
+
+def RTDP_parallel(model, gamma, maxTrials, workers=None, V0=None, seed=None,
+                  maxDepth=None, deadline=None, stats=None, probe=None):
+    
+    start = time.monotonic()
+    deadline = Deadline.of(deadline)   # absolute, the same for all workers
+    workers = workers or multiprocessing.cpu_count()
+    maxDepth = maxDepth or model.nStates
+    threshold, alias = model.aliasTables()
+    if V0 is None:
+        V0 = np.zeros(model.nStates)
+    
+    # Everything the workers read lives in shared memory
+    blocks = []
+    arrays = {"V"        : np.asarray(V0, dtype=np.float64),
+              "succ"     : model.succ,
+              "prob"     : model.prob,
+              "cost"     : model.cost,
+              "terminal" : model.goal | model.obstacle,
+              "threshold": threshold,
+              "alias"    : alias}
+    specs = {name: shareArray(a, blocks) for name, a in arrays.items()}
+    
+    # Split the trials and the random streams among the workers
+    if maxTrials is None:
+        chunks = [float("inf")] * workers
+    else:
+        chunks = [maxTrials // workers + (w < maxTrials % workers)
+                  for w in range(workers)]
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    
+    try:
+        with multiprocessing.Pool(workers, initializer=attachArrays,
+                                  initargs=(specs,)) as pool:
+            
+            results = pool.starmap(runTrials,
+                                   [(model.initial, gamma, chunks[w],
+                                     seeds[w], maxDepth, deadline)
+                                    for w in range(workers)])
+            
+        V = np.ndarray(arrays["V"].shape, dtype=np.float64,
+                       buffer=blocks[0].buf).copy()
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    
+    stop = "deadline" if deadline.expired() else "trials"
+    if stats is not None:
+        
+        # greedy action and residual at s0, one backup from V
+        s0, A = model.initial, model.nActions
+        Q = (model.expectedCost()[s0] + gamma
+             * (model.transitionMatrix()[s0*A : (s0+1)*A] @ V))
+        a = int(Q.argmax())
+        finish(stats, start, stop, trials=sum(r[0] for r in results),
+               backups=sum(r[2] for r in results),
+               action=model.actions[a], residual=float(abs(V[s0] - Q[a])),
+               workerTrials=[r[0] for r in results],
+               workerThroughput=[r[0] / r[1] if r[1] > 0 else 0.0
+                                 for r in results])
+    if probe is not None:
+        probe.count("trials", sum(r[0] for r in results))
+    
+    if stop == "deadline":
+        print("MDP RTDP: trials stopped, deadline reached")
+    else:
+        print("MDP RTDP: trials stopped, max number of trials reached")
+    return V
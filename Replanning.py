@@ -0,0 +1,345 @@
+"""
+Incremental replanning when the obstacle map changes.
+
+In production the map changes a few cells at a time. Rebuilding the model and
+solving again from scratch throws away the previous solution, although most
+of it is still right: the transitions of the maze only reach the 8
+neighbouring cells, so changing the cell c only changes the transitions of c
+(its flags) and of the cells around it (the cost of arriving at c). These are
+the "dirty" states, nothing else has to be regenerated.
+
+The values are then repaired starting from the dirty states, warm-started
+from the previous value function:
+
+    -CompiledModel (VI): the dirty states are backed up, and the states whose
+        value moved by more than the VI threshold put their neighbours (their
+        only possible predecessors) in the next frontier. The sweeps stop when
+        no value moves any more, so the work is proportional to the region
+        whose values really changed, not to the map.
+
+    -State objects (LRTDP): the flags and the transitions of the dirty states
+        are regenerated in place, then the solved labels are removed from the
+        dirty states and from every solved state whose greedy envelope reaches
+        one of them (the states that may have built their label on a value
+        that is going to change). LRTDP is then called again and only does
+        trials through the unlabeled region.
+
+A change is {index : kind} with kind in "obstacle", "free" or "goal".
+
+An obstacle or a removed goal only lowers V*, so the previous values stay
+admissible. A free cell (or a new goal) raises V* around it: the freed cell
+gets an admissible value (0 or a heuristic) and its predecessors lose their
+labels, but a solved state whose greedy envelope does not reach the change
+keeps its label even if the new cell would give it a shortcut. Call LRTDP on
+fresh labels when the map opens a lot.
+
+Usage:
+    policy, V, n, Res = VI(model, gamma, epsilon, maxIter, V0)
+    policy, V, rounds = replanVI(model, V, {5050: "obstacle"}, gamma,
+                                 epsilon, policy)
+
+    LRTDP(lazy.s0, gamma, epsilon)
+    replanLRTDP(lazy, {5050: "obstacle"}, gamma, epsilon)
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import time
+from collections import deque
+import numpy as np
+from SSP_obstaclesModel import (TransCostModel, GenerativeModel,
+                                gridTransitions, obstacleCost, slipProb)
+from LabeledRTDP import LRTDP
+from Anytime import finish
+
+KINDS = ("obstacle", "free", "goal")
+
+##---------------------------------AUXILIARY--------------------------------##
+"""
+This function returns the sorted indices of the cells of a H x W grid at
+Chebyshev distance <= 1 of the given cells (the cells themselves included):
+the states whose transitions may reach them.
+"""
+def neighbourhood(H, W, cells):
+
+    cells = np.asarray(cells, dtype=np.int64)
+    i, j = np.divmod(cells, W)
+
+    around = []
+    for di in (-1, 0, 1):
+        for dj in (-1, 0, 1):
+            ok = (i + di >= 0) & (i + di < H) & (j + dj >= 0) & (j + dj < W)
+            around.append(((i + di) * W + j + dj)[ok])
+
+    return np.unique(np.concatenate(around))
+
+
+def checkChanges(changes):
+
+    for index, kind in changes.items():
+        if kind not in KINDS:
+            raise ValueError("Unknown change of cell " + str(index) + ": "
+                             + str(kind))
+
+##----------------------------COMPILED MODEL--------------------------------##
+"""
+This function applies the changes to the masks of a CompiledModel and
+regenerates the transitions of the dirty states only (see updateStates).
+inputs:
+    - CompiledModel model : grid model built by compactModel
+    - dict changes        : {index : "obstacle" | "free" | "goal"}
+    - float slip          : probability of each lateral destination
+output:
+    - int array with the dirty states
+"""
+def changeCellsCompiled(model, changes, slip=slipProb):
+
+    checkChanges(changes)
+    for index, kind in changes.items():
+        model.goal[index] = kind == "goal"
+        model.obstacle[index] = kind == "obstacle"
+
+    dirty = neighbourhood(model.H, model.W, list(changes))
+    succ, prob, cost = gridTransitions(model.H, model.W, model.goal,
+                                       model.obstacle, idx=dirty, slip=slip)
+    model.updateStates(dirty, succ, prob, cost)
+
+    return dirty
+
+
+#----------------------------------------------------------------------------#
+"""
+This function is the Bellman backup of a block of states of a CompiledModel,
+with the self-loops solved exactly as in bestBackup (ValueIteration.py): the
+absorbing states get their exact value in one backup.
+outputs:
+    - int array with the greedy actions, float array with the new values
+"""
+def blockBackup(model, F, V, gamma):
+
+    succ, prob = model.succ[F], model.prob[F].astype(np.float64)
+    cost = model.cost[F].astype(np.float64)
+    loop = succ == F[:, None, None]
+
+    q = (prob * (cost + gamma * np.where(loop, 0, V[succ]))).sum(axis=2)
+    q /= 1 - gamma * (prob * loop).sum(axis=2)
+    a = q.argmax(axis=1)
+
+    return a, q[np.arange(F.shape[0]), a]
+
+
+#----------------------------------------------------------------------------#
+"""
+inputs:
+    - CompiledModel model : solved model, changed in place
+    - float array V       : its value function [S] (e.g. returned by VI),
+                            updated in place
+    - dict changes        : {index : "obstacle" | "free" | "goal"}
+    - gamma, epsilon      : the parameters of the previous VI call (gamma < 1)
+    - policy              : its policy (array of action names) updated in
+                            place. If None, a greedy policy of the whole map
+                            is computed at the end (one full backup).
+    - int maxRounds       : limit on the number of frontier sweeps
+    - dict stats          : optional, receives "rounds", "backups", "dirty",
+                            "changed" (states whose value moved) and the
+                            measures of Anytime.py
+outputs:
+    - policy, V, number of frontier sweeps
+"""
+def replanVI(model, V, changes, gamma, epsilon, policy=None, maxRounds=None,
+             slip=slipProb, stats=None):
+
+    start = time.monotonic()
+    optimality = 2*epsilon*gamma/(1-gamma)
+    names = np.array(model.actions, dtype=object)
+    dirty = changeCellsCompiled(model, changes, slip)
+
+    # Admissible restart of the cells that have been freed
+    for index, kind in changes.items():
+        if kind != "obstacle":
+            V[index] = 0
+
+    F = dirty
+    changed = np.zeros(model.nStates, dtype=bool)
+    rounds, backups = 0, 0
+    stop = "converged"
+
+    while F.size:
+
+        if maxRounds is not None and rounds >= maxRounds:
+            stop = "iterations"
+            break
+
+        a, q = blockBackup(model, F, V, gamma)
+        moved = np.abs(q - V[F]) > optimality
+        V[F] = q
+        if policy is not None:
+            policy[F] = names[a]
+
+        rounds += 1
+        backups += F.shape[0]
+        changed[F[moved]] = True
+
+        # the predecessors of the moved states are their neighbours
+        F = (neighbourhood(model.H, model.W, F[moved]) if moved.any()
+             else F[:0])
+
+    if policy is None:
+        policy = names[blockBackup(model, np.arange(model.nStates), V,
+                                   gamma)[0]]
+
+    print("MDP Replanning: " + str(rounds) + " sweeps, " + str(backups)
+          + " backups")
+    finish(stats, start, stop, rounds=rounds, backups=backups,
+           dirty=int(dirty.shape[0]), changed=int(changed.sum()))
+
+    return policy, V, rounds
+
+##------------------------------STATE OBJECTS-------------------------------##
+"""
+This function applies the changes to a model made of State objects and
+regenerates the transitions of the dirty states that already have them (the
+states that a GenerativeModel has not expanded yet will read the new map
+when they are expanded).
+inputs:
+    - model     : GenerativeModel, or list of State objects (then H, W needed)
+    - dict changes : {index : "obstacle" | "free" | "goal"}
+    - float gamma  : discount factor, to give the new obstacles their exact
+                     value obstacleCost / (1 - gamma)
+    - heuristic : optional admissible values indexed by the state number, for
+                  the freed cells (0 otherwise)
+output:
+    - list with the dirty states
+"""
+def changeCells(model, changes, gamma, H=None, W=None, slip=None,
+                heuristic=None):
+
+    checkChanges(changes)
+    lazy = isinstance(model, GenerativeModel)
+
+    if lazy:
+        H, W = model.H, model.W
+        slip = model.slip
+        obstacles, goals = set(model.obstacles), set(model.goals)
+        for index, kind in changes.items():
+            obstacles.discard(index)
+            goals.discard(index)
+            if kind == "obstacle":
+                obstacles.add(index)
+            elif kind == "goal":
+                goals.add(index)
+        model.obstacles, model.goals = frozenset(obstacles), frozenset(goals)
+        model.goal = sorted(goals)
+    elif slip is None:
+        slip = slipProb
+
+    for index, kind in changes.items():
+
+        s = model.cache.get(index) if lazy else model[index]
+        if s is None:
+            continue
+
+        s.goal = kind == "goal"
+        s.obstacle = kind == "obstacle"
+        if s.obstacle:
+            if gamma < 1:
+                s.value = obstacleCost / (1 - gamma)
+        elif s.goal:
+            s.value = 0
+        else:
+            s.value = 0 if heuristic is None else float(heuristic[index])
+
+    dirty = []
+    for index in neighbourhood(H, W, list(changes)):
+
+        s = model.cache.get(int(index)) if lazy else model[index]
+        if s is not None and (not lazy or s.expanded):
+            dirty.append(s)
+
+    TransCostModel(model, H, W, dirty, slip)
+
+    return dirty
+
+
+#----------------------------------------------------------------------------#
+"""
+This function removes the solved label of the dirty states and of every
+solved state whose greedy graph reaches one of them: a breadth first search
+from the dirty states over the reversed greedy edges of the solved states.
+The predecessors of a cell are among its 8 neighbours, so only the
+neighbours of the states reached are checked (their greedy action, one
+bestQ each): the work is proportional to the region that loses its labels,
+not to the model.
+inputs:
+    - model  : GenerativeModel, or list of State objects (then H, W needed)
+    - dirty  : the dirty states returned by changeCells
+output:
+    - number of labels removed
+"""
+def invalidate(model, dirty, gamma, H=None, W=None):
+
+    if isinstance(model, GenerativeModel):
+        H, W = model.H, model.W
+        find = model.cache.get         # the states not created are not solved
+    else:
+        find = model.__getitem__
+
+    queue = deque(dirty)
+    seen = set(dirty)
+    removed = 0
+    while queue:
+
+        s = queue.popleft()
+        if s.solved:
+            s.solved = False
+            removed += 1
+
+        # solved neighbours whose greedy action may lead to s
+        for i in range(max(s.vPos - 1, 0), min(s.vPos + 2, H)):
+            for j in range(max(s.hPos - 1, 0), min(s.hPos + 2, W)):
+
+                p = find(i * W + j)
+                if p is None or p in seen or not p.solved:
+                    continue
+                for successor, prob, c in p.flat[p.bestQ(gamma)[0]]:
+                    if successor is s:
+                        seen.add(p)
+                        queue.append(p)
+                        break
+
+    return removed
+
+
+#----------------------------------------------------------------------------#
+"""
+This function applies the changes to a model already solved by LRTDP,
+invalidates the labels that depend on them and calls LRTDP again from s0
+(model.s0 by default), warm-started from the current values.
+inputs:
+    - model, changes, gamma : see changeCells
+    - float epsilon         : residual of LRTDP
+    - options               : any other argument of LRTDP (seed, maxDepth,
+                              deadline...) and H, W, slip, heuristic of
+                              changeCells
+    - dict stats            : optional, receives the stats of LRTDP plus
+                              "dirty" and "invalidated"
+output:
+    - number of trials of LRTDP
+"""
+def replanLRTDP(model, changes, gamma, epsilon, s0=None, H=None, W=None,
+                slip=None, heuristic=None, stats=None, **options):
+
+    lazy = isinstance(model, GenerativeModel)
+    if s0 is None:
+        s0 = model.s0 if lazy else next(s for s in model if s.initial)
+
+    dirty = changeCells(model, changes, gamma, H, W, slip, heuristic)
+    removed = invalidate(model, dirty, gamma, H, W)
+    print("MDP Replanning: " + str(len(dirty)) + " dirty states, "
+          + str(removed) + " labels removed")
+
+    n = LRTDP(s0, gamma, epsilon, stats=stats, **options)
+    if stats is not None:
+        stats.update(dirty=len(dirty), invalidated=removed)
+
+    return n
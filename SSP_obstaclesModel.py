@@ -16,8 +16,10 @@ costs.
 
 ##-------------------------------LIBRARIES----------------------------------##
 
-from StateClass import State
+import numpy as np
+from StateClass import State, flag, EXPANDED
 from GridFunctions import Grid2State
+from CompiledModel import CompiledModel, ACTIONS
 
 ##------------------------------COST FUNCTION-------------------------------##
 """
@@ -37,12 +39,14 @@ inputs:
 output:
     - The cost
 """
+nominalCost = -0.05
+obstacleCost = -5
+goalCost = 0
+
+slipProb = 0.1        # probability of drifting to each lateral destination
+
 def Cost(state):
     
-    nominalCost = -0.05
-    obstacleCost = -5
-    goalCost = 0
-    
     if state.goal:
         return goalCost
     
@@ -62,35 +66,44 @@ StateClass:
 -dictionary transitions : This is an attribute that must be defined by a 
                           declarative model generator. The recommended data
                           structure can be as follows:
-        s.transitions = {"action" : {"State prime" : [Probability,Cost]}}
+        s.transitions = {"action" : {"State prime" : (Probability,Cost)}}
+
+The successors are looked up as states[index], so "states" can be any object
+indexable by the state number (e.g. the GenerativeModel below). By default 
+all the states are completed; toUpdate restricts the work to some of them.
+slip is the probability of drifting to each lateral destination (0.1 in the
+original scenario): 1-2*slip for the main destination, 1-slip on borders.
 
 """
-def TransCostModel(states, H, W):
+def TransCostModel(states, H, W, toUpdate=None, slip=slipProb):
+    
+    if toUpdate is None:
+        toUpdate = states
         
-    for s in states:
+    for s in toUpdate:
         
         # Stay action definition ---------------------------------------------
         if s.obstacle:
-            s.transitions["Stay"] = {s: [1, Cost(s)]}
+            s.transitions["Stay"] = {s: (1, Cost(s))}
             
         elif s.goal:
-            s.transitions["Stay"] = {s: [1, Cost(s)]}
+            s.transitions["Stay"] = {s: (1, Cost(s))}
             
         else:
-            s.transitions["Stay"] = {s: [1, Cost(s)]}
+            s.transitions["Stay"] = {s: (1, Cost(s))}
             
             
         
         
         # NORTH action definition --------------------------------------------    
         if s.obstacle:
-            s.transitions["North"] = {s: [1, Cost(s)]} 
+            s.transitions["North"] = {s: (1, Cost(s))} 
             
         elif s.goal:
-            s.transitions["North"] = {s: [1, Cost(s)]}
+            s.transitions["North"] = {s: (1, Cost(s))}
         
         elif s.top:
-            s.transitions["North"] = {s: [1, Cost(s)]}
+            s.transitions["North"] = {s: (1, Cost(s))}
            
         elif not s.top and s.left :
             #Compute the index of destination states
@@ -101,8 +114,8 @@ def TransCostModel(states, H, W):
             s1 = states[d1]
             s2 = states[d2]
             
-            s.transitions["North"] = {s1: [0.9, Cost(s1)],
-                                      s2: [0.1, Cost(s1)]}
+            s.transitions["North"] = {s1: (1-slip, Cost(s1)),
+                                      s2: (slip, Cost(s2))}
             
         elif not s.top and s.right :
             #Compute the index of destination states
@@ -113,8 +126,8 @@ def TransCostModel(states, H, W):
             s1 = states[d1]
             s2 = states[d2]
             
-            s.transitions["North"] = {s1: [0.9, Cost(s1)],
-                                      s2: [0.1, Cost(s2)]}
+            s.transitions["North"] = {s1: (1-slip, Cost(s1)),
+                                      s2: (slip, Cost(s2))}
             
         else:
             #Compute the index of destination states
@@ -127,19 +140,19 @@ def TransCostModel(states, H, W):
             s2 = states[d2]
             s3 = states[d3]
             
-            s.transitions["North"] = {s1: [0.8, Cost(s1)],
-                                      s2: [0.1, Cost(s2)],
-                                      s3: [0.1, Cost(s3)]}
+            s.transitions["North"] = {s1: (1-2*slip, Cost(s1)),
+                                      s2: (slip, Cost(s2)),
+                                      s3: (slip, Cost(s3))}
             
         # SOUTH action definition --------------------------------------------
         if s.obstacle:
-            s.transitions["South"] = {s: [1, Cost(s)]} 
+            s.transitions["South"] = {s: (1, Cost(s))} 
             
         elif s.goal:
-            s.transitions["South"] = {s: [1, Cost(s)]}
+            s.transitions["South"] = {s: (1, Cost(s))}
         
         elif s.bottom:
-            s.transitions["South"] = {s: [1, Cost(s)]}
+            s.transitions["South"] = {s: (1, Cost(s))}
            
         elif not s.bottom and s.left :
             #Compute the index of destination states
@@ -150,8 +163,8 @@ def TransCostModel(states, H, W):
             s1 = states[d1]
             s2 = states[d2]
             
-            s.transitions["South"] = {s1: [0.9, Cost(s1)],
-                                      s2: [0.1, Cost(s2)]}
+            s.transitions["South"] = {s1: (1-slip, Cost(s1)),
+                                      s2: (slip, Cost(s2))}
             
         elif not s.bottom and s.right :
             #Compute the index of destination states
@@ -162,8 +175,8 @@ def TransCostModel(states, H, W):
             s1 = states[d1]
             s2 = states[d2]
             
-            s.transitions["South"] = {s1: [0.9, Cost(s1)],
-                                      s2: [0.1, Cost(s2)]}
+            s.transitions["South"] = {s1: (1-slip, Cost(s1)),
+                                      s2: (slip, Cost(s2))}
             
         else:
             #Compute the index of destination states
@@ -176,19 +189,19 @@ def TransCostModel(states, H, W):
             s2 = states[d2]
             s3 = states[d3]
             
-            s.transitions["South"] = {s1: [0.8, Cost(s1)],
-                                      s2: [0.1, Cost(s2)],
-                                      s3: [0.1, Cost(s3)]}
+            s.transitions["South"] = {s1: (1-2*slip, Cost(s1)),
+                                      s2: (slip, Cost(s2)),
+                                      s3: (slip, Cost(s3))}
         
         # East action definition ---------------------------------------------
         if s.obstacle:
-            s.transitions["East"] = {s: [1, Cost(s)]} 
+            s.transitions["East"] = {s: (1, Cost(s))} 
             
         elif s.goal:
-            s.transitions["East"] = {s: [1, Cost(s)]}
+            s.transitions["East"] = {s: (1, Cost(s))}
         
         elif s.right:
-            s.transitions["East"] = {s: [1, Cost(s)]}
+            s.transitions["East"] = {s: (1, Cost(s))}
            
         elif not s.right and s.top :
             #Compute the index of destination states
@@ -199,8 +212,8 @@ def TransCostModel(states, H, W):
             s1 = states[d1]
             s2 = states[d2]
             
-            s.transitions["East"] = {s1: [0.9, Cost(s1)],
-                                     s2: [0.1, Cost(s2)]}
+            s.transitions["East"] = {s1: (1-slip, Cost(s1)),
+                                     s2: (slip, Cost(s2))}
             
         elif not s.right and s.bottom :
             #Compute the index of destination states
@@ -211,8 +224,8 @@ def TransCostModel(states, H, W):
             s1 = states[d1]
             s2 = states[d2]
             
-            s.transitions["East"] = {s1: [0.9, Cost(s1)],
-                                     s2: [0.1, Cost(s2)]}
+            s.transitions["East"] = {s1: (1-slip, Cost(s1)),
+                                     s2: (slip, Cost(s2))}
             
             
         else:
@@ -226,19 +239,19 @@ def TransCostModel(states, H, W):
             s2 = states[d2]
             s3 = states[d3]
             
-            s.transitions["East"] = {s1: [0.8, Cost(s1)],
-                                     s2: [0.1, Cost(s2)],        
-                                     s3: [0.1, Cost(s3)]}
+            s.transitions["East"] = {s1: (1-2*slip, Cost(s1)),
+                                     s2: (slip, Cost(s2)),        
+                                     s3: (slip, Cost(s3))}
             
         # West action definition ---------------------------------------------
         if s.obstacle:
-            s.transitions["West"] = {s: [1, Cost(s)]} 
+            s.transitions["West"] = {s: (1, Cost(s))} 
             
         elif s.goal:
-            s.transitions["West"] = {s: [1, Cost(s)]}
+            s.transitions["West"] = {s: (1, Cost(s))}
         
         elif s.left:
-            s.transitions["West"] = {s: [1, Cost(s)]}
+            s.transitions["West"] = {s: (1, Cost(s))}
            
         elif not s.left and s.top :
             #Compute the index of destination states
@@ -249,8 +262,8 @@ def TransCostModel(states, H, W):
             s1 = states[d1]
             s2 = states[d2]
             
-            s.transitions["West"] = {s1: [0.9, Cost(s1)],
-                                     s2: [0.1, Cost(s2)]}
+            s.transitions["West"] = {s1: (1-slip, Cost(s1)),
+                                     s2: (slip, Cost(s2))}
             
         elif not s.left and s.bottom :
             #Compute the index of destination states
@@ -261,8 +274,8 @@ def TransCostModel(states, H, W):
             s1 = states[d1]
             s2 = states[d2]
             
-            s.transitions["West"] = {s1: [0.9, Cost(s1)],
-                                     s2: [0.1, Cost(s2)]}
+            s.transitions["West"] = {s1: (1-slip, Cost(s1)),
+                                     s2: (slip, Cost(s2))}
             
         else:
             #Compute the index of destination states
@@ -275,9 +288,12 @@ def TransCostModel(states, H, W):
             s2 = states[d2]
             s3 = states[d3]
             
-            s.transitions["West"] = {s1: [0.8, Cost(s1)],
-                                     s2: [0.1, Cost(s2)],
-                                     s3: [0.1, Cost(s3)]}
+            s.transitions["West"] = {s1: (1-2*slip, Cost(s1)),
+                                     s2: (slip, Cost(s2)),
+                                     s3: (slip, Cost(s3))}
+        
+        # Compiled copy of the transitions for the solvers' hot loops
+        s.compile()
         
     return states
     
@@ -323,15 +339,324 @@ def declarativeModel():
     states = TransCostModel(states, H, W)
     
     return states
-     
 
 
+##----------------------ARRAY-BACKED (COMPACT) MODEL------------------------##
+"""
+The declarativeModel above creates one State object per cell, which is
+perfect to read the model but far too heavy for maps with millions of cells.
+The functions below build the very same transition-cost model directly as
+NumPy arrays (see CompiledModel.py) without instantiating any State.
+
+The border logic of TransCostModel is written in a vectorized form: every 
+action (except "Stay") has a main destination and two lateral destinations.
+    - main destination outside the grid -> stay with probability 1
+    - lateral destination outside the grid -> its probability (slip) is 
+      given to the main destination (0.8 + 0.1 = 0.9 by default)
+    - goal and obstacles are absorbing, all the actions stay in the state
+The cost of a transition only depends on the destination, as in Cost().
+"""
+
+# Offsets (di, dj) of the main and lateral destinations of each action, in
+# the same order used by TransCostModel. "Stay" has no offsets.
+MOVES = {"Stay"  : None,
+         "North" : ((-1, 0), (-1,-1), (-1, 1)),
+         "South" : (( 1, 0), ( 1,-1), ( 1, 1)),
+         "East"  : (( 0, 1), ( 1, 1), (-1, 1)),
+         "West"  : (( 0,-1), ( 1,-1), (-1,-1))}
+
+
+#----------------------------------------------------------------------------#
+"""
+This function returns the cost of arriving at each state, i.e. the vectorized
+version of Cost().
+inputs:
+    - bool arrays goal, obstacle : [S] masks
+output:
+    - float32 array [S]
+"""
+def arrivalCost(goal, obstacle):
     
+    c = np.full(goal.shape, nominalCost, dtype=np.float32)
+    c[obstacle] = obstacleCost
+    c[goal] = goalCost
     
+    return c
 
 
-           
+#----------------------------------------------------------------------------#
+"""
+This function computes the transitions of a block of states.
+inputs:
+    - int array idx : indices of the states of the block
+    - look(M, di, dj) : returns, for each state of the block, the value of the
+                        padded map M in the cell shifted by (di, dj)
+    - int W         : width of the grid
+    - inside, free, arrival : padded maps built by gridTransitions
+    - float slip    : probability of each lateral destination
+outputs:
+    - succ int32 [n, A, 3], prob float32 [n, A, 3], cost float32 [n, A, 3]
+"""
+def transitionBlock(idx, look, W, inside, free, arrival, slip):
+    
+    n = idx.shape[0]
+    A = len(ACTIONS)
+    moving = look(free, 0, 0)                 # absorbing states never move
+    ownCost = look(arrival, 0, 0)
+    
+    # Default: stay in the state with probability 1, padded slots have P=0
+    succ = np.empty((n, A, 3), dtype=np.int32)
+    succ[:] = idx[:, None, None]
+    prob = np.zeros((n, A, 3), dtype=np.float32)
+    cost = np.zeros((n, A, 3), dtype=np.float32)
+    prob[:, :, 0] = 1
+    cost[:, :, 0] = ownCost[:, None]
+    
+    for a, action in enumerate(ACTIONS):
+        
+        if MOVES[action] is None:
+            continue
+        
+        (mi, mj), *sides = MOVES[action]
+        
+        # main destination
+        go = moving & look(inside, mi, mj)
+        pMain = np.ones(n)
+        
+        # lateral destinations (only if the main move is possible)
+        for k, (si, sj) in enumerate(sides, start=1):
+            
+            lateral = go & look(inside, si, sj)
+            
+            succ[:, a, k] += lateral * np.int32(si*W + sj)
+            prob[:, a, k] = lateral * np.float32(slip)
+            cost[:, a, k] = np.where(lateral, look(arrival, si, sj), 0)
+            pMain -= lateral * slip
+        
+        succ[:, a, 0] += go * np.int32(mi*W + mj)
+        prob[:, a, 0] = pMain
+        cost[:, a, 0] = np.where(go, look(arrival, mi, mj), ownCost)
+    
+    return succ, prob, cost
+
+
+#----------------------------------------------------------------------------#
+"""
+This function computes the transitions of the states idx (all of them by
+default) of a H x W grid. The whole grid is processed in bands of rows so 
+that the temporary arrays stay small and in cache.
+inputs:
+    - int H, W             : dimensions of the grid
+    - bool arrays goal, obstacle : [H*W] masks
+    - int array idx        : indices of the states to compute
+    - float slip           : probability of each lateral destination
+outputs:
+    - succ int32 [n, A, 3], prob float32 [n, A, 3], cost float32 [n, A, 3]
+"""
+def gridTransitions(H, W, goal, obstacle, idx=None, slip=slipProb):
+    
+    # Padded maps: one extra ring of cells around the grid, so the border
+    # detection becomes a simple look-up of the destination cell
+    inside = np.zeros((H+2, W+2), dtype=bool)
+    inside[1:-1, 1:-1] = True
+    free = np.zeros((H+2, W+2), dtype=bool)
+    free[1:-1, 1:-1] = ~(goal | obstacle).reshape(H, W)
+    arrival = np.zeros((H+2, W+2), dtype=np.float32)
+    arrival[1:-1, 1:-1] = arrivalCost(goal, obstacle).reshape(H, W)
+    maps = (inside, free, arrival, slip)
+    
+    if idx is not None:
+        # some states -> gather the shifted cells
+        idx = np.asarray(idx, dtype=np.int32)
+        i, j = np.divmod(idx, W)
+        def look(M, di, dj):
+            return M[1+di+i, 1+dj+j]
+        
+        return transitionBlock(idx, look, W, *maps)
+    
+    # whole grid -> shifted views of a band of rows, no gather at all
+    n_states = H*W
+    A = len(ACTIONS)
+    succ = np.empty((n_states, A, 3), dtype=np.int32)
+    prob = np.empty((n_states, A, 3), dtype=np.float32)
+    cost = np.empty((n_states, A, 3), dtype=np.float32)
+    
+    band = max(1, 16384 // W)
+    for r0 in range(0, H, band):
+        
+        r1 = min(H, r0 + band)
+        def look(M, di, dj):
+            return M[1+di+r0 : 1+di+r1, 1+dj : 1+dj+W].ravel()
+        
+        rows = slice(r0*W, r1*W)
+        idx = np.arange(r0*W, r1*W, dtype=np.int32)
+        succ[rows], prob[rows], cost[rows] = transitionBlock(idx, look, W, *maps)
+    
+    return succ, prob, cost
+
+
+#----------------------------------------------------------------------------#
+"""
+This is the compact counterpart of declarativeModel(): it builds the model of
+any H x W map as a CompiledModel, which can be given directly to VI.
+inputs:
+    - int H, W       : dimensions of the grid
+    - int initial    : index of the initial state
+    - int goal       : index of the goal
+    - obstacles      : bool mask of shape [H, W] or [H*W]
+    - float slip     : probability of each lateral destination
+output:
+    - CompiledModel
+"""
+def compactModel(H, W, initial, goal, obstacles, slip=slipProb):
+    
+    n_states = H*W
     
+    goalMask = np.zeros(n_states, dtype=bool)
+    goalMask[goal] = True
+    obstacleMask = np.asarray(obstacles, dtype=bool).reshape(n_states).copy()
+    obstacleMask[goalMask] = False
+    
+    succ, prob, cost = gridTransitions(H, W, goalMask, obstacleMask,
+                                       slip=slip)
+    
+    return CompiledModel(H, W, succ, prob, cost, goalMask, obstacleMask,
+                         initial=initial)
+
 
+##----------------------GENERATIVE (LAZY) MODEL-----------------------------##
+"""
+RTDP, LRTDP and UCT only visit the states reachable from s0, so there is no
+need to instantiate and wire all the H*W states before solving. The 
+GenerativeModel creates a State the first time it is referenced (interned in
+a cache, so every index has exactly one State) and computes its transitions
+only the first time a solver reads them. Memory and startup time then scale
+with the visited envelope instead of the whole map.
+
+Usage:
+    model = GenerativeModel(H, W, initial, goal, obstacles)
+    RTDP(model.s0, gamma, maxTrials)
+    len(model)          -> number of states instantiated so far
+"""
+class LazyState(State):
+    
+    __slots__ = ("model",)
+    expanded = flag(EXPANDED)
+    
+    def __init__(self, index, H, W, model):
+        
+        State.__init__(self, index, H, W)
+        self.model = model
+    
+    # The transitions are computed (and compiled) on the first read
+    def expand(self):
+        
+        self.flags |= EXPANDED
+        TransCostModel(self.model, self.model.H, self.model.W, [self],
+                       self.model.slip)
+    
+    @property
+    def transitions(self):
+        
+        if not self.flags & EXPANDED:
+            self.expand()
+        
+        return State.transitions.fget(self)
+    
+    @transitions.setter
+    def transitions(self, value):
+        self._transitions = value
+    
+    def compile(self):
+        
+        if not self.flags & EXPANDED:
+            self.expand()               # expanded and compiled
+            return self.flat
+        return State.compile(self)
 
 
+#----------------------------------------------------------------------------#
+"""
+inputs:
+    - int H, W       : dimensions of the grid
+    - int initial    : index of the initial state
+    - goal           : index of the goal, or an iterable of indices
+    - obstacles      : iterable with the indices of the obstacles, or a bool 
+                       mask of shape [H, W] or [H*W]
+    - float slip     : probability of each lateral destination
+    - heuristic      : optional initial values indexed by the state number
+                       (see Heuristics.py), given to the states on creation
+"""
+class GenerativeModel:
+    
+    def __init__(self, H, W, initial, goal, obstacles, slip=slipProb,
+                 heuristic=None):
+        
+        self.H = H
+        self.W = W
+        self.initial = initial
+        self.goal = goal
+        self.slip = slip
+        self.heuristic = heuristic
+        self.goals = frozenset(int(g) for g in np.atleast_1d(goal))
+        self.deadEnds = frozenset()        # set by DeadEnds.markDeadEnds
+        self.deadEndValue = 0
+        
+        if isinstance(obstacles, np.ndarray) and obstacles.dtype == bool:
+            obstacles = np.flatnonzero(obstacles)
+        self.obstacles = frozenset(int(o) for o in obstacles)
+        
+        self.cache = {}                    # interned states {index : State}
+    
+    def __getitem__(self, index):
+        
+        s = self.cache.get(index)
+        if s is None:
+            
+            s = LazyState(index, self.H, self.W, self)
+            s.initial = index == self.initial
+            s.goal = index in self.goals
+            s.obstacle = index in self.obstacles and not s.goal
+            if self.heuristic is not None:
+                s.value = float(self.heuristic[index])
+            if index in self.deadEnds:
+                s.deadEnd = True
+                s.value = self.deadEndValue
+                s.solved = True
+            self.cache[index] = s
+        
+        return s
+    
+    def __len__(self):
+        return len(self.cache)
+    
+    def state(self, i, j):
+        return self[Grid2State(i, j, self.H, self.W)]
+    
+    @property
+    def s0(self):
+        return self[self.initial]
+
+
+##------------------------RANDOM OBSTACLE MAPS------------------------------##
+"""
+This function draws a random obstacle map, used by the benchmarks. Every 
+cell is an obstacle with probability density, except the initial state and
+the goal.
+inputs:
+    - int H, W        : dimensions of the grid
+    - float density   : probability of each cell being an obstacle
+    - seed            : seed of the random generator
+    - int initial, goal : indices that must stay free
+output:
+    - bool mask [H, W]
+"""
+def randomObstacles(H, W, density, seed=None, initial=0, goal=None):
+    
+    if goal is None:
+        goal = H*W - 1
+    
+    obstacles = np.random.default_rng(seed).random(H*W) < density
+    obstacles[[initial, goal]] = False
+    
+    return obstacles.reshape(H, W)
@@ -0,0 +1,144 @@
+"""
+Sampling tools shared by the solvers.
+
+All the trial based algorithms (RTDP, LRTDP, UCT and its rollouts) spend a
+good part of their time sampling successors s' ~ P(.|s,a). Accumulating the
+probabilities of a dictionary until a random number is reached costs O(K) per
+draw and, because of the floating point accumulation, may even fail to return
+a successor when the random number is above the final sum.
+
+The alias method (Walker, Vose) precomputes two tables per distribution,
+threshold and alias, so that a draw costs O(1) and never fails:
+    x = u * K                 (u uniform in [0,1), K number of outcomes)
+    k = int(x)                (uniform column)
+    k if x - k < threshold[k] else alias[k]
+
+The random numbers come from numpy.random.Generator objects, one per solver
+so that every run can be seeded and reproduced.
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import numpy as np
+
+##---------------------------ALIAS TABLES-----------------------------------##
+"""
+This function builds the alias tables of a single distribution. It is used
+by State.compile(), where K is tiny (up to 3) and NumPy would be overkill.
+inputs:
+    - list probs : probabilities of the K outcomes
+outputs:
+    - tuple threshold, tuple alias
+"""
+def aliasRow(probs):
+
+    K = len(probs)
+    total = sum(probs)
+    scaled = [p * K / total for p in probs]
+    threshold = [1.0] * K
+    alias = list(range(K))
+
+    small = [k for k in range(K) if scaled[k] < 1]
+    large = [k for k in range(K) if scaled[k] >= 1]
+    while small and large:
+
+        s = small.pop()
+        l = large.pop()
+        threshold[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1 - scaled[s]
+
+        if scaled[l] < 1:
+            small.append(l)
+        else:
+            large.append(l)
+
+    return tuple(threshold), tuple(alias)
+
+
+#----------------------------------------------------------------------------#
+"""
+Vectorized version: alias tables of N distributions at once.
+inputs:
+    - float array probs : [N, K] each row is a distribution (zeros allowed)
+outputs:
+    - float array threshold [N, K], int8 array alias [N, K]
+"""
+def aliasTable(probs):
+
+    N, K = probs.shape
+    rows = np.arange(N)
+    scaled = probs.astype(np.float64) * K / probs.sum(axis=1, keepdims=True)
+    threshold = np.ones((N, K))
+    alias = np.tile(np.arange(K, dtype=np.int8), (N, 1))
+    done = np.zeros((N, K), dtype=bool)
+
+    # Each step pairs the smallest pending column with the largest one
+    for step in range(K - 1):
+
+        s = np.where(done, np.inf, scaled).argmin(axis=1)
+        l = np.where(done, -np.inf, scaled).argmax(axis=1)
+        pair = scaled[rows, s] < 1
+
+        r, s, l = rows[pair], s[pair], l[pair]
+        threshold[r, s] = scaled[r, s]
+        alias[r, s] = l
+        scaled[r, l] -= 1 - scaled[r, s]
+        done[r, s] = True
+
+    return threshold, alias
+
+
+#----------------------------------------------------------------------------#
+"""
+Vectorized draw from alias tables.
+inputs:
+    - threshold, alias : tables of shape [N, K] (see aliasTable)
+    - int array rows   : which distribution to sample, any shape
+    - float array u    : uniform numbers in [0,1), same shape as rows
+output:
+    - int array with the sampled column of each row
+"""
+def sampleAlias(threshold, alias, rows, u):
+
+    K = threshold.shape[1]
+    x = u * K
+    k = np.minimum(x.astype(np.int64), K - 1)
+    keep = (x - k) < threshold[rows, k]
+
+    return np.where(keep, k, alias[rows, k])
+
+
+##---------------------------RANDOM STREAMS---------------------------------##
+"""
+A RandomStream wraps a numpy.random.Generator and hands out uniform numbers
+one by one from a buffer, so the scalar draws of the Python solvers pay one
+NumPy call every few thousand numbers instead of one per draw. The generator
+itself is available for batch draws.
+
+Usage:
+    rng = RandomStream(seed)
+    u = rng.random()                   # one float in [0,1)
+    U = rng.generator.random(1000)     # batch
+"""
+class RandomStream:
+
+    def __init__(self, seed=None, bufferSize=4096):
+
+        if isinstance(seed, RandomStream):
+            seed = seed.generator
+
+        self.generator = np.random.default_rng(seed)
+        self.bufferSize = bufferSize
+        self.buffer = []
+
+    def random(self):
+
+        if not self.buffer:
+            self.buffer = self.generator.random(self.bufferSize).tolist()
+
+        return self.buffer.pop()
+
+
+# Stream used when a State method is called without a solver's stream
+defaultStream = RandomStream()
@@ -0,0 +1,527 @@
+"""
+Content-addressed cache of solutions on the local disk.
+
+The same maze (grid, goal, obstacles, slip) is solved again and again with
+the same gamma. The cache sits in front of VI, RTDP and LRTDP: the model is
+compiled and fingerprinted (CompiledModel.fingerprint), and together with
+the solver and every parameter that changes its result (epsilon, maxIter,
+the initial values, mode, backend, seed, maxDepth...) this gives the key of
+the solution. The solutions are PolicyIO files in the cache directory, so a
+hit costs the fingerprint plus a memory map.
+
+Only finished solutions are stored: VI when it converged, LRTDP when s0 is
+solved, RTDP when it ran all its trials from a cold start. A run stopped by
+a deadline (or by maxIter) is returned but not cached. The deadline, stats
+and probe are not part of the key, they do not change a finished solution.
+
+When there is no exact hit, the cached solution of the nearest maze (same
+grid, solver and gamma, fewest cells whose obstacle/goal flag differ, at most
+maxDiff of the cells) warm-starts the solver:
+    -VI converges from any V0, so it always starts from the cached values.
+    -RTDP and LRTDP need an upper bound of V*. The cached values stay one
+     when the new maze only adds obstacles (or removes goals), otherwise
+     the solver starts cold.
+The changed cells get their new value (obstacleCost / (1 - gamma) for the
+new obstacles, 0 for the freed cells and the new goals) and the states the
+cached solver never reached keep V0.
+
+The entries are evicted in least recently used order when there are more
+than maxEntries or they take more than maxBytes. The index is a JSON file
+in the directory.
+
+Several processes (or jobs) can share a directory. Every change of the
+index (a use, a store, an eviction) re-reads it from the disk, changes it
+and writes it back while holding an exclusive fcntl.flock on index.lock,
+so no writer loses the entries of another. All the files are written to a
+unique temporary name and moved into place with os.replace, so the readers
+never see a partial file. An entry whose .pol file another process has
+evicted (or that cannot be read) is a miss and is dropped from the index.
+Without fcntl (Windows) there is no lock and concurrent writers may lose
+each other's entries, but never corrupt the files.
+
+Usage:
+    cache = SolutionCache("~/.cache/maze", maxBytes=2**30)
+    policy, V, n, Res = cache.VI(model, gamma, epsilon, maxIter)
+    cache.LRTDP(lazy, gamma, epsilon, seed=0)
+    cache.counters      -> {"hits", "misses", "warmStarts", "evictions"}
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from SSP_obstaclesModel import GenerativeModel, obstacleCost
+from ValueIteration import VI, sparseSweeps
+from RealTimeDP import RTDP
+from LabeledRTDP import LRTDP
+from Heuristics import asCompiled
+from PolicyIO import savePolicy, saveStates, loadPolicy
+
+try:
+    import fcntl
+except ImportError:                      # Windows: no lock, see the header
+    fcntl = None
+
+INDEX = "index.json"
+LOCK = "index.lock"
+
+# options that do not change a finished solution, left out of the key
+RUNTIME = ("deadline", "stats", "probe")
+
+##-----------------------------Class definition-----------------------------##
+"""
+The objects of type SolutionCache have the following attributes:
+    -str directory   : where the solutions are stored
+    -int maxEntries  : maximum number of solutions (None -> no limit)
+    -int maxBytes    : maximum size of the solutions (None -> no limit)
+    -float maxDiff   : fraction of differing cells accepted for a warm start
+    -dict counters   : hits, misses (warm starts included), warmStarts and
+                       evictions of this object
+    -dict index      : {key : entry} with the H, W, solver, gamma, size and
+                       last use of every solution, as last read from the disk
+"""
+class SolutionCache:
+
+    def __init__(self, directory, maxEntries=None, maxBytes=None,
+                 maxDiff=0.01):
+
+        self.directory = os.path.expanduser(directory)
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.maxDiff = maxDiff
+        self.counters = {"hits": 0, "misses": 0, "warmStarts": 0,
+                         "evictions": 0}
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = self.readIndex()
+
+    def __len__(self):
+        self.index = self.readIndex()
+        return len(self.index)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    #-------------------------------------------------------------------------
+    def key(self, compiled, solver, gamma, params):
+
+        """
+        This method returns the key of a solution: the SHA-256 of the model
+        fingerprint, the solver and its parameters (dict, see describe).
+        """
+
+        params = {name: describe(value) for name, value in params.items()
+                  if name not in RUNTIME}
+        text = json.dumps([compiled.fingerprint(), solver, gamma, params],
+                          sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    #-------------------------------------------------------------------------
+    def lookup(self, key):
+
+        """
+        This method returns the cached Policy (see PolicyIO) of the key, or
+        None, and counts the hit or the miss.
+        """
+
+        with self.locked():
+            found = key in self.index
+            if found:
+                self.touch(key)
+                self.save()
+
+        solution = self.load(key) if found else None
+        self.counters["hits" if solution is not None else "misses"] += 1
+        return solution
+
+    #-------------------------------------------------------------------------
+    def nearest(self, compiled, solver, gamma):
+
+        """
+        This method looks for the cached solution of the nearest maze. It
+        returns (Policy, old obstacle mask, old goal mask, number of
+        different cells) or None.
+        """
+
+        S = compiled.nStates
+        best, bestDiff = None, int(self.maxDiff * S)
+
+        self.index = self.readIndex()
+        for key, entry in self.index.items():
+
+            if (entry["H"], entry["W"], entry["solver"], entry["gamma"]) != \
+               (compiled.H, compiled.W, solver, gamma):
+                continue
+
+            try:
+                obstacle, goal = self.masks(key, S)
+            except (OSError, ValueError):  # evicted by another process
+                continue
+            diff = int((obstacle != compiled.obstacle).sum()
+                       + (goal != compiled.goal).sum())
+            if diff <= bestDiff:
+                best, bestDiff = (key, obstacle, goal), diff
+
+        if best is None:
+            return None
+
+        key, obstacle, goal = best
+        solution = self.load(key)
+        if solution is None:
+            return None
+        with self.locked():
+            if key in self.index:
+                self.touch(key)
+                self.save()
+        return solution, obstacle, goal, bestDiff
+
+    #-------------------------------------------------------------------------
+    def warmValues(self, compiled, solver, gamma, V0, admissible):
+
+        """
+        This method builds the initial values of a solver from the nearest
+        cached solution (see the header), or returns None.
+        """
+
+        found = self.nearest(compiled, solver, gamma)
+        if found is None:
+            return None
+
+        solution, obstacle, goal, diff = found
+        freed = (obstacle & ~compiled.obstacle) | (compiled.goal & ~goal)
+        if admissible and freed.any():
+            return None
+
+        V = np.array(solution.V, dtype=np.float64)
+        unknown = ~np.isfinite(V)
+        V[unknown] = 0 if V0 is None else np.asarray(V0)[unknown]
+        V[compiled.obstacle & ~obstacle] = obstacleCost / (1 - gamma)
+        V[freed] = 0
+
+        self.counters["warmStarts"] += 1
+        print("MDP Cache: warm start from a maze with " + str(diff)
+              + " different cells")
+        return V
+
+    #-------------------------------------------------------------------------
+    def store(self, key, compiled, solver, gamma, write):
+
+        """
+        This method adds a solution: write(path) saves the PolicyIO file,
+        the masks of the maze are saved next to it for nearest().
+        """
+
+        masks = np.stack([np.packbits(compiled.obstacle),
+                          np.packbits(compiled.goal)])
+        size = (self.replaceFile(key + ".map.npy",
+                                 lambda path: saveMasks(path, masks))
+                + self.replaceFile(key + ".pol", write))
+
+        with self.locked():
+            self.index[key] = {"H": compiled.H, "W": compiled.W,
+                               "solver": solver, "gamma": gamma,
+                               "size": size, "used": 0}
+            self.touch(key)
+            self.evict()
+            self.save()
+
+    #-------------------------------------------------------------------------
+    def evict(self):
+
+        """
+        This method removes the least recently used solutions until the
+        limits are met (called under the lock, see locked).
+        """
+
+        order = sorted(self.index, key=lambda k: self.index[k]["used"])
+        size = sum(e["size"] for e in self.index.values())
+
+        while order and ((self.maxEntries is not None
+                          and len(self.index) > self.maxEntries)
+                         or (self.maxBytes is not None
+                             and size > self.maxBytes)):
+
+            key = order.pop(0)
+            size -= self.index[key]["size"]
+            self.remove(key)
+            self.counters["evictions"] += 1
+
+    #-------------------------------------------------------------------------
+    def remove(self, key):
+
+        self.index.pop(key, None)
+        for name in (key + ".pol", key + ".map.npy"):
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+
+    def touch(self, key):
+
+        # the clock is shared by all the processes through the index
+        clock = max((e["used"] for e in self.index.values()), default=0)
+        self.index[key]["used"] = clock + 1
+
+    def masks(self, key, S):
+
+        bits = np.load(self.path(key + ".map.npy"))
+        return (np.unpackbits(bits[0], count=S).astype(bool),
+                np.unpackbits(bits[1], count=S).astype(bool))
+
+    def load(self, key):
+
+        """
+        This method maps the Policy of an entry. A file another process has
+        evicted, or that cannot be read, is a miss: unless it was stored
+        again meanwhile, the entry is dropped and None is returned.
+        """
+
+        try:
+            return loadPolicy(self.path(key + ".pol"))
+        except (OSError, ValueError, IndexError):
+            pass
+
+        with self.locked():
+            try:
+                return loadPolicy(self.path(key + ".pol"))
+            except (OSError, ValueError, IndexError):
+                self.remove(key)
+                self.save()
+        return None
+
+    #-------------------------------------------------------------------------
+    @contextlib.contextmanager
+    def locked(self):
+
+        """
+        This method holds the lock of the directory and re-reads the index
+        from the disk: the changes made in the block are merged with the
+        ones of the other processes, save() writes them before the release.
+        """
+
+        with open(self.path(LOCK), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            self.index = self.readIndex()
+            yield                        # closing the file releases the lock
+
+    def readIndex(self):
+
+        try:
+            with open(self.path(INDEX)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save(self):
+
+        self.replaceFile(INDEX, lambda path: saveIndex(path, self.index))
+
+    def replaceFile(self, name, write):
+
+        """
+        This method writes a file of the cache: write(path) fills a unique
+        temporary file of the directory, which is then moved to name. It
+        returns the size of the file.
+        """
+
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp",
+                                         delete=False) as f:
+            tmp = f.name
+        try:
+            write(tmp)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, self.path(name))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return size
+
+    ## Solvers ---------------------------------------------------------------
+    def VI(self, model, gamma, epsilon, maxIter, V0=None, stats=None,
+           **options):
+
+        """
+        Cached VI on a CompiledModel or a list of State objects. Same inputs
+        and outputs as VI (V0 defaults to zeros); on a hit n is 0 and Res
+        are the residuals of one Bellman backup of the cached values.
+        stats["cache"] is "hit", "warm" or "miss".
+        """
+
+        compiled = asCompiled(model)
+        key = self.key(compiled, "VI", gamma,
+                       dict(options, epsilon=epsilon, maxIter=maxIter, V0=V0))
+        solution = self.lookup(key)
+
+        if solution is not None:
+            print("MDP Cache: solution found")
+            if stats is not None:
+                stats["cache"] = "hit"
+            names = np.array(solution.actions, dtype=object)
+            V = np.array(solution.V, dtype=np.float64)
+            Res = next(sparseSweeps(compiled, gamma, V))[2]
+            return names[solution.policy], V, 0, Res
+
+        warm = self.warmValues(compiled, "VI", gamma, V0, admissible=False)
+        stats = {} if stats is None else stats
+        stats["cache"] = "miss" if warm is None else "warm"
+        if warm is None:
+            warm = np.zeros(compiled.nStates) if V0 is None else V0
+
+        policy, V, n, Res = VI(model, gamma, epsilon, maxIter, warm,
+                               stats=stats, **options)
+        if stats["stop"] != "converged":
+            return policy, V, n, Res
+
+        self.store(key, compiled, "VI", gamma,
+                   lambda path: savePolicy(path, policy, V, compiled.H,
+                                           compiled.W, gamma, epsilon,
+                                           solved=np.asarray(Res) <
+                                           2*epsilon*gamma/(1-gamma),
+                                           actions=compiled.actions))
+        return policy, V, n, Res
+
+    #-------------------------------------------------------------------------
+    def LRTDP(self, model, gamma, epsilon, s0=None, stats=None, **options):
+
+        """
+        Cached LRTDP on a GenerativeModel or a list of State objects. On a
+        hit the values and labels are written into the states, so s0 is
+        solved. Returns the number of trials (0 on a hit), as LRTDP. Stored
+        only when s0 is solved.
+        """
+
+        return self.trials("LRTDP", model, gamma,
+                           dict(options, epsilon=epsilon), s0, stats,
+                           lambda s, stats: LRTDP(s, gamma, epsilon,
+                                                  stats=stats, **options),
+                           epsilon)
+
+    def RTDP(self, model, gamma, maxTrials, s0=None, stats=None, **options):
+
+        """
+        Cached RTDP, same as above. Stored only when all the maxTrials trials
+        were run from a cold start (RTDP has no convergence test).
+        """
+
+        return self.trials("RTDP", model, gamma,
+                           dict(options, maxTrials=maxTrials), s0, stats,
+                           lambda s, stats: RTDP(s, gamma, maxTrials,
+                                                 stats=stats, **options),
+                           None)
+
+    def trials(self, solver, model, gamma, params, s0, stats, run, epsilon):
+
+        compiled = asCompiled(model)
+        lazy = isinstance(model, GenerativeModel)
+        if s0 is None:
+            s0 = model.s0 if lazy else next(s for s in model if s.initial)
+
+        # the values the states start from are part of the key
+        key = self.key(compiled, solver, gamma,
+                       dict(params, s0=s0.number,
+                            V0=currentValues(model, compiled.nStates)))
+        solution = self.lookup(key)
+
+        if solution is not None:
+            print("MDP Cache: solution found")
+            restore(model, solution.V, solution.solvedBits)
+            if stats is not None:
+                stats.update(cache="hit", action=s0.greedyAction(gamma))
+            return 0
+
+        # nan -> the states the cached solver never reached are not created
+        warm = self.warmValues(compiled, solver, gamma,
+                               np.full(compiled.nStates, np.nan),
+                               admissible=True)
+        stats = {} if stats is None else stats
+        stats["cache"] = "miss" if warm is None else "warm"
+        if warm is not None:
+            restore(model, warm)
+
+        n = run(s0, stats)
+        if solver == "LRTDP":
+            finished = s0.solved
+        else:
+            finished = stats["stop"] == "trials" and warm is None
+        if not finished:
+            return n
+
+        self.store(key, compiled, solver, gamma,
+                   lambda path: saveStates(path, model, gamma, epsilon,
+                                           fingerprint=False))
+        return n
+
+
+##---------------------------------AUXILIARY--------------------------------##
+"""
+These functions write the index and the masks of a solution into a file
+(np.save on a path would add the .npy suffix to the temporary name).
+"""
+def saveIndex(path, index):
+
+    with open(path, "w") as f:
+        json.dump(index, f)
+
+
+def saveMasks(path, masks):
+
+    with open(path, "wb") as f:
+        np.save(f, masks)
+
+
+"""
+This function turns a parameter into a JSON value for the key: numbers,
+strings and None as they are, arrays (and lists of numbers) as their dtype,
+shape and SHA-256, the rest as its repr.
+"""
+def describe(value):
+
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple, np.ndarray)):
+        array = np.ascontiguousarray(value)
+        if array.dtype != object:
+            return [array.dtype.str, list(array.shape),
+                    hashlib.sha256(memoryview(array).cast("B")).hexdigest()]
+    return repr(value)
+
+
+"""
+This function returns the values the states of a model start from: the
+heuristic of a GenerativeModel (0 without it) overwritten by the states it
+has already created, or the values of a list of State objects.
+"""
+def currentValues(model, S):
+
+    if not isinstance(model, GenerativeModel):
+        return np.array([s.value for s in model], dtype=np.float64)
+
+    V = (np.zeros(S) if model.heuristic is None
+         else np.array(model.heuristic, dtype=np.float64))
+    for index, s in model.cache.items():
+        V[index] = s.value
+    return V
+
+"""
+This function writes cached values (and solved labels, packed as in
+PolicyIO) into the State objects of a model. The unknown values (nan) are
+skipped; a GenerativeModel creates the states that have a value.
+"""
+def restore(model, V, solvedBits=None):
+
+    V = np.asarray(V)
+    solved = (None if solvedBits is None else
+              np.unpackbits(np.asarray(solvedBits), count=V.shape[0],
+                            bitorder="little").astype(bool))
+
+    for index in np.flatnonzero(np.isfinite(V)):
+
+        s = model[int(index)]
+        s.value = float(V[index])
+        if solved is not None:
+            s.solved = bool(solved[index])
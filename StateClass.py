@@ -1,8 +1,50 @@
 ##-------------------------------LIBRARIES----------------------------------##
 
 from GridFunctions import State2Grid
-import operator
-from random import random
+from Sampling import aliasRow, defaultStream
+
+##------------------------------FLAGS---------------------------------------##
+"""
+The boolean attributes of a State are the bits of a single int, "flags".
+They are still read and written by name (s.goal, s.solved = True...) through
+the properties below; the solvers' hot loops test the bits directly, e.g.
+s.flags & TERMINAL instead of s.goal or s.obstacle or s.deadEnd.
+"""
+INITIAL  = 1
+GOAL     = 2
+OBSTACLE = 4
+DEADEND  = 8
+TOP      = 16
+BOTTOM   = 32
+LEFT     = 64
+RIGHT    = 128
+SOLVED   = 256
+EXPANDED = 512          # LazyState only
+
+TERMINAL = GOAL | OBSTACLE | DEADEND
+
+
+def flag(bit):
+
+    def get(self):
+        return self.flags & bit != 0
+
+    def set(self, on):
+        if on:
+            self.flags |= bit
+        else:
+            self.flags &= ~bit
+
+    return property(get, set)
+
+
+"""
+The tuples of action names and the alias tables are shared by all the
+states that have the same ones (interned), instead of one copy per state:
+the tables only depend on the probabilities, not on the successors.
+"""
+actionNames = {}
+aliasCache = {}
 
 ##-----------------------------Class definition-----------------------------##
 """
@@ -10,9 +52,12 @@ The objects of type State will have the following attributes:
     -int number      : It is the first identifier of the state
     -int vPos        : It is the row in which the state is placed (from 0 to H-1)
     -int hPos        : It is the column in which the state is placed (from 0 to W-1)
+    -int flags       : the bits of the boolean attributes below (see FLAGS)
     -boolean initial : True if this is the initial state
     -boolean goal    : True if this is the goal
     -boolean obstacle: True if this state is a dead-end, otherwise False
+    -boolean deadEnd : True if the goal cannot be reached from this state
+                       (obstacle or walled-in cell, see DeadEnds.py)
     -boolean top     : True if the state belongs to the top bound, otherwise False
     -boolean bottom  : True if the state belongs to the bottom bound, otherwise False
     -boolean rigth   : True if the state belongs to the right bound, otherwise False
@@ -20,10 +65,37 @@ The objects of type State will have the following attributes:
     -dictionary transitions : This is an attribute that must be defined by a 
                               declarative model generator. The recommended data
                               structure can be as follows:
-                              transitions = {"action" : {State prime : [Probability,Cost]}}
+                              transitions = {"action" : {State prime : (Probability,Cost)}}
+                              compile() turns it into flat and releases it;
+                              reading it afterwards rebuilds it from flat.
+    -tuple flat : compiled transitions, built by compile(). The actions are
+                  numbers: flat[a] = ((State prime, Probability, Cost), ...)
+                  This is what the hot methods below iterate.
+    -tuple alias : alias tables of each action, built by compile():
+                  alias[a] = (threshold, alias), over the entries of flat[a]
+    -tuple actions : the name of each action number (shared between states)
     -float value: current estimate for the value of this state
+    -boolean solved : solved label of LRTDP
+    -int mark   : generation of the last LRTDP search that reached this state
+
+The attributes are slots: a State has no __dict__ and cannot get new ones.
+bestQ, backup and sampleNewState work with action numbers, greedyAction
+and SampleAction return names, Qvalue and sampleNewState accept both.
 """
 class State:
+
+    __slots__ = ("number", "vPos", "hPos", "flags", "_transitions", "flat",
+                 "alias", "actions", "value", "mark")
+
+    initial  = flag(INITIAL)
+    goal     = flag(GOAL)
+    obstacle = flag(OBSTACLE)
+    deadEnd  = flag(DEADEND)
+    top      = flag(TOP)
+    bottom   = flag(BOTTOM)
+    left     = flag(LEFT)
+    right    = flag(RIGHT)
+    solved   = flag(SOLVED)
     
     def __init__(self, index, H, W):
         
@@ -31,44 +103,44 @@ class State:
         self.number = index
         [self.vPos,self.hPos] = State2Grid(index, H, W)
          
-        # Special States
-        self.initial = False
-        self.goal = False
-        self.obstacle = False
-        
-        # Border detection
-        if self.vPos == 0:
-            self.top = True
-        else:
-            self.top = False
-            
-        if self.vPos == H-1:
-            self.bottom = True
-        else:
-            self.bottom = False
-        
-        if self.hPos == 0:
-            self.left = True
-        else:
-            self.left = False
-        
-        if self.hPos == W-1:
-            self.right = True
-        else:
-            self.right = False
+        # Special States and border detection
+        self.flags = ((TOP if self.vPos == 0 else 0)
+                      | (BOTTOM if self.vPos == H-1 else 0)
+                      | (LEFT if self.hPos == 0 else 0)
+                      | (RIGHT if self.hPos == W-1 else 0))
           
         # Transition model    
-        self.transitions = {}
+        self._transitions = None
+        self.flat = None
+        self.alias = None
+        self.actions = None
         
         #Current estimate of the value function -> (L)RTDP
         self.value = 0
         
-        #solved label -> for LRTDP
-        self.solved = False
+        #generation of the last LRTDP search that reached this state
+        self.mark = 0
    
          
     def __str__(self):
         return  "s"+str(self.number)+"-(" + str(self.vPos) + "," + str(self.hPos) + ")"
+
+    @property
+    def transitions(self):
+
+        if self._transitions is None:
+            if self.flat is None:
+                self._transitions = {}
+            else:
+                self._transitions = {name: {s_prime: (p, c)
+                                            for s_prime, p, c in dest}
+                                     for name, dest in zip(self.actions,
+                                                           self.flat)}
+        return self._transitions
+
+    @transitions.setter
+    def transitions(self, value):
+        self._transitions = value
     
     
     ## useful methods for RTDP -----------------------------------------------    
@@ -79,30 +151,83 @@ class State:
         account the current estimate for the values of the successor's states
         """
         
+        if action.__class__ is str:
+            action = self.actionNumber(action)
+
         Bellman_operator = 0
-        for s_prime,parameters in self.transitions[action].items():
+        for s_prime, p, c in (self.flat or self.compile())[action]:
             
-            Bellman_operator += parameters[0] * (parameters[1] + gamma * s_prime.value)
+            Bellman_operator += p * (c + gamma * s_prime.value)
         
         return Bellman_operator
     
+    #-------------------------------------------------------------------------
+    def compile(self):
+        
+        """
+        This method flattens the transitions dictionary into tuples, which are
+        much cheaper to iterate and to store. It is called by the model
+        generator once the transitions are defined, and must be called again
+        if they change. The dictionary is released.
+        """
+        
+        transitions = self.transitions
+        names = tuple(transitions.keys())
+        self.actions = actionNames.setdefault(names, names)
+        self.flat = tuple(tuple((s_prime, p[0], p[1])
+                                for s_prime, p in dest.items())
+                          for dest in transitions.values())
+        
+        probs = tuple(tuple(d[1] for d in dest) for dest in self.flat)
+        self.alias = aliasCache.get(probs)
+        if self.alias is None:
+            self.alias = aliasCache[probs] = tuple(aliasRow(row)
+                                                   for row in probs)
+        self._transitions = None
+        
+        return self.flat
+
+    def actionNumber(self, name):
+
+        if self.actions is None:
+            self.compile()
+        return self.actions.index(name)
+    
+    #-------------------------------------------------------------------------
+    def bestQ(self, gamma):
+        
+        """
+        This method computes the Q-values of all the actions in a single pass
+        and returns the greedy action (its number) together with its Q-value.
+        Ties are broken in favour of the first action.
+        """
+        
+        bestA = None
+        bestQ = None
+        a = 0
+        for dest in (self.flat or self.compile()):
+            
+            q = 0
+            for s_prime, p, c in dest:
+                q += p * (c + gamma * s_prime.value)
+                
+            if bestQ is None or q > bestQ:
+                bestA, bestQ = a, q
+            a += 1
+        
+        return bestA, bestQ
+    
     #-------------------------------------------------------------------------        
     def greedyAction(self, gamma):
         
         """
         This method computes the Q-values for all the possible actions in the 
         given state. According to these results, this method returns the 
-        greedy action which maximizes the Q-value
+        greedy action which maximizes the Q-value (its name)
         """
         
-        Bellman_dic = {}
-        for action in self.transitions.keys():
-            
-            Bellman_dic[action] = self.Qvalue(action, gamma)
-        
-        a = max(Bellman_dic.items(), key=operator.itemgetter(1))[0]
-        
-        return a
+        a = self.bestQ(gamma)[0]
+        return None if a is None else self.actions[a]
     
     #-------------------------------------------------------------------------
     def update(self,gamma):
@@ -111,42 +236,47 @@ class State:
         This method can update the value of a state in accordance with the
         greedy action.
         """
-        a = self.greedyAction(gamma)
-        self.value = self.Qvalue(a,gamma)
+        self.value = self.bestQ(gamma)[1]
+    
+    #-------------------------------------------------------------------------
+    def backup(self, gamma):
+        
+        """
+        Fused Bellman backup: greedy action, new value and residual computed
+        in one pass (greedyAction + update + Residual). The value is updated.
+        """
+        a, q = self.bestQ(gamma)
+        residual = abs(self.value - q)
+        self.value = q
+        
+        return a, q, residual
         
     #-------------------------------------------------------------------------
-    def sampleNewState(self, action):
+    def sampleNewState(self, action, rng=None):
         
         """
         This method is able to return an successor state in accoradance with
         the probability P(s'|s,a).
         Obiously, the transition model must be defined before launching this 
         method.
-        """
-        r = random()           # create a random number in the range [0,1]
-        accrualProb = 0        # initialise the accrual Probability
         
-        # Explore the dictionary {successor : [Probability, Cost]}
-        for s_prime,parameters in self.transitions[action].items():
-     
-            accrualProb += parameters[0]    # Addup the probability for this successor
-            
-            if r <= accrualProb:            # if the random number is in this
-                                            # range, I can return the successor
-                return s_prime
-            
-            else:
-                continue
-            
-        """
-        This is a fair algorithm. Imagine the following example:
-            {s1: 0.1,
-             s2: 0.8,
-             s3: 0.1}
-        accrual = 0.1 -> if r<0.1 -> return s1 with a probability of 0.1
-        accrual = 0.9 -> if r<0.9 -> return s2 with a probability of 0.8
-        accrual = 1.0 -> if r<1.0 -> return s3 with a probability of 0.1
+        The draw uses the alias tables built by compile() (see Sampling.py):
+        one random number and O(1) work, whatever the number of successors.
+        rng is the RandomStream of the solver (a default one otherwise).
         """
+        if self.alias is None:
+            self.compile()
+        if action.__class__ is str:
+            action = self.actions.index(action)
+        dest = self.flat[action]
+        threshold, alias = self.alias[action]
+        
+        x = (rng or defaultStream).random() * len(dest)
+        k = int(x)
+        if x - k < threshold[k]:
+            return dest[k][0]
+        else:
+            return dest[alias[k]][0]
             
     #-------------------------------------------------------------------------       
     def Residual(self, gamma):
@@ -156,26 +286,18 @@ class State:
         update according to the Q-value with the greedy action.
         """
         
-        a = self.greedyAction(gamma)
-        
-        return abs(self.value - self.Qvalue(a,gamma))
+        return abs(self.value - self.bestQ(gamma)[1])
         
     #------------------------------------------------------------------------
      
-    def SampleAction(self):
+    def SampleAction(self, rng=None):
          
         """
         This method returns a random action according to the transitions 
         atribute. this method is used in the rollouts of the UCT algorithm
         """
-        r = random()                # sample a random number in the range [0,1]
-        nA = len(self.transitions)  # compute the number of actions
-        deltaP = 1/nA               # compute an increment of probability
-        accrual = 0                 # accrual probability
-        for action in self.transitions.keys():
-            
-            accrual += deltaP       # addup the increment to accrual
-            if r <= accrual: return action
-            else: continue
-                
-                
\ No newline at end of file
+        if self.actions is None:
+            self.compile()
+        
+        r = (rng or defaultStream).random()   # random number in [0,1)
+        return self.actions[int(r * len(self.actions))]
@@ -1,163 +1,973 @@
 """
-This algorithm is an adptation of the classical UCT algorithm. It is based on 
+This algorithm is an adptation of the classical UCT algorithm. It is based on
 RTDP. Credits to Caroline Chanel
 
+The search is iterative: a trial walks down the tree from s0, choosing the
+actions with the UCB formula, until it reaches a terminal state, a state that
+is not in the tree yet (which is then added and initialised with rollouts) or
+the horizon. The return of the trial is then propagated back along the
+recorded path. No recursion, so long trajectories and self-loops ("Stay",
+moving against a border) cannot blow the stack.
 
-
+The tree is stored in NumPy arrays allocated by blocks (see UCTTree) and the
+model is accessed through a small simulator object, so the same engine runs
+on the declarative model (State objects, also the lazy GenerativeModel) and
+on the CompiledModel arrays.
 """
+
+##-------------------------------LIBRARIES----------------------------------##
+
 import math
-import operator
+import time
+import multiprocessing
+import numpy as np
+from Sampling import RandomStream
+from CompiledModel import CompiledModel
+from StateClass import GOAL, TERMINAL
+from Anytime import CHECK_EVERY, Deadline, Snapshot, finish
+from RealTimeDP import shareArray, attachArrays, workerArrays
+from DeadEnds import deadEnds as findDeadEnds
+
+##-------------------------------PARAMETERS---------------------------------##
+
+explorationCoef = 10     # c of the UCB formula
+deadEndValue = -5        # default value given to dead-ends
+rolloutDepth = 5         # how deep do the rollouts go?
+
+##-----------------------------Class definition-----------------------------##
+"""
+Tree of the search. The nodes are numbered in order of creation and their
+statistics are rows of preallocated arrays:
+    -int64 N   [nodes]          : visits of the node
+    -int64 Na  [nodes, A]       : times the action a was selected in the node
+    -int64 Nq  [nodes, A]       : returns averaged in Q (see below)
+    -float Q   [nodes, A]       : mean return of the pair node-action
+    -int32 child [nodes, A, K]  : node reached through the k-th successor of
+                                  (node,a), -1 if unknown, -2 if terminal
+The arrays double their capacity when they are full, so adding a node is
+amortised O(1) and the trials do not allocate anything else.
+
+Na is counted when the trial goes down (so a trial that comes back to the
+same node does not pick the same action again and again) and Nq when the
+return comes back up, which keeps Q an exact running mean:
+    Nq += 1;  Q += (q - Q) / Nq
+
+keys[node] is the state of the node and index[state] its node, the state is
+the State object itself or its number in a CompiledModel.
+
+Usage:
+    tree = UCT_like(s0, 10000, asTree=True)
+    tree.bestAction(s0), tree.Qvalues(s0)
+"""
+class UCTTree:
+
+    def __init__(self, actions, K, capacity=1024):
+
+        self.actions = tuple(actions)
+        self.A = len(self.actions)
+        self.K = K
+        self.size = 0
+        self.keys = []
+        self.index = {}
+        self.capacity = 0
+        self.grow(capacity)
+
+    def __len__(self):
+        return self.size
+
+    #-------------------------------------------------------------------------
+    def grow(self, capacity):
+
+        """
+        This method reallocates the arrays with the given capacity and copies
+        the current nodes. The flat memoryviews are what the trials index:
+        reading and writing them costs as much as a list, unlike NumPy scalar
+        indexing.
+        """
+
+        A, K, n = self.A, self.K, self.size
+        N = np.zeros(capacity, dtype=np.int64)
+        Na = np.zeros((capacity, A), dtype=np.int64)
+        Nq = np.zeros((capacity, A), dtype=np.int64)
+        Q = np.zeros((capacity, A), dtype=np.float64)
+        child = np.full((capacity, A, K), -1, dtype=np.int32)
+
+        if n:
+            N[:n] = self.N[:n]
+            Na[:n] = self.Na[:n]
+            Nq[:n] = self.Nq[:n]
+            Q[:n] = self.Q[:n]
+            child[:n] = self.child[:n]
+
+        self.N, self.Na, self.Nq, self.Q, self.child = N, Na, Nq, Q, child
+        self.capacity = capacity
+        self.views = tuple(memoryview(x).cast("B").cast(x.dtype.char)
+                           for x in (N, Na, Nq, Q, child))
+
+    #-------------------------------------------------------------------------
+    def addNode(self, key):
+
+        """
+        This method adds the node of a state and returns it together with
+        True (the caller created it, see SharedTree). The node starts with
+        N = Na = Nq = 1 and Q = 0, a placeholder sample that the caller
+        replaces with its leaf values, so a node is never visible with no
+        visits.
+        """
+
+        if self.size == self.capacity:
+            self.grow(2 * self.capacity)
+
+        node = self.size
+        self.size += 1
+        self.keys.append(key)
+        initNode(self.views, node, self.A)
+        self.index[key] = node
+
+        return node, True
+
+    #-------------------------------------------------------------------------
+    def node(self, s):
+        return self.index.get(s)
+
+    def Qvalues(self, s):
+
+        """
+        Q-values of the state s as a dictionary {action: Q}, empty if s is
+        not in the tree.
+        """
+
+        node = self.index.get(s)
+        if node is None:
+            return {}
+        return dict(zip(self.actions, self.Q[node].tolist()))
+
+    def bestAction(self, s):
+
+        """
+        Action with the best mean return in s (None if s is not in the tree)
+        """
+
+        node = self.index.get(s)
+        if node is None:
+            return None
+        return self.actions[int(self.Q[node].argmax())]
+
+    def value(self, s):
+
+        node = self.index.get(s)
+        if node is None:
+            return None
+        return float(self.Q[node].max())
+
+    #-------------------------------------------------------------------------
+    def asGraph(self):
+
+        """
+        This method returns the tree with the nested dictionaries of the
+        previous version of UCT_like:
+            G = {s: {a: {"Q-value": Q(s,a), "Na": Na(s,a)}, "N": N(s)}}
+        """
+
+        G = {}
+        N, Na, Q = self.N.tolist(), self.Na.tolist(), self.Q.tolist()
+        for node, s in enumerate(self.keys):
+
+            G[s] = {"N": N[node]}
+            for a, action in enumerate(self.actions):
+                G[s][action] = {"Q-value": Q[node][a], "Na": Na[node][a]}
+
+        return G
+
+
+##-------------------------------SIMULATORS---------------------------------##
+"""
+The engine only needs three things from the model:
+    -terminal(s)       : value of s if it is a goal or a dead-end, else None
+    -step(s, a, rng)   : (successor, cost, k) for the action number a, where
+                         k is the slot of the successor (for child pointers)
+    -actions, K        : names of the actions, maximum number of successors
+and number(s), the index of s in the heuristic arrays (see Rollout).
+Both simulators sample with the alias tables (see Sampling.py).
+"""
+class StateSimulator:
+
+    def __init__(self, s0, deadEnd=deadEndValue):
+
+        flat = s0.flat or s0.compile()
+        self.actions = s0.actions
+        self.K = max(len(dest) for dest in flat)
+        self.deadEnd = deadEnd
+
+    def terminal(self, s):
+
+        if s.flags & GOAL:
+            return 0.0
+        elif s.flags & TERMINAL:
+            return self.deadEnd
+        return None
+
+    def number(self, s):
+        return s.number
+
+    def step(self, s, a, rng):
+
+        dest = (s.flat or s.compile())[a]
+        threshold, alias = s.alias[a]
+
+        x = rng.random() * len(dest)
+        k = int(x)
+        if x - k >= threshold[k]:
+            k = alias[k]
+
+        return dest[k][0], dest[k][2], k
+
+
 #----------------------------------------------------------------------------#
+class ArraySimulator:
+
+    def __init__(self, model, deadEnd=deadEndValue, deadEnds=None):
+
+        S, A, K = model.succ.shape
+        threshold, alias = model.aliasTables()
+
+        self.actions = model.actions
+        self.A, self.K = A, K
+        self.deadEnd = deadEnd
+
+        # flat views of the arrays, indexed by (s*A + a)*K + k
+        self.arrays = (np.ascontiguousarray(model.succ, dtype=np.int32),
+                       np.ascontiguousarray(model.cost, dtype=np.float64),
+                       np.ascontiguousarray(threshold, dtype=np.float64),
+                       np.ascontiguousarray(alias, dtype=np.int8))
+        self.succ, self.cost, self.threshold, self.alias = (
+            memoryview(x).cast("B").cast(x.dtype.char) for x in self.arrays)
+
+        self.rolloutTables = None
+
+        # deadEnds: optional bool mask of the dead-ends (see DeadEnds.py)
+        dead = model.obstacle if deadEnds is None else model.obstacle | deadEnds
+        self.isTerminal = model.goal | dead
+        self.leafValue = np.where(dead, float(deadEnd), 0.0)
+        self.leaf = [None] * S
+        for s in np.flatnonzero(self.isTerminal).tolist():
+            self.leaf[s] = float(self.leafValue[s])
+
+    def terminal(self, s):
+        return self.leaf[s]
+
+    def number(self, s):
+        return s
+
+    def tables(self, gamma):
+
+        """
+        Flat tables of the batch rollouts (see batchRollout): successors,
+        costs, threshold and alias. The terminal states become absorbing
+        with cost 0 and the transitions into them pay gamma * their value,
+        so a rollout which has ended keeps adding zeros and needs no mask.
+        """
+
+        if self.rolloutTables is None or self.rolloutTables[0] != gamma:
+
+            succ, cost, threshold, alias = self.arrays
+            S, A, K = succ.shape
+            cost = cost + gamma * self.leafValue[succ]
+            cost[self.isTerminal] = 0
+            succ = succ.copy()
+            succ[self.isTerminal] = np.arange(S)[self.isTerminal, None, None]
+            self.rolloutTables = (gamma, succ.ravel(), cost.ravel(),
+                                  threshold.ravel(), alias.ravel())
+
+        return self.rolloutTables[1:]
+
+    def step(self, s, a, rng):
+
+        K = self.K
+        base = (s * self.A + a) * K
+        x = rng.random() * K
+        k = int(x)
+        if x - k >= self.threshold[base + k]:
+            k = self.alias[base + k]
+
+        return self.succ[base + k], self.cost[base + k], k
+
+
+##---------------------------------ROLLOUT----------------------------------##
 """
-The Rollout function is used to initialise the Q-value of a new node in the 
+The Rollout function is used to initialise the Q-value of a new node in the
 Graph. It basically returns an estimation of the long term cost/reward starting
 from the child "s".
-Note that the rollout do not need to end in the goal.
+Note that the rollout do not need to end in the goal, but it stops if it
+reaches a terminal state (its value is added). If it does not, the optional
+heuristic (an array of values indexed by the state number) estimates the rest
+of the path.
 """
-def Rollout(s):
-    
-    depth = 5       # Define the depth parameter, how deep do you want to go?
-    nRollout = 0    # initialise the rollout counter
+def Rollout(sim, s, rng, depth=rolloutDepth, gamma=1.0, heuristic=None):
+
+    A = len(sim.actions)
     payoff = 0      # initialise the cummulative cost/reward
-    while nRollout < depth:
-        # The rollouts progress with random actions -> sample an action
-        a = s.SampleAction()
-        print(a)
-        # Sample a state according to P(s'|s,a)
-        successor = s.sampleNewState(a)
-        print(successor)
-        # Compute the inmediate cost/reward and update the payoff
-        payoff += s.transitions[a][successor][1]
-        print(payoff)
-        # update the current state with the sampled successor
-        s = successor
-        # increase the rollout counter
-        nRollout += 1
+    discount = 1
+    for nRollout in range(depth):
+
+        v = sim.terminal(s)
+        if v is not None:
+            return payoff + discount * v
+
+        # The rollouts progress with random actions
+        s, c, k = sim.step(s, int(rng.random() * A), rng)
+        payoff += discount * c
+        discount *= gamma
+
+    v = sim.terminal(s)
+    if v is not None:
+        return payoff + discount * v
+    if heuristic is not None:
+        payoff += discount * heuristic[sim.number(s)]
+
     return payoff
 
-#----------------------------------------------------------------------------#    
+
+#----------------------------------------------------------------------------#
+"""
+Vectorized rollouts of a leaf: n rollouts for every action of the state s,
+all of them advanced together, one NumPy pass per step over the arrays of
+the ArraySimulator. Row a of the batch starts with the action a and goes on
+with random actions, exactly like cost(s,a,s') + gamma * Rollout(s'). The
+rollouts that reach a terminal state get its value and then add zeros (see
+ArraySimulator.tables); the others get the heuristic tail (if any) after
+depth random steps.
+
+inputs:
+    - ArraySimulator sim, int s, RandomStream rng
+    - int n     : rollouts per action
+    - depth, gamma, heuristic : as in Rollout
+outputs:
+    - float arrays mean [A] and variance [A] of the returns of each action
 """
-The action selection method is the heart of UCT. It is the way the algorithm 
-deals with the exploration-exploitation dilemma. Namely, UCT takes the ideas 
+def batchRollout(sim, s, rng, n=32, depth=rolloutDepth, gamma=1.0,
+                 heuristic=None):
+
+    A, K = sim.A, sim.K
+    succ, cost, threshold, alias = sim.tables(gamma)
+
+    # all the random numbers at once: [step, action or slot, A, n]
+    u = rng.generator.random((depth + 1, 2, A, n))
+    states = np.full((A, n), s, dtype=np.int64)
+    actions = np.repeat(np.arange(A), n).reshape(A, n)
+    payoff = np.zeros((A, n))
+    discount = 1.0
+
+    for step in range(depth + 1):
+
+        if step:
+            actions = (u[step, 0] * A).astype(np.int64)
+        base = (states * A + actions) * K
+
+        # alias draw (see Sampling.py) on the flat tables
+        x = u[step, 1] * K
+        k = x.astype(np.int64)
+        slot = base + k
+        slot = np.where(x - k < threshold.take(slot), slot,
+                        base + alias.take(slot))
+
+        payoff += discount * cost.take(slot)
+        states = succ.take(slot)
+        discount *= gamma
+
+    if heuristic is not None:
+        tail = np.asarray(heuristic, dtype=np.float64).take(states)
+        payoff += discount * np.where(sim.isTerminal[states], 0, tail)
+
+    variance = payoff.var(axis=1, ddof=1) if n > 1 else np.zeros(A)
+    return payoff.mean(axis=1), variance
+
+
+#----------------------------------------------------------------------------#
+"""
+Initial Q-values of a new node: the mean of n rollouts per action. They are
+batched on the compiled model, one by one (Rollout) on the State objects or
+when n = 1, which is cheaper without the NumPy overhead.
+"""
+def leafValues(sim, s, rng, n=1, depth=rolloutDepth, gamma=1.0,
+               heuristic=None):
+
+    if n > 1 and isinstance(sim, ArraySimulator):
+        return batchRollout(sim, s, rng, n, depth, gamma, heuristic)[0].tolist()
+
+    values = []
+    for a in range(len(sim.actions)):
+        total = 0
+        for r in range(n):
+            successor, cost, k = sim.step(s, a, rng)
+            total += cost + gamma * Rollout(sim, successor, rng, depth, gamma,
+                                            heuristic)
+        values.append(total / n)
+
+    return values
+
+"""
+This function gives a new node its placeholder statistics (see addNode).
+"""
+def initNode(views, node, A):
+
+    N, Na, Nq, Q, child = views
+    N[node] = 1
+    row = node * A
+    for a in range(A):
+        Na[row + a] = 1
+        Nq[row + a] = 1
+        Q[row + a] = 0.0
+
+##----------------------------ACTION SELECTION------------------------------##
+"""
+The action selection method is the heart of UCT. It is the way the algorithm
+deals with the exploration-exploitation dilemma. Namely, UCT takes the ideas
 of bandit problems and applies the UCB formula to solve the conflict. In this
 formula there is a term that votes for exploitation of the best current policy.
 By contrast, the other term is devoted to exploring less visited nodes.
 
-It receives the current Graph as input because this function doesn't modify 
-the graph.
-
-"""
-def ActionSelection(s,G):
-    c = 10           # Exploration coefficient 
-    UCB = {}         # Dictionary to save the result of UCB for each action
-    
-    for a in  G[s].keys():          # UCB formula
-        if not a=="N":              # a key of this dictionary is not an action
-            UCB[a] = G[s][a]["Q-value"] + c * math.sqrt(math.log(G[s]["N"])/G[s][a]["Na"])
-
-    # choose the action that maximize the UCB formula    
-    a_UCB = max(UCB.items(), key=operator.itemgetter(1))[0]
-    return a_UCB
-    
-#----------------------------------------------------------------------------#   
-def UCT_Trial(s):
-    
-    global G           # Make sure that I have access to the graph
-    K = -5             # Internal parameter -> asociated cost to dead-ends
-    
-    # 1) CHECK IF THE STATE IS TERMINAL---------------------------------------
-        # as a reminder: in finite horizion MDP terminal means that the final
-        # decision epoch has been reached. In infinte horizon (disc. reward) 
-        # MDP, the terminal states are the goals and the dead-ends.
-        
-    if s.goal : return 0               # No cost to reach the goal
-    elif s.obstacle: return K          # Penalty for dead-ends
-        
-    # 2) CHECK IF THE STATE IS ALREADY IN THE GRAPH---------------------------
-    if s not in G:
-        
-        # create a new node in the graph if this is a new state
-        G[s] = {}             # intialise node's dictionary
-        G[s]["N"] = 1         # Count the first visit to the node                            ESTO NO ESTA EN EL CODIGO
-        
-        # initialise the Q-values based on rollouts
-        # note that all the possible actions are tested
-        # note that the childs are not created in the graph
-        aux = []              # empty list to ease the maximization
-        for a in s.transitions.keys():
-            
-            # Sample a successor according to the generative model
-            successor = s.sampleNewState(a)
-            print("successor pre rollout",successor)
-            
-            # the Qvalue is the inmediate cost/reward plus the long term
-            # cost/reward that is estimated through a rollout
-            G[s][a]={}
-            G[s][a]["Q-value"] = s.transitions[a][successor][1] + Rollout(successor)
-            aux.append(G[s][a]["Q-value"])  
-            
-            # Register the visit for this pair s-a
-            G[s][a]["Na"]= 1
-        
-        rv = max(aux)        # the return value is the max Q(s,a)
-        aux = []             # clear the auxiliary list
-        return rv
-    
-    # 3) EXPAND THE NODE IF IT'S ALREADY IN THE GRAPH ------------------------
-        # To expand a node, UCT applies the action selection  
-        # strategy that is based on the UCB formula    
-    a_UCB = ActionSelection(s,G)
-    
-    # 4) SAMPLE A CHILD FOLLOWING PLAYING THIS ACTION ------------------------
-    successor = s.sampleNewState(a_UCB)
-    
-    # 6) UPDATE THE COUNTERS -------------------------------------------------
-    G[s]["N"] += 1
-    G[s][a_UCB]["Na"] += 1   # I've reversed the order to solve cycles.....let's see
-    
-    # 5) WHAT IS THIS? -------------------------------------------------------
-    QvaluePrime =  s.transitions[a_UCB][successor][1] + UCT_Trial(successor)  
-    """
-    Problems here! If UCT_Trial(s*) tells me that a_UCB is "stay" the successor
-    will be s* (not only the problem of "stay" imagine playing "north" in 
-    the border...). This means that I will call again UCT_Trial(s*) that will
-    give me the same a_UCB and consequently, I will enter an infinite loop.
-    
-    how to solve? if the successor is the same then change the action? do I 
-    have to cvhange ActionSelection method or solve it at this level....
-    
-    """      
-    
-
-    
-    # 7) UPDATE THE Q-VALUE OF THE PAIR (s,a_UCB)-----------------------------
-    G[s][a_UCB]["Q-value"] += (QvaluePrime + G[s][a_UCB]["Q-value"]) / G[s][a_UCB]["Na"]
-    
-    return QvaluePrime       
-    
-#----------------------------------------------------------------------------#    
-"""
-This is the skeleton of the UCT: it relies on the UCT_Trial mnethod wich will
-update and refine the information in G, a global variable which represents
-the current partial tree. The desired architecture for this variable is:
-    
-    G = { s1: {a1 : {"Q-value" : current estimation for Q(s1,a1)
-                        "Na"   : number of times we have played a1 in s1}
-               a2 : {...}
-               N  : Number of times this State has been visited} 
-         
-         s2:{...}
-         }
-"""
-def UCT_like(s0, maxTrials):
-    
-    nTrial = 0                         # initialize the trial counter
-    global G                           # make a global variable so that all 
-                                       # the functions can modify it
-    G = {}                             # initialize a graph
-    while nTrial < maxTrials :         # perform trials while possible
-        
-        UCT_Trial(s0)
+inputs: flat views Na, Q of the tree, first row index of the node, number of
+        actions, visits of the node and exploration coefficient
+        (optional) flat view Nq and virtual loss, see UCT_treeParallel
+output: number of the action that maximizes the UCB formula
+"""
+def ActionSelection(Na, Q, row, A, N, c, Nq=None, virtualLoss=0):
+
+    logN = math.log(N) if N > 1 else 0.0
+    best = 0
+    bestU = None
+    for a in range(A):
+        if Na[row + a] <= 0:
+            return a                    # never tried
+        u = Q[row + a] + c * math.sqrt(logN / Na[row + a])
+        if virtualLoss:
+            # descents in flight through (s,a): Na is counted, Nq is not yet
+            u -= virtualLoss * (Na[row + a] - Nq[row + a]) / Na[row + a]
+        if bestU is None or u > bestU:
+            best, bestU = a, u
+
+    return best
+
+##----------------------------------TRIAL-----------------------------------##
+"""
+One simulation from s0:
+    1) go down the tree with ActionSelection until a terminal state, a new
+       state or the horizon is reached (the path is recorded)
+    2) a new state is added to the tree: its Q-values are initialised with
+       the mean of n rollouts per action (see leafValues)
+    3) the return is propagated back along the path with the running mean
+A deadline (see Anytime.py), checked every CHECK_EVERY steps of the
+descent, ends it as the horizon does. It returns the length of the path. The
+optional Probe (see Probe.py) receives the "nodes" created, the "rollouts",
+the "samples" of the descent, the "trialLength" and the "selection",
+"rollout" and "backpropagation" timers.
+"""
+def UCT_Trial(tree, sim, s0, rng, c=explorationCoef, gamma=1.0,
+              horizon=1000, depth=rolloutDepth, n=1, heuristic=None,
+              virtualLoss=0, probe=None, deadline=None):
+
+    deadline = Deadline.of(deadline)
+    A, K = tree.A, tree.K
+    path = []
+    t = probe.tic() if probe is not None else None
+
+    s = s0
+    node = tree.index.get(s0)
+    leaf = sim.terminal(s0)
+    slot = -1
+
+    while leaf is None:
+
+        # 2) NEW STATE: EXPAND IT AND STOP ----------------------------------
+        if node is None:
+            node, created = tree.addNode(s)
+            N, Na, Nq, Q, child = tree.views
+            if slot >= 0:
+                child[slot] = node      # pointer of the edge that led here
+            if not created:
+                continue                # another worker expands it
+            row = node * A
+            if probe is not None:
+                probe.toc("selection", t)
+                t = probe.tic()
+            values = leafValues(sim, s, rng, n, depth, gamma, heuristic)
+            if probe is not None:
+                probe.toc("rollout", t)
+                probe.count("nodes")
+                probe.count("rollouts", n * A)
+                t = None                # the descent is already timed
+            # the values replace the placeholder sample of addNode in the
+            # means (other workers may have added theirs meanwhile)
+            for a in range(A):
+                Q[row + a] += values[a] / Nq[row + a]
+            leaf = max(values)
+            break
+
+        N, Na, Nq, Q, child = tree.views
+        row = node * A
+        if len(path) == horizon or (not len(path) % CHECK_EVERY
+                                    and deadline.expired()):
+            leaf = max(Q[row:row + A])
+            break
+
+        # 1) SELECT AN ACTION AND SAMPLE A CHILD -----------------------------
+        a = ActionSelection(Na, Q, row, A, N[node], c, Nq, virtualLoss)
+        N[node] += 1
+        Na[row + a] += 1
+
+        successor, cost, k = sim.step(s, a, rng)
+        path.append((row + a, cost))
+
+        slot = (row + a) * K + k if k < K else -1
+        pointer = child[slot] if slot >= 0 else -1
+        if pointer >= 0:
+            node = pointer
+        elif pointer == -2:
+            leaf = sim.terminal(successor)
+        else:
+            leaf = sim.terminal(successor)
+            if leaf is not None:
+                pointer = -2
+            else:
+                node = tree.index.get(successor)
+                pointer = -1 if node is None else node
+            if slot >= 0:
+                child[slot] = pointer
+        s = successor
+
+    # 3) BACKPROPAGATION -----------------------------------------------------
+    if probe is not None:
+        probe.toc("selection", t)
+        t = probe.tic()
+    N, Na, Nq, Q, child = tree.views
+    G = leaf
+    for pair, cost in reversed(path):
+        G = cost + gamma * G
+        Nq[pair] += 1
+        Q[pair] += (G - Q[pair]) / Nq[pair]
+
+    if probe is not None:
+        probe.toc("backpropagation", t)
+        probe.count("samples", len(path))
+        probe.observe("trialLength", len(path))
+
+    return len(path)
+
+##----------------------------------UCT-------------------------------------##
+"""
+This is the skeleton of the UCT: it relies on the UCT_Trial method wich will
+update and refine the information in the tree.
+
+inputs:
+    - s0        : initial State, or number of the initial state if a
+                  CompiledModel is given (None -> model.initial)
+    - maxTrials : number of simulations (None -> no limit, use a deadline)
+    - seed      : seed of the random numbers of this run
+    - model     : CompiledModel to search on instead of the State objects
+    - c, gamma  : exploration coefficient and discount factor
+    - horizon   : maximum length of the path of a trial
+    - depth     : length of the rollouts
+    - rollouts  : rollouts per action to initialise a new node (batched on
+                  a CompiledModel, see batchRollout)
+    - heuristic : optional array of values indexed by the state number, to
+                  estimate the end of the rollouts
+    - workers   : number of processes (None -> sequential, in this process)
+    - mode      : "root" or "tree" parallelism, see below
+    - virtualLoss : penalty of the descents in flight (tree parallelism)
+    - deadEnd   : value of the dead-ends (obstacles)
+    - deadEnds  : bool mask of all the dead-ends of a CompiledModel (see 
+                  DeadEnds.py), True -> computed here. The descents and the
+                  rollouts stop on them. With State objects, mark them with
+                  markDeadEnds instead.
+    - deadline  : seconds or Deadline (see Anytime.py), checked every
+                  CHECK_EVERY steps of the trials
+    - stats     : optional dict, filled with "trials", "nodes" and "steps"
+                  (totals over the workers in the parallel modes), "stop",
+                  "elapsed", the best "action" at s0 and its "value"; the
+                  parallel modes add "simsPerSec" and the "workerTrials" and
+                  "workerThroughput" of each worker
+    - probe     : optional Probe (see Probe.py), receives the counters and
+                  timers of UCT_Trial, the "trials" and an event per trial.
+                  The parallel modes only report the total of "trials".
+    - asTree    : False -> return the graph of nested dictionaries of the
+                  previous versions (see UCTTree.asGraph), True -> return
+                  the UCTTree itself, without the conversion
+output:
+    - G = {s: {a: {"Q-value": Q(s,a), "Na": Na(s,a)}, "N": N(s)}}, or the
+      UCTTree if asTree
+"""
+def UCT_like(s0, maxTrials, seed=None, model=None, c=explorationCoef,
+             gamma=1.0, horizon=1000, depth=rolloutDepth, rollouts=1,
+             heuristic=None, workers=None, mode="root", virtualLoss=1.0,
+             deadEnd=deadEndValue, deadEnds=None, deadline=None, stats=None,
+             probe=None, asTree=False):
+
+    start = time.monotonic()
+    deadline = Deadline.of(deadline)
+    if deadEnds is True:
+        deadEnds = findDeadEnds(model)
+    if workers is not None:
+        options = {"c": c, "gamma": gamma, "horizon": horizon,
+                   "depth": depth, "rollouts": rollouts,
+                   "heuristic": heuristic, "deadEnd": deadEnd,
+                   "deadEnds": deadEnds, "deadline": deadline}
+        if probe is not None and stats is None:
+            stats = {}
+        if mode == "root":
+            tree = UCT_rootParallel(s0, maxTrials, workers, seed, model,
+                                    options, stats)
+        elif mode == "tree":
+            tree = UCT_treeParallel(s0, maxTrials, workers, seed, model,
+                                    options, virtualLoss, stats)
+        else:
+            raise ValueError("UCT: unknown parallel mode %r" % (mode,))
+        if stats is not None:
+            stats["elapsed"] = time.monotonic() - start
+        if probe is not None:
+            probe.count("trials", stats["trials"])
+        return tree if asTree else tree.asGraph()
+
+    sim, s0 = simulator(s0, model, deadEnd, deadEnds)
+    tree = UCTTree(sim.actions, sim.K)
+    rng = RandomStream(seed)           # random numbers of this run
+    steps = 0
+    nTrial = 0
+    stop = "trials"
+    while maxTrials is None or nTrial < maxTrials:
+
+        if deadline.expired():         # perform trials while possible
+            stop = "deadline"
+            break
+        length = UCT_Trial(tree, sim, s0, rng, c, gamma, horizon, depth,
+                           rollouts, heuristic, probe=probe,
+                           deadline=deadline)
+        steps += length
         nTrial += 1
-        
-    return G     
\ No newline at end of file
+        if probe is not None:
+            probe.count("trials")
+            probe.event("UCT", trial=nTrial, length=length, nodes=len(tree))
+
+    finish(stats, start, stop, trials=nTrial, nodes=len(tree), steps=steps,
+           action=tree.bestAction(s0), value=tree.value(s0))
+
+    return tree if asTree else tree.asGraph()
+
+
+#----------------------------------------------------------------------------#
+"""
+Generator version of UCT_like (see Anytime.py), sequential only: the same
+trials, with a Snapshot every "every" trials and a last one, whose stop is
+set, when maxTrials or the deadline is reached. The snapshots give the best
+action at s0, its value and the tree.
+"""
+def iter_UCT(s0, maxTrials=None, seed=None, model=None, c=explorationCoef,
+             gamma=1.0, horizon=1000, depth=rolloutDepth, rollouts=1,
+             heuristic=None, deadEnd=deadEndValue, deadEnds=None,
+             deadline=None, every=1):
+
+    start = time.monotonic()
+    deadline = Deadline.of(deadline)
+    if deadEnds is True:
+        deadEnds = findDeadEnds(model)
+    sim, s0 = simulator(s0, model, deadEnd, deadEnds)
+    tree = UCTTree(sim.actions, sim.K)
+    rng = RandomStream(seed)
+    nTrial = 0
+    stop = None
+    while True:
+
+        if stop is not None or (nTrial and nTrial % every == 0):
+            yield Snapshot(nTrial, None, tree.value(s0), tree.bestAction(s0),
+                           time.monotonic() - start, stop, tree=tree)
+        if stop is not None:
+            return
+
+        UCT_Trial(tree, sim, s0, rng, c, gamma, horizon, depth, rollouts,
+                  heuristic, deadline=deadline)
+        nTrial += 1
+
+        if maxTrials is not None and nTrial >= maxTrials:
+            stop = "trials"
+        elif deadline.expired():
+            stop = "deadline"
+
+
+"""
+This function returns the simulator of the search and the initial state:
+the arrays of a CompiledModel (s0 is a state number, model.initial by 
+default) or the State objects.
+"""
+def simulator(s0, model, deadEnd, deadEnds):
+
+    if isinstance(model, CompiledModel):
+        sim = ArraySimulator(model, deadEnd, deadEnds)
+        s0 = model.initial if s0 is None else int(s0)
+    else:
+        sim = StateSimulator(s0, deadEnd)
+
+    return sim, s0
+
+
+##-------------------------------PARALLEL UCT-------------------------------##
+"""
+The workers are processes (the GIL would serialise threads running the
+trials). The fork start method is preferred: the workers inherit s0 and the
+model instead of receiving a pickled copy of a graph of State objects.
+
+The trials are split among the workers and each one gets an independent
+random stream of the seed, as in RTDP_parallel.
+"""
+
+def processContext():
+
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("fork" if "fork" in methods else None)
+
+
+def splitTrials(maxTrials, workers, seed):
+
+    if maxTrials is None:
+        chunks = [None] * workers
+    else:
+        chunks = [maxTrials // workers + (w < maxTrials % workers)
+                  for w in range(workers)]
+    return chunks, np.random.SeedSequence(seed).spawn(workers)
+
+
+def workerStats(stats, results, wall, deadline, s0, tree, nodes, steps):
+
+    stats["stop"] = "deadline" if deadline.expired() else "trials"
+    stats["action"] = tree.bestAction(s0)
+    stats["value"] = tree.value(s0)
+    stats["trials"] = sum(r[0] for r in results)
+    stats["nodes"] = nodes
+    stats["steps"] = steps
+    stats["workerTrials"] = [r[0] for r in results]
+    stats["workerThroughput"] = [r[0] / r[1] if r[1] > 0 else 0.0
+                                 for r in results]
+    stats["simsPerSec"] = stats["trials"] / wall if wall > 0 else 0.0
+
+
+#----------------------------------------------------------------------------#
+"""
+Root parallelism: every worker grows its own tree from s0 with its share of
+the trials, and only the statistics of the root are merged:
+    N, Na, Nq : sums over the workers
+    Q         : mean of the workers' Q weighted by their Nq
+The result is a UCTTree with a single node, s0, which is what the agent
+needs to act.
+"""
+
+# s0 and model of a worker process
+rootWorker = {}
+
+def initRootWorker(s0, model):
+
+    rootWorker["s0"] = s0
+    rootWorker["model"] = model
+
+
+def runRootTrials(nTrials, seed, options):
+
+    start = time.perf_counter()
+    stats = {}
+    s0 = rootWorker["s0"]
+    tree = UCT_like(s0, nTrials, seed, rootWorker["model"], stats=stats,
+                    asTree=True, **options)
+    elapsed = time.perf_counter() - start
+
+    node = tree.node(s0)
+    if node is None:                   # s0 is terminal
+        return stats["trials"], elapsed, stats["nodes"], None, stats["steps"]
+    return (stats["trials"], elapsed, stats["nodes"],
+            (int(tree.N[node]), tree.Na[node].copy(), tree.Nq[node].copy(),
+             tree.Q[node].copy()), stats["steps"])
+
+
+def UCT_rootParallel(s0, maxTrials, workers, seed, model, options,
+                     stats=None):
+
+    if isinstance(model, CompiledModel):
+        s0 = model.initial if s0 is None else int(s0)
+        actions, K = model.actions, model.succ.shape[2]
+    else:
+        sim = StateSimulator(s0)
+        actions, K = sim.actions, sim.K
+
+    chunks, seeds = splitTrials(maxTrials, workers, seed)
+    start = time.perf_counter()
+    with processContext().Pool(workers, initializer=initRootWorker,
+                               initargs=(s0, model)) as pool:
+        results = pool.starmap(runRootTrials,
+                               [(chunks[w], seeds[w], options)
+                                for w in range(workers)])
+    wall = time.perf_counter() - start
+
+    tree = UCTTree(actions, K, capacity=1)
+    roots = [r[3] for r in results if r[3] is not None]
+    if roots:
+        node = tree.addNode(s0)[0]
+        tree.N[node] = sum(r[0] for r in roots)
+        tree.Na[node] = sum(r[1] for r in roots)
+        tree.Nq[node] = sum(r[2] for r in roots)
+        tree.Q[node] = sum(r[2] * r[3] for r in roots) / tree.Nq[node]
+
+    if stats is not None:
+        workerStats(stats, results, wall, options["deadline"], s0, tree,
+                    sum(r[2] for r in results), sum(r[4] for r in results))
+
+    return tree
+
+
+#----------------------------------------------------------------------------#
+"""
+Tree parallelism: all the workers run trials on the same tree, which lives
+in shared memory. It needs a CompiledModel, the states are numbers and the
+index state -> node is a shared array (nodeOf) too. Each trial adds at most
+one node, so the capacity min(S, maxTrials + 1) is allocated at once.
+
+There are no locks on the statistics, as in RTDP_parallel: concurrent updates
+of the same pair may lose an increment, which only adds a little noise to
+the means. Only the creation of nodes takes a lock, so that a state never
+gets two nodes. The node is initialised (see UCTTree.addNode) before it is
+published in nodeOf, and only the worker that created it runs its rollouts:
+the others go on descending through it.
+
+Virtual loss: Na is counted on the way down and Nq on the way back up, so
+Na - Nq is the number of descents in flight through (s,a). ActionSelection
+lowers their UCB value by virtualLoss * (Na - Nq) / Na, which spreads the
+concurrent descents over different branches.
+"""
+class SharedTree(UCTTree):
+
+    def __init__(self, actions, K, arrays, lock):
+
+        self.actions = tuple(actions)
+        self.A = len(self.actions)
+        self.K = K
+        self.N, self.Na, self.Nq, self.Q, self.child = (
+            arrays[name] for name in ("N", "Na", "Nq", "Q", "child"))
+        self.nodeOf = arrays["nodeOf"]
+        self.keyOf = arrays["keyOf"]
+        self.counter = arrays["counter"]
+        self.capacity = self.N.shape[0]
+        self.views = tuple(memoryview(x).cast("B").cast(x.dtype.char)
+                           for x in (self.N, self.Na, self.Nq, self.Q,
+                                     self.child))
+        self.nodes = memoryview(self.nodeOf).cast("B").cast("i")
+        self.index = self              # UCT_Trial calls tree.index.get(s)
+        self.lock = lock
+
+    @property
+    def size(self):
+        return int(self.counter[0])
+
+    def get(self, s):
+
+        node = self.nodes[s]
+        return None if node < 0 else node
+
+    def addNode(self, key):
+
+        with self.lock:
+            node = self.nodes[key]
+            if node >= 0:
+                return node, False
+            node = int(self.counter[0])
+            self.counter[0] = node + 1
+            self.keyOf[node] = key
+            initNode(self.views, node, self.A)
+            self.nodes[key] = node      # published once initialised
+
+        return node, True
+
+
+# simulator and lock of a worker process
+treeWorker = {}
+
+def initTreeWorker(specs, lock, model, options):
+
+    attachArrays(specs)
+    treeWorker["lock"] = lock
+    treeWorker["sim"] = ArraySimulator(model, options["deadEnd"],
+                                       options["deadEnds"])
+
+
+def runTreeTrials(s0, nTrials, seed, options, virtualLoss):
+
+    sim = treeWorker["sim"]
+    tree = SharedTree(sim.actions, sim.K, workerArrays, treeWorker["lock"])
+    rng = RandomStream(seed)
+    deadline = options["deadline"]
+
+    start = time.perf_counter()
+    steps = 0
+    n = 0
+    while (nTrials is None or n < nTrials) and not deadline.expired():
+        steps += UCT_Trial(tree, sim, s0, rng, options["c"],
+                           options["gamma"], options["horizon"],
+                           options["depth"], options["rollouts"],
+                           options["heuristic"], virtualLoss,
+                           deadline=deadline)
+        n += 1
+
+    return n, time.perf_counter() - start, steps
+
+
+def UCT_treeParallel(s0, maxTrials, workers, seed, model, options,
+                     virtualLoss=1.0, stats=None):
+
+    if not isinstance(model, CompiledModel):
+        raise ValueError("UCT: tree parallelism needs a CompiledModel")
+
+    s0 = model.initial if s0 is None else int(s0)
+    S, A, K = model.succ.shape
+    capacity = S if maxTrials is None else min(S, maxTrials + 1)
+    model.aliasTables()                # built once, before the fork
+
+    blocks = []
+    arrays = {"N"      : np.zeros(capacity, dtype=np.int64),
+              "Na"     : np.zeros((capacity, A), dtype=np.int64),
+              "Nq"     : np.zeros((capacity, A), dtype=np.int64),
+              "Q"      : np.zeros((capacity, A)),
+              "child"  : np.full((capacity, A, K), -1, dtype=np.int32),
+              "nodeOf" : np.full(S, -1, dtype=np.int32),
+              "keyOf"  : np.zeros(capacity, dtype=np.int32),
+              "counter": np.zeros(1, dtype=np.int64)}
+    specs = {name: shareArray(a, blocks) for name, a in arrays.items()}
+
+    chunks, seeds = splitTrials(maxTrials, workers, seed)
+    context = processContext()
+    lock = context.Lock()
+
+    try:
+        start = time.perf_counter()
+        with context.Pool(workers, initializer=initTreeWorker,
+                          initargs=(specs, lock, model, options)) as pool:
+            results = pool.starmap(runTreeTrials,
+                                   [(s0, chunks[w], seeds[w], options,
+                                     virtualLoss) for w in range(workers)])
+        wall = time.perf_counter() - start
+
+        # copy the shared tree into a regular one
+        for (name, a), shm in zip(arrays.items(), blocks):
+            a[...] = np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    n = int(arrays["counter"][0])
+    tree = UCTTree(model.actions, K, capacity=max(n, 1))
+    for name in ("N", "Na", "Nq", "Q", "child"):
+        getattr(tree, name)[:n] = arrays[name][:n]
+    tree.keys = arrays["keyOf"][:n].tolist()
+    tree.index = {s: node for node, s in enumerate(tree.keys)}
+    tree.size = n
+
+    if stats is not None:
+        workerStats(stats, results, wall, options["deadline"], s0, tree, n,
+                    sum(r[2] for r in results))
+
+    return tree
@@ -1,6 +1,14 @@
 ##-------------------------------LIBRARIES----------------------------------##
 
 import operator
+import heapq
+import time
+from collections import deque
+import numpy as np
+from CompiledModel import CompiledModel, compileModel, predecessorIndex
+from Anytime import Deadline, Snapshot, finish
+
+REQUEUE = 1.5            # growth of a priority that queues the state again
 
 ##----------------------------Function description--------------------------##
 """
@@ -13,6 +21,26 @@ inputs:
     epsilon  : convergence criteria
     maxIter  : iterations budget
     V0       : initialization of the value function. (heuristic)
+    backend  : "python" walks the State objects, "sparse" compiles the model
+               and runs the backups as sparse matrix-vector products. A
+               CompiledModel is always solved with the sparse backend.
+    mode     : order of the backups (see VI_inPlace below)
+               "jacobi"       -> classical VI, reads V_old and writes V
+               "gauss-seidel" -> in-place updates, states in index order
+               "goal-outward" -> in-place updates, states sorted by their
+                                 distance to the goal
+               "prioritized"  -> prioritized sweeping
+               "topological"  -> strongly connected components solved one
+                                 by one (see VI_topological below)
+    deadline : seconds or Deadline (see Anytime.py), checked every sweep (and
+               every 1024 backups of the prioritized mode)
+    stats    : optional dictionary, filled with the number of "sweeps" and
+               "backups" performed, "stop", "elapsed", the largest 
+               "residual" and the "solvedFraction" of states whose residual
+               is below the optimality threshold
+    probe    : optional Probe (see Probe.py), receives the "sweeps",
+               "backups" and "qEvaluations", the "sweep" timer and an event
+               per sweep (per component in the topological mode)
 
 outputs:
     policy : this is the policy solution, the optimals actions that the agent 
@@ -29,63 +57,814 @@ WARNING -> the algorithm works well with infinite or finte horizon MDP and
            improvement of this algorithim could consist in define a 
            finite-Penalty-SSP. (Mausam and Kolobov pg 58). But this is a
            particular customization for these kind of problems.
+           -> DeadEnds.py does it: VI_pruned collapses every state that
+              cannot reach the goal into a single penalised sink.
            
 """
 
-def VI(decModel, gamma, epsilon, maxIter, V0):
+def VI(decModel, gamma, epsilon, maxIter, V0, backend="python",
+       mode="jacobi", deadline=None, stats=None, probe=None):
+    
+    if mode == "topological":
+        return VI_topological(decModel, gamma, epsilon, maxIter, V0,
+                              deadline, stats, probe)
+    
+    elif mode != "jacobi":
+        return VI_inPlace(decModel, gamma, epsilon, maxIter, V0, mode,
+                          deadline, stats, probe)
+    
+    elif isinstance(decModel, CompiledModel):
+        return VI_sparse(decModel, gamma, epsilon, maxIter, V0, deadline,
+                         stats, probe)
     
+    elif backend == "sparse":
+        return VI_sparse(compileModel(decModel), gamma, epsilon, maxIter, V0,
+                         deadline, stats, probe)
+    
+    start      = time.monotonic()
+    deadline   = Deadline.of(deadline)
     n_states   = len(decModel)                   # number of states
-    policy     = [""] * n_states                 # policy solution
-    V_old      = V0                              # initialization of the value function (heuristic)
-    V          = [0]  * n_states                 # value function
-    Res        = [0]  * n_states                 # Residual of each state
+    sweeps     = jacobiSweeps(decModel, gamma, V0)
     n          = 0                               # iter counter
     optimality = 2*epsilon*gamma/(1-gamma)       # optimality convergence criterium
+    if probe is not None:
+        qSweep = sum(len(s.flat or s.compile()) for s in decModel)
     
     while n < maxIter :                          # Refine V until the buget is reached
         
+        t = probe.tic() if probe is not None else None
+        policy, V, Res = next(sweeps)            # Evaluate all the states
+        
+        # Once the value of all the states have been updated...
+        # Compute iteration, and check exit conditions    
+        n += 1
+        report(stats, n, n*n_states)
+        if probe is not None:
+            probeSweep(probe, t, n, n_states, qSweep, max(Res))
+        
+        if max(Res) < optimality:
+            
+            stopped(stats, start, "converged", Res, optimality)
+            return policy, V, n , Res
+        
+        elif n==maxIter:
+            
+            stopped(stats, start, "iterations", Res, optimality)
+            return policy, V, n, Res
+        
+        elif deadline.expired():
+            
+            stopped(stats, start, "deadline", Res, optimality)
+            return policy, V, n, Res
+
+
+#----------------------------------------------------------------------------#
+"""
+Jacobi sweeps on the State objects: every next() performs one sweep and 
+returns the new policy, V and Res lists (new lists every sweep, the ones
+of the previous sweep are left untouched).
+"""
+
+def jacobiSweeps(decModel, gamma, V0):
+    
+    n_states   = len(decModel)                   # number of states
+    V_old      = V0                              # initialization of the value function (heuristic)
+    
+    while True:
+        
+        policy = [""] * n_states                 # policy solution
+        V      = [0]  * n_states                 # value function
+        Res    = [0]  * n_states                 # Residual of each state
+        
         for s in decModel:                       # Evaluate all the states
             
             # Initialization of state's BellMan operator.
             # Each state will have its own BM operator in each iteration
             # it will be a dictionary such that {"action": value}
             Bellman_operator = {}                 
-            for a,dest in s.transitions.items(): # evaluate state's transitions
+            flat = s.flat or s.compile()        # compiled before s.actions is read
+            for a,dest in zip(s.actions, flat):  # evaluate state's transitions
                 
-                # state.transitions reminder ->
-                # a = "action"
-                # dest = {s_prime : [probability, cost]}
+                # state.flat reminder ->
+                # a = "action" (name of the action number)
+                # dest = ((s_prime, probability, cost), ...)
                 
                 Bellman_operator[a] = 0
-                for s_prime in dest.keys():      # Compute possible successors
+                for s_prime, p, c in dest:       # Compute possible successors
                     
-                    Bellman_operator[a] += dest[s_prime][0] * (dest[s_prime][1] +
-                                                               gamma * V_old[s_prime.number])
+                    Bellman_operator[a] += p * (c + gamma * V_old[s_prime.number])
             
             # For the state s, chose the greedy action in its
             # Bellman dictionary, update V and compute the residual       
             [policy[s.number],V[s.number]] = max(Bellman_operator.items(), key=operator.itemgetter(1))
             Res[s.number] = abs( V[s.number] - V_old[s.number] )
         
-        # Once the value of all the states have been updated...
-        # Compute iteration, and check exit conditions    
+        yield policy, V, Res
+        V_old = V
+
+
+##----------------------------Function description--------------------------##
+"""
+Sparse backend of VI. It works on a CompiledModel (see CompiledModel.py) and
+performs exactly the same Jacobi backups as VI, but all at once:
+
+    Q = R + gamma * P @ V_old        (P is [S*A, S], R is [S, A])
+    policy = argmax_a Q ,  V = max_a Q
+
+Ties are broken in favour of the first action, as the max() in VI does, so
+both backends return the same policy. The outputs have the same meaning as in
+VI: policy is an array of action names, V and Res are NumPy arrays that can be
+indexed exactly like the lists returned by the python backend.
+"""
+
+def VI_sparse(model, gamma, epsilon, maxIter, V0, deadline=None, stats=None,
+              probe=None):
+    
+    start      = time.monotonic()
+    deadline   = Deadline.of(deadline)
+    n_states   = model.nStates                   # number of states
+    n_actions  = model.nActions                  # number of actions
+    names      = np.array(model.actions, dtype=object)
+    sweeps     = sparseSweeps(model, gamma, V0)
+    n          = 0                               # iter counter
+    optimality = 2*epsilon*gamma/(1-gamma)       # optimality convergence criterium
+    
+    while n < maxIter :
+        
+        t = probe.tic() if probe is not None else None
+        a, V, Res = next(sweeps)
+        
         n += 1
+        report(stats, n, n*n_states)
+        if probe is not None:
+            probeSweep(probe, t, n, n_states, n_states*n_actions, Res.max())
         
-        if max(Res) < optimality:
+        if Res.max() < optimality:
             
-            print("MDP Value Iteration: iterations stopped, epsilon-optimal policy found")
-            return policy, V, n , Res
+            stopped(stats, start, "converged", Res, optimality)
+            return names[a], V, n, Res
         
         elif n==maxIter:
             
-            print("MDP Value Iteration: iterations stopped, max number of iteration reached")
-            return policy, V, n, Res
+            stopped(stats, start, "iterations", Res, optimality)
+            return names[a], V, n, Res
         
+        elif deadline.expired():
+            
+            stopped(stats, start, "deadline", Res, optimality)
+            return names[a], V, n, Res
+
+
+#----------------------------------------------------------------------------#
+"""
+Sweeps of the sparse backend, as jacobiSweeps: every next() returns the
+greedy action columns, V and Res arrays of one more sweep.
+"""
+
+def sparseSweeps(model, gamma, V0):
+    
+    n_states   = model.nStates                   # number of states
+    n_actions  = model.nActions                  # number of actions
+    P          = model.transitionMatrix()        # stacked P_a matrices
+    R          = model.expectedCost()            # expected costs
+    rows       = np.arange(n_states)
+    V_old      = np.asarray(V0, dtype=np.float64)
+    
+    while True:
+        
+        # Bellman backup of every pair state-action
+        Q = R + gamma * (P @ V_old).reshape(n_states, n_actions)
+        a = Q.argmax(axis=1)
+        V = Q[rows, a]
+        Res = np.abs(V - V_old)
+        
+        yield a, V, Res
+        V_old = V
+
+
+##----------------------------Function description--------------------------##
+"""
+In-place variants of VI. Jacobi VI only reads the values of the previous 
+sweep, so the information travels one cell per sweep from the goal. These
+variants write V as soon as a state is backed up, so the states evaluated 
+later in the same sweep already benefit from it:
+
+    "gauss-seidel" -> sweeps in index order
+    "goal-outward" -> sweeps in order of distance to the goal, following the
+                      transitions backwards (breadth first search over the
+                      predecessors). Unreachable states go last.
+    "prioritized"  -> after a first goal-outward sweep, only the states whose
+                      successors have changed are backed up (Moore &
+                      Atkeson). The states wait in a priority queue keyed by
+                      the sum of gamma * max_a P(s'|s,a) * |dV(s')| over the
+                      changes of their successors since their last backup,
+                      and a state is queued when its key goes over the
+                      optimality threshold. The key does not count the 
+                      self-loops that bestBackup solves, so a second sum,
+                      with the weights of priorityWeights, bounds the
+                      residual of every state: when the queue runs empty,
+                      the states whose bound is still above the threshold
+                      are queued again, so the mode stops with the same
+                      guarantee as the sweeps.
+
+Inputs and outputs are the ones of VI. For the prioritized mode n is the 
+number of backups divided by the number of states (equivalent sweeps) and
+Res is the bound of the residual of each state.
+
+All these modes back up with bestBackup, which solves the self-loops in
+closed form (a state whose best action is "Stay" converges in one backup),
+while the Jacobi mode iterates them like any other transition. Part of their
+gain over the Jacobi mode comes from that backup, not from the order of the
+backups: compare them with each other (see benchmarks/bench_vi_modes.py).
+"""
+
+def VI_inPlace(decModel, gamma, epsilon, maxIter, V0, mode, deadline=None,
+               stats=None, probe=None):
+    
+    start      = time.monotonic()
+    deadline   = Deadline.of(deadline)
+    actions, rows = flatModel(decModel)
+    n_states   = len(rows)
+    preds      = predecessors(decModel)
+    policy     = [""] * n_states
+    V          = [float(v) for v in V0]          # values are updated in place
+    Res        = [0]  * n_states
+    n          = 0                               # sweeps counter
+    backups    = 0                               # backups counter
+    optimality = 2*epsilon*gamma/(1-gamma)
+    
+    if mode == "gauss-seidel":
+        order = range(n_states)
+    elif mode in ("goal-outward", "prioritized"):
+        order = goalOutwardOrder(decModel, preds)
+    else:
+        raise ValueError("Unknown VI mode: " + str(mode))
+    
+    if probe is not None:
+        qSweep = sum(len(row) for row in rows)
+    
+    # Sweeps --------------------------------------------------------------
+    sweeps = inPlaceSweeps(actions, rows, order, gamma, policy, V, Res)
+    while n < maxIter:
+        
+        t = probe.tic() if probe is not None else None
+        next(sweeps)
+        n += 1
+        backups += n_states
+        if probe is not None:
+            probeSweep(probe, t, n, n_states, qSweep, max(Res))
+        
+        if mode == "prioritized" or max(Res) < optimality:
+            break
+        if deadline.expired():
+            break
+    
+    # Prioritized sweeping ------------------------------------------------
+    if mode == "prioritized":
+        
+        # priority[s]: the key, the changes of the successors of s since its
+        # last backup propagated through their probabilities
+        # bound[s]: the same sum with the self-loops, bounds its residual
+        weights = priorityWeights(decModel, rows, gamma)
+        priority = [0] * n_states
+        bound = [0] * n_states
+        for s in range(n_states):
+            for p, q in preds[s]:
+                priority[p] += gamma * q * Res[s]
+            for p, w in weights[s]:
+                bound[p] += w * Res[s]
+        
+        # keyed[s] is the key of the current entry of s (0 -> none): an 
+        # entry is pushed again only when the priority has grown by
+        # REQUEUE, the older ones are skipped when they are popped
+        queue = [(-priority[p], p) for p in range(n_states)
+                 if priority[p] > optimality]
+        heapq.heapify(queue)
+        keyed = [0] * n_states
+        for key, p in queue:
+            keyed[p] = -key
+        sweepBackups = backups
+        qEvaluations = 0
+        t = probe.tic() if probe is not None else None
+        
+        while backups < maxIter*n_states:
+            
+            if not queue:
+                # the keys miss the self-loops: check the bounds
+                for p in range(n_states):
+                    if bound[p] >= optimality:
+                        priority[p] = keyed[p] = bound[p]
+                        queue.append((-bound[p], p))
+                if not queue:
+                    break
+                heapq.heapify(queue)
+            
+            if backups % 1024 == 0 and deadline.expired():
+                break
+            
+            key, s = heapq.heappop(queue)
+            if -key != keyed[s]:
+                continue                 # replaced by a newer entry
+            if -key < priority[s]:
+                keyed[s] = priority[s]   # grown a little since, queue again
+                heapq.heappush(queue, (-priority[s], s))
+                continue
+            keyed[s] = priority[s] = bound[s] = 0
+            
+            a, v = bestBackup(rows[s], V, gamma, s)
+            delta = abs(v - V[s])
+            V[s] = v
+            policy[s] = actions[a]
+            backups += 1
+            if probe is not None:
+                qEvaluations += len(rows[s])
+            
+            # let the predecessors know that this state has changed
+            for p, q in preds[s]:
+                priority[p] += gamma * q * delta
+                if priority[p] > optimality and \
+                   priority[p] >= REQUEUE * keyed[p]:
+                    keyed[p] = priority[p]
+                    heapq.heappush(queue, (-priority[p], p))
+            for p, w in weights[s]:
+                bound[p] += w * delta
+        
+        n = -(-backups // n_states)
+        Res[:] = bound
+        done = max(Res) < optimality
+        if probe is not None:
+            probe.toc("prioritized", t)
+            probe.count("backups", backups - sweepBackups)
+            probe.count("qEvaluations", qEvaluations)
+        
+    else:
+        done = max(Res) < optimality
+    
+    report(stats, n, backups)
+    
+    if done:
+        stop = "converged"
+    elif deadline.expired():
+        stop = "deadline"
+    else:
+        stop = "iterations"
+    stopped(stats, start, stop, Res, optimality)
+        
+    return policy, V, n, Res
+
+
+#----------------------------------------------------------------------------#
+"""
+Sweeps of the in-place variants: every next() backs up the states in the
+given order, updating policy, V and Res in place, and returns them.
+"""
+
+def inPlaceSweeps(actions, rows, order, gamma, policy, V, Res):
+    
+    while True:
+        
+        for s in order:
+            
+            a, v = bestBackup(rows[s], V, gamma, s)
+            Res[s] = abs(v - V[s])
+            V[s] = v
+            policy[s] = actions[a]
+        
+        yield policy, V, Res
+
+
+##----------------------------Function description--------------------------##
+"""
+Topological VI. The value of a state only depends on the states it can 
+reach, so the transition graph is split into its strongly connected 
+components (Tarjan) and the components are solved one after the other, in
+reverse topological order: when a component is solved, every component it
+can reach is already converged and its values are constants.
+
+    -a singleton (the goal, an obstacle, a cell that can only go forward) 
+     is solved exactly with a single backup, the self-loops are solved in 
+     closed form by bestBackup. Absorbing states cost one backup and are
+     never swept.
+    -a larger component is swept in place until its residual is below the
+     optimality threshold, then never touched again.
+
+In the maze every free region is strongly connected (the agent can go back
+the way it came), so the gain comes from the walls: the obstacles and the
+goal are solved once, and the pockets that cannot reach the goal are 
+solved apart from the region of the goal instead of being swept with it.
+
+Inputs and outputs are the ones of VI. n is the number of backups divided
+by the number of states (equivalent sweeps), maxIter bounds it. stats also
+receives the number of "components".
+"""
+
+def VI_topological(decModel, gamma, epsilon, maxIter, V0, deadline=None,
+                   stats=None, probe=None):
+    
+    start      = time.monotonic()
+    deadline   = Deadline.of(deadline)
+    actions, rows = flatModel(decModel)
+    n_states   = len(rows)
+    policy     = [""] * n_states
+    V          = [float(v) for v in V0]          # values are updated in place
+    Res        = [0]  * n_states
+    backups    = 0
+    optimality = 2*epsilon*gamma/(1-gamma)
+    stop       = "converged"
+    
+    adjacency = [sorted({j for dest in row for j, p, c in dest if j != s})
+                 for s, row in enumerate(rows)]
+    components = stronglyConnected(adjacency)
+    
+    for component in components:
+        
+        if deadline.expired():
+            stop = "deadline"
+            break
+        
+        sweeps = 0
+        while True:
+            
+            t = probe.tic() if probe is not None else None
+            for s in component:
+                
+                a, v = bestBackup(rows[s], V, gamma, s)
+                Res[s] = abs(v - V[s])
+                V[s] = v
+                policy[s] = actions[a]
+            
+            backups += len(component)
+            sweeps += 1
+            if probe is not None:
+                probeSweep(probe, t, sweeps, len(component),
+                           sum(len(rows[s]) for s in component),
+                           max(Res[s] for s in component), len(component))
+            
+            # a singleton only depends on solved states -> exact in one go
+            if (len(component) == 1
+                or max(Res[s] for s in component) < optimality):
+                break
+            if backups >= maxIter * n_states:
+                stop = "iterations"
+                break
+            if deadline.expired():
+                stop = "deadline"
+                break
+        
+        if stop != "converged":
+            break
+    
+    n = -(-backups // n_states)
+    report(stats, n, backups)
+    if stats is not None:
+        stats["components"] = len(components)
+    stopped(stats, start, stop, Res, optimality)
+    
+    return policy, V, n, Res
+
+
+#----------------------------------------------------------------------------#
+"""
+Iterative version of Tarjan's algorithm (no recursion, the components of a
+large map are deeper than the recursion limit).
+input:
+    - adjacency : adjacency[s] is the list of successors of s
+output:
+    - list of components (lists of states) in reverse topological order:
+      a component comes after every component it can reach
+"""
+def stronglyConnected(adjacency):
+    
+    n_states = len(adjacency)
+    index    = [-1] * n_states        # discovery order of each state
+    low      = [0] * n_states         # lowest index reachable from it
+    onStack  = [False] * n_states
+    stack    = []
+    components = []
+    counter  = 0
+    
+    for root in range(n_states):
+        
+        if index[root] != -1:
+            continue
+        
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        onStack[root] = True
+        work = [(root, 0)]            # (state, next successor to explore)
+        
+        while work:
+            
+            v, i = work[-1]
+            if i < len(adjacency[v]):
+                
+                work[-1] = (v, i + 1)
+                w = adjacency[v][i]
+                if index[w] == -1:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    onStack[w] = True
+                    work.append((w, 0))
+                elif onStack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+                continue
+            
+            # every successor of v explored
+            work.pop()
+            if work and low[v] < low[work[-1][0]]:
+                low[work[-1][0]] = low[v]
+            
+            if low[v] == index[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    onStack[w] = False
+                    component.append(w)
+                    if w == v:
+                        break
+                components.append(component)
+    
+    return components
+
+
+##----------------------------Function description--------------------------##
+"""
+Generator version of VI (see Anytime.py): the same sweeps, with a Snapshot
+after each one. The last snapshot has its stop set ("converged", 
+"iterations" or "deadline"); leaving the loop earlier cancels VI.
+inputs:
+    - decModel, gamma, epsilon, maxIter, V0, backend, deadline : as in VI
+    - mode : "jacobi", "gauss-seidel" or "goal-outward" (the modes that 
+             work by sweeps)
+    - copy : copy V and the policy into every snapshot. Otherwise the 
+             snapshot holds the arrays of the solver, which the in-place
+             modes go on updating (the Jacobi ones are new every sweep).
+The value of the snapshots is V at the initial state.
+"""
+
+def iter_VI(decModel, gamma, epsilon, maxIter, V0, backend="python",
+            mode="jacobi", deadline=None, copy=False):
+    
+    start      = time.monotonic()
+    deadline   = Deadline.of(deadline)
+    optimality = 2*epsilon*gamma/(1-gamma)
+    
+    if mode == "jacobi":
+        if isinstance(decModel, CompiledModel) or backend == "sparse":
+            model = (decModel if isinstance(decModel, CompiledModel)
+                     else compileModel(decModel))
+            names = np.array(model.actions, dtype=object)
+            sweeps = sparseSweeps(model, gamma, V0)
+        else:
+            names = None
+            sweeps = jacobiSweeps(decModel, gamma, V0)
+        
+    elif mode in ("gauss-seidel", "goal-outward"):
+        actions, rows = flatModel(decModel)
+        n_states = len(rows)
+        order = (range(n_states) if mode == "gauss-seidel" else
+                 goalOutwardOrder(decModel, predecessors(decModel)))
+        names = None
+        sweeps = inPlaceSweeps(actions, rows, order, gamma, [""] * n_states,
+                               [float(v) for v in V0], [0] * n_states)
+        
+    else:
+        raise ValueError("iter_VI: the " + str(mode) + " mode has no sweeps")
+    
+    if isinstance(decModel, CompiledModel):
+        s0 = decModel.initial
+    else:
+        s0 = next((s.number for s in decModel if s.initial), None)
+    
+    n = 0
+    while n < maxIter:
+        
+        policy, V, Res = next(sweeps)
+        n += 1
+        residual = float(max(Res))
+        
+        if residual < optimality:
+            stop = "converged"
+        elif n == maxIter:
+            stop = "iterations"
+        elif deadline.expired():
+            stop = "deadline"
         else:
+            stop = None
+        
+        if names is not None:
+            policy = names[policy]
+        elif copy:
+            policy = list(policy)
+        if copy:
+            V = list(V) if isinstance(V, list) else V.copy()
+        
+        yield Snapshot(n, residual, None if s0 is None else float(V[s0]),
+                       None, time.monotonic() - start, stop, V, policy)
+        
+        if stop is not None:
+            return
+
+
+#----------------------------------------------------------------------------#
+"""
+Auxiliary functions of VI_inPlace.
+
+flatModel(decModel) -> (actions, rows)
+    rows[s][a] is a list of tuples (successor index, probability, cost). It 
+    works for a list of State objects and for a CompiledModel.
+
+predecessors(decModel) -> preds
+    preds[s] is a list of tuples (predecessor index, probability): the 
+    largest probability of reaching s from that predecessor. It is read from
+    the PredecessorIndex of the model, self-loops are left out.
+
+goalOutwardOrder(decModel, preds) -> list of state indices
+
+priorityWeights(decModel, rows, gamma) -> list of lists
+    weights[s] is a list of tuples (predecessor index, weight): the largest
+    gamma * P(s|p,a) / (1 - gamma * P(p|p,a)) over the actions a of the
+    predecessor p, the factor of |dV(s)| in the change of its backup.
+
+bestBackup(row, V, gamma, s) -> (greedy action index, its Q-value)
+    Ties are broken in favour of the first action, as in VI. The self-loops
+    are solved exactly: if the action keeps the agent in s with probability
+    p, Q = (sum_{s' != s} P (C + gamma V(s')) + p C(s,a,s)) / (1 - gamma p).
+    The fixed point is the same, but a dead-end (or "Stay") gets its final
+    value in a single backup instead of converging geometrically.
+"""
+
+def flatModel(decModel):
+    
+    if isinstance(decModel, CompiledModel):
+        
+        rows = []
+        for succ, prob, cost in zip(decModel.succ.tolist(),
+                                    decModel.prob.tolist(),
+                                    decModel.cost.tolist()):
+            rows.append([[(j, p, c) for j, p, c in zip(*dest) if p > 0]
+                         for dest in zip(succ, prob, cost)])
             
-            V_old = V
-            V = [0]*n_states # don't know why but if you remove this, python 
-                             # starts confusing V and V_old
+        return decModel.actions, rows
+    
+    decModel[0].flat or decModel[0].compile()
+    actions = decModel[0].actions
+    rows = [[[(s_prime.number, p, c) for s_prime, p, c in dest]
+             for dest in (s.flat or s.compile())]
+            for s in decModel]
+    
+    return actions, rows
+
+
+def predecessors(decModel):
+    
+    if isinstance(decModel, CompiledModel):
+        index = decModel.predecessors()
+    else:
+        index = predecessorIndex(decModel)
+    
+    preds = []
+    for s in range(len(index)):
         
-       
+        best = {}
+        state, action, prob = index.of(s)
+        for p, q in zip(state.tolist(), prob.tolist()):
+            if p != s and q > best.get(p, 0):
+                best[p] = q
+                
+        preds.append(list(best.items()))
+                    
+    return preds
+
+
+def priorityWeights(decModel, rows, gamma):
+    
+    if isinstance(decModel, CompiledModel):
+        index = decModel.predecessors()
+    else:
+        index = predecessorIndex(decModel)
+    
+    # probability of each self-loop
+    loops = [[sum(p for j, p, c in dest if j == s) for dest in row]
+             for s, row in enumerate(rows)]
+    
+    weights = []
+    for s in range(len(index)):
+        
+        # P(s|p,a) of every pair (padded entries may repeat it)
+        into = {}
+        state, action, prob = index.of(s)
+        for p, a, q in zip(state.tolist(), action.tolist(), prob.tolist()):
+            if p != s:
+                into[p, a] = into.get((p, a), 0) + q
         
+        best = {}
+        for (p, a), q in into.items():
+            w = gamma * q / (1 - gamma * loops[p][a])
+            if w > best.get(p, 0):
+                best[p] = w
+        
+        weights.append(list(best.items()))
+    
+    return weights
+
+
+def goalOutwardOrder(decModel, preds):
+    
+    if isinstance(decModel, CompiledModel):
+        goals = np.flatnonzero(decModel.goal).tolist()
+        n_states = decModel.nStates
+    else:
+        goals = [s.number for s in decModel if s.goal]
+        n_states = len(decModel)
+    
+    seen = [False] * n_states
+    order = []
+    queue = deque(goals)
+    for g in goals:
+        seen[g] = True
+        
+    while queue:
+        
+        s = queue.popleft()
+        order.append(s)
+        for p, prob in preds[s]:
+            if not seen[p]:
+                seen[p] = True
+                queue.append(p)
+    
+    order.extend(s for s in range(n_states) if not seen[s])
+    
+    return order
+
+
+def bestBackup(row, V, gamma, s):
+    
+    bestA = 0
+    bestQ = None
+    for a, dest in enumerate(row):
+        
+        q = 0
+        loop = 0                       # probability of staying in s
+        for j, p, c in dest:
+            if j == s:
+                loop += p
+                q += p * c
+            else:
+                q += p * (c + gamma * V[j])
+        q /= 1 - gamma * loop
+            
+        if bestQ is None or q > bestQ:
+            bestA, bestQ = a, q
+    
+    return bestA, bestQ
+
+
+#----------------------------------------------------------------------------#
+"""
+This function reports a sweep into the probe: its timer, the counters and
+the event (iteration, residual and, in the topological mode, the size of
+the component swept).
+"""
+def probeSweep(probe, t, n, backups, qEvaluations, residual, component=None):
+    
+    probe.toc("sweep", t)
+    probe.count("sweeps")
+    probe.count("backups", backups)
+    probe.count("qEvaluations", qEvaluations)
+    if component is None:
+        probe.event("VI", iteration=n, residual=float(residual))
+    else:
+        probe.event("VI", iteration=n, residual=float(residual),
+                    component=component)
+
+
+"""
+This function writes the number of sweeps and backups into the stats
+dictionary, if the caller gave one.
+"""
+def report(stats, sweeps, backups):
+    
+    if stats is not None:
+        stats["sweeps"] = sweeps
+        stats["backups"] = backups
+
+
+"""
+This function prints why VI (or the solver named) stopped and writes it into
+the stats dictionary together with the convergence measures (see Anytime.py).
+"""
+def stopped(stats, start, stop, Res, optimality, solver="Value Iteration"):
+    
+    if stop == "converged":
+        print("MDP " + solver + ": iterations stopped, epsilon-optimal policy found")
+    elif stop == "deadline":
+        print("MDP " + solver + ": iterations stopped, deadline reached")
+    else:
+        print("MDP " + solver + ": iterations stopped, max number of iteration reached")
+    
+    Res = np.asarray(Res)
+    finish(stats, start, stop, residual=float(Res.max()),
+           solvedFraction=float((Res < optimality).mean()))
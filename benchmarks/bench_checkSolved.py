@@ -0,0 +1,116 @@
+"""
+Benchmark of LRTDP's checkSolved: time to label the greedy envelope of s0 as
+a function of its size, for the previous version (list membership tests on
+openStack + closedStack) and the current one (deque + generation marks).
+
+The states get the values of a converged VI first, so every residual is
+below epsilon and checkSolved has to walk the whole greedy envelope.
+
+Usage:
+    python benchmarks/bench_checkSolved.py [sizes...]
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from StateClass import State
+from SSP_obstaclesModel import TransCostModel
+from ValueIteration import VI
+from LabeledRTDP import checkSolved
+
+##---------------------PREVIOUS VERSION OF checkSolved----------------------##
+
+def checkSolvedLists(s, gamma, epsilon):
+
+    rv = True
+    openStack = []
+    closedStack = []
+
+    if not s.solved:
+        openStack.append(s)
+
+    while not openStack == []:
+
+        last = len(openStack) - 1
+        s = openStack[last]
+        openStack.pop(last)
+
+        closedStack.append(s)
+
+        if s.Residual(gamma) > epsilon:
+            rv = False
+            continue
+
+        a = s.greedyAction(gamma)
+        for successor in s.transitions[a].keys():
+
+            if not successor.solved and successor not in (openStack + closedStack):
+                openStack.append(successor)
+
+    if rv:
+        for s in closedStack:
+            s.solved = True
+    else:
+        while not closedStack == []:
+            last = len(closedStack) - 1
+            s = closedStack[last]
+            closedStack.pop(last)
+            s.update(gamma)
+
+    return rv
+
+##---------------------------------SCENARIO---------------------------------##
+
+def convergedGrid(N, gamma):
+
+    states = [State(i, N, N) for i in range(N*N)]
+    states[0].initial = True
+    states[-1].goal = True
+    TransCostModel(states, N, N)
+
+    V = VI(states, gamma, 1e-9, 100000, [0]*(N*N), backend="sparse")[1]
+    for s in states:
+        s.value = float(V[s.number])
+
+    return states
+
+
+def timeCall(function, states, gamma, epsilon):
+
+    for s in states:
+        s.solved = s.goal
+
+    start = time.perf_counter()
+    function(states[0], gamma, epsilon)
+    elapsed = time.perf_counter() - start
+
+    envelope = sum(1 for s in states if s.solved and not s.goal)
+
+    return envelope, elapsed
+
+##----------------------------------MAIN------------------------------------##
+
+if __name__ == "__main__":
+
+    sizes = [int(a) for a in sys.argv[1:]] or [10, 20, 40, 80, 160, 320]
+    gamma = 0.999
+    epsilon = 1e-3
+    oldLimit = 10000           # the old version is quadratic, stop it here
+
+    print("%8s %10s %12s %12s" % ("grid", "envelope", "old (s)", "new (s)"))
+    for N in sizes:
+
+        states = convergedGrid(N, gamma)
+        envelope, new = timeCall(checkSolved, states, gamma, epsilon)
+
+        if envelope <= oldLimit:
+            old = "%12.4f" % timeCall(checkSolvedLists, states, gamma, epsilon)[1]
+        else:
+            old = "%12s" % "-"
+
+        print("%8s %10d %s %12.4f" % ("%dx%d" % (N, N), envelope, old, new))
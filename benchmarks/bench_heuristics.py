@@ -0,0 +1,96 @@
+"""
+Benchmark of the heuristic initialisations (Heuristics.py): effort to
+convergence of each solver starting from V0 = 0 ("zero") and from the
+"chebyshev" and "relaxed" heuristics, on random obstacle mazes.
+
+    -LRTDP : trials and backups until s0 is solved
+    -RTDP  : trials until |V(s0) - V*(s0)| < tolerance (checked every trial)
+    -VI    : sweeps of the sparse backend until epsilon-convergence
+
+Usage:
+    python benchmarks/bench_heuristics.py [sizes...]
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import numpy as np
+
+from SSP_obstaclesModel import compactModel, GenerativeModel, randomObstacles
+from ValueIteration import VI
+from RealTimeDP import TRIAL
+from LabeledRTDP import LRTDP
+from Sampling import RandomStream
+from Heuristics import heuristicValues
+
+HEURISTICS = ("zero", "chebyshev", "relaxed")
+
+##---------------------------------SCENARIO---------------------------------##
+
+def rtdpTrials(model, gamma, vstar, tolerance, maxTrials, maxDepth):
+
+    rng = RandomStream(0)
+    s0 = model.s0
+    for n in range(1, maxTrials + 1):
+        TRIAL(s0, gamma, rng, maxDepth)
+        if abs(s0.value - vstar) < tolerance:
+            return n
+
+    return "> %d" % maxTrials
+
+##----------------------------------MAIN------------------------------------##
+
+if __name__ == "__main__":
+
+    sizes = [int(a) for a in sys.argv[1:]] or [20, 40, 80]
+    gamma, epsilon, tolerance = 0.95, 1e-3, 1e-2
+    maxDepth, maxTrials = 1000, 20000
+
+    print("%8s %10s %14s %14s %10s %12s %8s"
+          % ("grid", "heuristic", "LRTDP trials", "LRTDP backups",
+             "LRTDP (s)", "RTDP trials", "VI sweeps"))
+
+    for N in sizes:
+
+        obstacles = randomObstacles(N, N, 0.1, 0)
+        model = compactModel(N, N, 0, N*N - 1, obstacles)
+        with open(os.devnull, "w") as devnull, \
+             contextlib.redirect_stdout(devnull):
+            vstar = VI(model, gamma, 1e-9, 100000, np.zeros(N*N))[1][0]
+
+        for kind in HEURISTICS:
+
+            if kind == "zero":
+                V0 = None
+            else:
+                V0 = heuristicValues(model, gamma, kind)
+
+            with open(os.devnull, "w") as devnull, \
+                 contextlib.redirect_stdout(devnull):
+
+                stats = {}
+                lazy = GenerativeModel(N, N, 0, N*N - 1, obstacles,
+                                       heuristic=V0)
+                start = time.perf_counter()
+                LRTDP(lazy.s0, gamma, epsilon, seed=0, maxDepth=maxDepth,
+                      stats=stats)
+                elapsed = time.perf_counter() - start
+
+                lazy = GenerativeModel(N, N, 0, N*N - 1, obstacles,
+                                       heuristic=V0)
+                trials = rtdpTrials(lazy, gamma, vstar, tolerance,
+                                    maxTrials, maxDepth)
+
+                sweeps = {}
+                VI(model, gamma, epsilon, 100000,
+                   np.zeros(N*N) if V0 is None else V0, stats=sweeps)
+
+            print("%8s %10s %14d %14d %10.3f %12s %8d"
+                  % ("%dx%d" % (N, N), kind, stats["trials"],
+                     stats["backups"], elapsed, trials, sweeps["sweeps"]))
@@ -0,0 +1,90 @@
+"""
+Benchmark of policy iteration (PolicyIteration.py) against VI on random
+obstacle mazes, gamma = 0.95:
+
+    -VI       : sweeps of the sparse backend until epsilon-convergence
+    -PI       : improvements, each one followed by a sparse direct solve
+    -MPI k    : improvements, each one followed by k evaluation sweeps
+
+For each solver: outer iterations, sweeps (improvements plus evaluation
+sweeps), linear solves, wall time and the error of the values, the largest
+|V - V*| (V* given by VI with epsilon = 1e-10). The solvers run on the CompiledModel; with --python they also
+run on the State objects for the grids up to 50x50.
+
+Usage:
+    python benchmarks/bench_policy_iteration.py [sizes...] [--python]
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import numpy as np
+
+from SSP_obstaclesModel import compactModel, GenerativeModel, randomObstacles
+from ValueIteration import VI
+from PolicyIteration import PI
+
+MPI_SWEEPS = (5, 20, 50)
+
+##---------------------------------SCENARIO---------------------------------##
+
+def run(solver, model, gamma, epsilon, **options):
+
+    stats = {}
+    with open(os.devnull, "w") as devnull, \
+         contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        V = solver(model, gamma, epsilon, 100000,
+                   np.zeros(len(model) if isinstance(model, list)
+                            else model.nStates),
+                   stats=stats, **options)[1]
+        elapsed = time.perf_counter() - start
+
+    return np.asarray(V, dtype=np.float64), stats, elapsed
+
+##----------------------------------MAIN------------------------------------##
+
+if __name__ == "__main__":
+
+    python = "--python" in sys.argv
+    sizes = [int(a) for a in sys.argv[1:] if a != "--python"] or [50, 100, 200]
+    gamma, epsilon = 0.95, 1e-3
+
+    print("%8s %8s %10s %10s %8s %8s %10s %10s"
+          % ("grid", "backend", "solver", "iterations", "sweeps", "solves",
+             "time (s)", "error"))
+
+    for N in sizes:
+
+        obstacles = randomObstacles(N, N, 0.1, 0)
+        models = [("sparse", compactModel(N, N, 0, N*N - 1, obstacles))]
+        if python and N <= 50:
+            lazy = GenerativeModel(N, N, 0, N*N - 1, obstacles)
+            models.append(("python", [lazy[i] for i in range(N*N)]))
+        vstar = run(VI, models[0][1], gamma, 1e-10)[0]
+
+        for backend, model in models:
+
+            V, stats, elapsed = run(VI, model, gamma, epsilon)
+            rows = [("VI", stats["sweeps"], stats["sweeps"], 0, elapsed,
+                     np.abs(V - vstar).max())]
+
+            solvers = [("PI", {"evaluation": "direct"})]
+            solvers += [("MPI %d" % k, {"evaluation": "iterative", "k": k})
+                        for k in MPI_SWEEPS]
+            for name, options in solvers:
+                V, stats, elapsed = run(PI, model, gamma, epsilon, **options)
+                rows.append((name, stats["iterations"], stats["sweeps"],
+                             stats["solves"], elapsed,
+                             np.abs(V - vstar).max()))
+
+            for name, iterations, sweeps, solves, elapsed, error in rows:
+                print("%8s %8s %10s %10d %8d %8d %10.3f %10.2e"
+                      % ("%dx%d" % (N, N), backend, name, iterations, sweeps,
+                         solves, elapsed, error))
@@ -0,0 +1,79 @@
+"""
+Benchmark of the UCT leaf evaluation: n rollouts for every action of a state,
+one by one with Rollout (what leafValues does on the State objects) and
+batched with batchRollout on the compiled arrays.
+
+For each n it prints the cost of a whole leaf evaluation, the cost per
+rollout and the standard error of the Q estimates, sqrt(var / n).
+
+Usage:
+    python benchmarks/bench_rollouts.py [N] [density]
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import numpy as np
+
+from Sampling import RandomStream
+from SSP_obstaclesModel import compactModel, randomObstacles
+from UCT import ArraySimulator, Rollout, batchRollout
+
+##---------------------------------SCENARIO---------------------------------##
+
+def scalarLeaf(sim, s, rng, n, depth, gamma):
+
+    returns = np.zeros((sim.A, n))
+    for a in range(sim.A):
+        for r in range(n):
+            successor, cost, k = sim.step(s, a, rng)
+            returns[a, r] = cost + gamma * Rollout(sim, successor, rng,
+                                                   depth, gamma)
+
+    return returns.mean(axis=1), returns.var(axis=1, ddof=1)
+
+
+def timeLeaf(function, sim, s, n, depth, gamma, repeat):
+
+    rng = RandomStream(0)
+    start = time.perf_counter()
+    for r in range(repeat):
+        mean, var = function(sim, s, rng, n, depth, gamma)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    return elapsed, mean, var
+
+##----------------------------------MAIN------------------------------------##
+
+if __name__ == "__main__":
+
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    density = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    depth, gamma = 5, 0.95
+
+    model = compactModel(N, N, 0, N*N - 1, randomObstacles(N, N, density, 0))
+    sim = ArraySimulator(model)
+    s = (N // 2) * N + N // 2            # a state in the middle of the map
+    if sim.isTerminal[s]:
+        s = int(np.flatnonzero(~sim.isTerminal)[N*N // 2])
+
+    print("%6s %14s %14s %14s %14s %8s %10s" % ("n", "scalar (ms)",
+          "batch (ms)", "scalar/roll", "batch/roll", "speedup", "std err"))
+    for n in (2, 8, 32, 128, 512):
+
+        repeat = max(1, 2000 // n)
+        old, mean, var = timeLeaf(scalarLeaf, sim, s, n, depth, gamma,
+                                  max(1, repeat // 10))
+        new, mean, var = timeLeaf(batchRollout, sim, s, n, depth, gamma,
+                                  repeat)
+        rollouts = n * sim.A
+
+        print("%6d %14.3f %14.3f %12.2fus %12.2fus %7.1fx %10.4f"
+              % (n, old * 1e3, new * 1e3, old / rollouts * 1e6,
+                 new / rollouts * 1e6, old / new,
+                 float(np.sqrt(var / n).max())))
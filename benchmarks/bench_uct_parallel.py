@@ -0,0 +1,54 @@
+"""
+Scaling of the parallel UCT: simulations per second of the root and tree
+parallel modes from 1 worker to all the cores, against the sequential
+search, on a random obstacle maze (CompiledModel).
+
+Usage:
+    python benchmarks/bench_uct_parallel.py [N] [trials] [max workers]
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from SSP_obstaclesModel import compactModel, randomObstacles
+from UCT import UCT_like
+
+##----------------------------------MAIN------------------------------------##
+
+if __name__ == "__main__":
+
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    trials = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    maxWorkers = (int(sys.argv[3]) if len(sys.argv) > 3
+                  else multiprocessing.cpu_count())
+
+    model = compactModel(N, N, 0, N*N - 1, randomObstacles(N, N, 0.1, 0))
+    options = {"gamma": 0.95, "horizon": 100, "seed": 0}
+
+    start = time.perf_counter()
+    tree = UCT_like(None, trials, model=model, asTree=True, **options)
+    base = trials / (time.perf_counter() - start)
+
+    print("%d x %d maze, %d simulations, %d cores"
+          % (N, N, trials, multiprocessing.cpu_count()))
+    print("%-10s %8s %12s %8s %10s" % ("mode", "workers", "sims/sec",
+                                       "speedup", "V(s0)"))
+    print("%-10s %8s %12.0f %8.2f %10.4f" % ("sequential", "-", base, 1.0,
+                                             tree.value(model.initial)))
+
+    for mode in ("root", "tree"):
+        for workers in range(1, maxWorkers + 1):
+
+            stats = {}
+            tree = UCT_like(None, trials, model=model, workers=workers,
+                            mode=mode, stats=stats, asTree=True,
+                            **options)
+            print("%-10s %8d %12.0f %8.2f %10.4f"
+                  % (mode, workers, stats["simsPerSec"],
+                     stats["simsPerSec"] / base, tree.value(model.initial)))
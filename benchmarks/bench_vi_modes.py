@@ -0,0 +1,81 @@
+"""
+Benchmark of the orders of the VI backups (VI(..., mode=...)) on random
+obstacle mazes, gamma = 0.95, obstacle density 0.2:
+
+    -jacobi       : reads V_old and writes V
+    -gauss-seidel : in-place backups, states in index order
+    -goal-outward : in-place backups, states by distance to the goal
+    -prioritized  : prioritized sweeping (Moore & Atkeson)
+
+For each mode: sweeps (backups divided by the number of states), backups,
+wall time and the largest |V - V*| (V* given by VI with epsilon = 1e-10).
+
+The in-place modes solve the self-loops in closed form (see bestBackup in
+ValueIteration.py) and the Jacobi mode does not, so the gap between them
+mixes the order and the backup. The order alone is the gap between the
+in-place modes. With V0 = 0 every free state starts above its value and
+falls geometrically, so the sweep order barely matters; prioritized
+sweeping saves the backups of the states that have already converged.
+
+Usage:
+    python benchmarks/bench_vi_modes.py [sizes...] [--epsilon e]
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import numpy as np
+
+from SSP_obstaclesModel import compactModel, randomObstacles
+from ValueIteration import VI
+
+MODES = ("jacobi", "gauss-seidel", "goal-outward", "prioritized")
+
+##---------------------------------SCENARIO---------------------------------##
+
+def run(model, gamma, epsilon, mode):
+
+    stats = {}
+    with open(os.devnull, "w") as devnull, \
+         contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        V = VI(model, gamma, epsilon, 100000, np.zeros(model.nStates),
+               mode=mode, stats=stats)[1]
+        elapsed = time.perf_counter() - start
+
+    return np.asarray(V, dtype=np.float64), stats, elapsed
+
+##----------------------------------MAIN------------------------------------##
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    epsilon = 1e-4
+    if "--epsilon" in args:
+        i = args.index("--epsilon")
+        epsilon = float(args[i + 1])
+        del args[i:i + 2]
+    sizes = [int(a) for a in args] or [30, 50, 80]
+    gamma = 0.95
+
+    print("%8s %14s %8s %10s %10s %10s"
+          % ("grid", "mode", "sweeps", "backups", "time (s)", "error"))
+
+    for N in sizes:
+
+        model = compactModel(N, N, 0, N*N - 1,
+                             randomObstacles(N, N, 0.2, 0))
+        vstar = run(model, gamma, 1e-10, "jacobi")[0]
+
+        for mode in MODES:
+
+            V, stats, elapsed = run(model, gamma, epsilon, mode)
+            print("%8s %14s %8.1f %10d %10.3f %10.2e"
+                  % ("%dx%d" % (N, N), mode, stats["backups"] / N**2,
+                     stats["backups"], elapsed, np.abs(V - vstar).max()))
@@ -0,0 +1,216 @@
+"""
+Benchmark harness: runs VI, RTDP, LRTDP and UCT on random obstacle mazes and
+records, for every run:
+    - wall time, backups, trials and peak RSS (each run has its own process,
+      so the memory of one solver does not leak into the next one)
+    - value of s0 found by the solver against the VI optimum V*(s0), 
+      gap = V(s0) - V*(s0) (positive -> optimistic estimate)
+
+The mazes are N x N grids, initial state in the top-left corner, goal in the
+bottom-right corner, every other cell is an obstacle with a given density.
+
+Usage (see --help for all the options):
+    python benchmarks/compare_solvers.py --sizes 10 20 40 --density 0.1 \
+        --seeds 0 1 --csv results.csv --json results.json
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import numpy as np
+
+from SSP_obstaclesModel import compactModel, GenerativeModel, randomObstacles
+from ValueIteration import VI
+from RealTimeDP import RTDP
+from LabeledRTDP import LRTDP
+from UCT import UCT_like
+
+SOLVERS = ("VI", "RTDP", "LRTDP", "UCT")
+
+FIELDS = ("solver", "size", "density", "slip", "seed", "gamma", "status",
+          "wall_time", "backups", "trials", "states", "peak_rss_mb",
+          "value_s0", "vstar_s0", "gap")
+
+##-------------------------------SCENARIOS----------------------------------##
+"""
+Each solver gets the maze description and builds its own model inside the
+child process, so the building time and memory are part of its run.
+"""
+
+def runVI(maze, args):
+
+    model = compactModel(maze["N"], maze["N"], 0, maze["N"]**2 - 1,
+                         maze["obstacles"], slip=maze["slip"])
+    stats = {}
+    V = VI(model, args.gamma, args.epsilon, args.max_iter,
+           np.zeros(model.nStates), stats=stats)[1]
+
+    return {"backups": stats["backups"], "trials": 0,
+            "states": model.nStates, "value_s0": float(V[0])}
+
+
+def runRTDP(maze, args):
+
+    model = GenerativeModel(maze["N"], maze["N"], 0, maze["N"]**2 - 1,
+                            maze["obstacles"], slip=maze["slip"])
+    stats = {}
+    RTDP(model.s0, args.gamma, args.rtdp_trials, seed=maze["seed"],
+         maxDepth=args.max_depth, stats=stats)
+
+    return {"backups": stats["backups"], "trials": stats["trials"],
+            "states": len(model), "value_s0": model.s0.value}
+
+
+def runLRTDP(maze, args):
+
+    model = GenerativeModel(maze["N"], maze["N"], 0, maze["N"]**2 - 1,
+                            maze["obstacles"], slip=maze["slip"])
+    stats = {}
+    LRTDP(model.s0, args.gamma, args.epsilon, seed=maze["seed"],
+          maxDepth=args.max_depth, stats=stats)
+
+    return {"backups": stats["backups"], "trials": stats["trials"],
+            "states": len(model), "value_s0": model.s0.value}
+
+
+def runUCT(maze, args):
+
+    model = compactModel(maze["N"], maze["N"], 0, maze["N"]**2 - 1,
+                         maze["obstacles"], slip=maze["slip"])
+    tree = UCT_like(None, args.uct_trials, seed=maze["seed"], model=model,
+                    gamma=args.gamma, horizon=args.uct_horizon, asTree=True)
+    value = tree.value(model.initial)
+
+    return {"backups": "", "trials": args.uct_trials,
+            "states": len(tree), "value_s0": "" if value is None else value}
+
+
+RUNNERS = {"VI": runVI, "RTDP": runRTDP, "LRTDP": runLRTDP, "UCT": runUCT}
+
+##------------------------------CHILD PROCESS-------------------------------##
+
+def child(solver, maze, args, queue):
+
+    # the solvers print their own messages
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+
+        start = time.perf_counter()
+        try:
+            result = RUNNERS[solver](maze, args)
+            result["status"] = "ok"
+        except Exception as error:
+            result = {"status": "error: %s" % error}
+        result["wall_time"] = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put(result)
+
+
+def runIsolated(solver, maze, args):
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=child, args=(solver, maze, args, queue))
+    process.start()
+    process.join(args.timeout)
+
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return {"status": "timeout", "wall_time": args.timeout}
+
+    if queue.empty():
+        return {"status": "crashed (exit code %s)" % process.exitcode}
+
+    return queue.get()
+
+##----------------------------------MAIN------------------------------------##
+
+def parseArguments(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 20, 40])
+    parser.add_argument("--density", type=float, default=0.1)
+    parser.add_argument("--slip", type=float, default=0.1)
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--solvers", nargs="+", default=list(SOLVERS),
+                        choices=SOLVERS)
+    parser.add_argument("--gamma", type=float, default=0.95)
+    parser.add_argument("--epsilon", type=float, default=0.001)
+    parser.add_argument("--max-iter", type=int, default=10000)
+    parser.add_argument("--rtdp-trials", type=int, default=1000)
+    parser.add_argument("--uct-trials", type=int, default=1000)
+    parser.add_argument("--uct-horizon", type=int, default=100,
+                        help="maximum length of a UCT trial")
+    parser.add_argument("--max-depth", type=int, default=1000,
+                        help="maximum length of an RTDP/LRTDP trial")
+    parser.add_argument("--timeout", type=float, default=600,
+                        help="seconds allowed to each run")
+    parser.add_argument("--csv", help="write the results to this CSV file")
+    parser.add_argument("--json", help="write the results to this JSON file")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+
+    args = parseArguments(argv)
+    rows = []
+
+    for N in args.sizes:
+        for seed in args.seeds:
+
+            maze = {"N": N, "seed": seed, "slip": args.slip,
+                    "obstacles": randomObstacles(N, N, args.density, seed)}
+
+            # reference: V*(s0) with a tight VI on the compact model
+            model = compactModel(N, N, 0, N*N - 1, maze["obstacles"],
+                                 slip=args.slip)
+            with open(os.devnull, "w") as devnull, \
+                 contextlib.redirect_stdout(devnull):
+                vstar = float(VI(model, args.gamma, 1e-6, 100000,
+                                 np.zeros(model.nStates))[1][0])
+
+            for solver in args.solvers:
+
+                row = dict.fromkeys(FIELDS, "")
+                row.update(solver=solver, size=N, density=args.density,
+                           slip=args.slip, seed=seed, gamma=args.gamma,
+                           vstar_s0=vstar)
+                row.update(runIsolated(solver, maze, args))
+                if row["value_s0"] != "":
+                    row["gap"] = row["value_s0"] - vstar
+
+                rows.append(row)
+                print("%-6s %4dx%-4d seed=%-3d %-8s %8.3fs  V(s0)=%s  V*(s0)=%.4f"
+                      % (solver, N, N, seed, row["status"], row["wall_time"],
+                         row["value_s0"], vstar))
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -47,15 +47,25 @@ for i in range(0,n_states):
 """    
 
 
+# Lazy model -----------------------------------------------------------------
+"""
+The trial based solvers can also work on a generative model that only 
+instantiates the states they visit:
+
+from SSP_obstaclesModel import GenerativeModel
+model = GenerativeModel(3, 4, 0, 11, [2, 9])
+RTDP(model.s0, discount, maxTrials)
+"""
+
 # UCT ------------------------------------------------------------------------
 
 
 maxTrials = 50
-Graph = UCT_like(states[0], maxTrials)
+tree = UCT_like(states[0], maxTrials, asTree=True)
+print("UCT: best action in s0 ->", tree.bestAction(states[0]))
 
 """
 leer paper
 crear github
-intentar no instanciar todos los estados, sol cuando sea necesario
 fix the closed LRTD
 """
@@ -0,0 +1,64 @@
+"""
+The trial-based solvers stop close to their deadline, even on a maze where
+the greedy policy "Stays" away from the goal and maxDepth is None, so that a
+single trial never ends by itself (see Anytime.py).
+
+Usage:
+    python -m pytest tests
+"""
+
+##-------------------------------LIBRARIES----------------------------------##
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import pytest
+
+from SSP_obstaclesModel import GenerativeModel, randomObstacles
+from Anytime import Deadline, NEVER
+from RealTimeDP import RTDP
+from LabeledRTDP import LRTDP
+from UCT import UCT_like
+
+BUDGET = 0.05            # seconds given to the solvers
+OVERRUN = 0.02           # largest overrun accepted
+
+SOLVERS = {
+    "RTDP" : lambda s0, deadline, stats: RTDP(s0, 0.95, None, seed=0,
+                                              deadline=deadline,
+                                              stats=stats),
+    "LRTDP": lambda s0, deadline, stats: LRTDP(s0, 0.95, 1e-4, seed=0,
+                                               deadline=deadline,
+                                               stats=stats),
+    "UCT"  : lambda s0, deadline, stats: UCT_like(s0, None, seed=0,
+                                                  gamma=0.95,
+                                                  horizon=10**9,
+                                                  deadline=deadline,
+                                                  stats=stats),
+}
+
+##----------------------------------TESTS-----------------------------------##
+
+@pytest.mark.parametrize("solver", sorted(SOLVERS))
+def test_overrun_is_bounded(solver):
+
+    obstacles = randomObstacles(20, 20, 0.15, seed=1)
+    s0 = GenerativeModel(20, 20, 0, 399, obstacles).s0
+    stats = {}
+
+    start = time.monotonic()
+    SOLVERS[solver](s0, Deadline(seconds=BUDGET), stats)
+    elapsed = time.monotonic() - start
+
+    assert stats["stop"] == "deadline"
+    assert elapsed < BUDGET + OVERRUN
+
+
+def test_no_deadline_never_expires():
+
+    assert Deadline.of(None) is NEVER
+    assert not NEVER.expired()
+    assert Deadline.of(0).expired()